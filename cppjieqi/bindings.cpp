@@ -9,6 +9,7 @@
 #include <memory>
 #include <unordered_map>
 #include <mutex>
+#include <atomic>
 
 // Forward declaration of necessary functions from the codebase
 extern short pstglobal[5][123][256];
@@ -41,6 +42,11 @@ public:
         histories.erase(id);
     }
 
+    size_t size() {
+        std::lock_guard<std::mutex> lock(mtx);
+        return boards.size();
+    }
+
     board::AIBoard5* get_board(uint64_t id) {
         std::lock_guard<std::mutex> lock(mtx);
         auto it = boards.find(id);
@@ -59,6 +65,29 @@ private:
 
 AIManager ai_manager;
 
+// Engine counters summed over every search and evaluation since the module was loaded, for engine_stats()
+struct EngineCounters {
+    std::atomic<uint64_t> searches{0};
+    std::atomic<uint64_t> evaluations{0};
+    std::atomic<uint64_t> nodes{0};
+    std::atomic<uint64_t> tt_probes{0};
+    std::atomic<uint64_t> tt_hits{0};
+};
+
+EngineCounters engine_counters;
+
+void begin_search(board::AIBoard5* thinker) {
+    thinker->nodes = thinker->tt_probes = thinker->tt_hits = 0;
+    thinker->completed_depth = 0;
+}
+
+void end_search(board::AIBoard5* thinker, bool evaluation) {
+    (evaluation ? engine_counters.evaluations : engine_counters.searches)++;
+    engine_counters.nodes += thinker->nodes;
+    engine_counters.tt_probes += thinker->tt_probes;
+    engine_counters.tt_hits += thinker->tt_hits;
+}
+
 // Function to initialize necessary components
 void initialize_engine() {
     // No longer needed for AIBoard5 as it seems to manage its own memory or doesn't use a global tptable
@@ -106,9 +135,10 @@ void set_board(uint64_t game_id, const std::string& board_json_str, bool is_red_
     memcpy(setup_board.state_black, setup_board.state_red, 257);
     setup_board.rotate(setup_board.state_black);
     
-    // These methods belong to Board, not AIBoard5
-    setup_board.GenerateRandomMap();
-    setup_board.initialize_di();
+    // These methods belong to Board, not AIBoard5. The identities of the covered pieces are unknown
+    // here, so DI holds every piece not yet revealed rather than a random draw: the same board always
+    // gets the same evaluation.
+    setup_board.initialize_di_unknown();
 
     // Now, transfer the state to the persistent AIBoard5 instance
     ai_board_instance->turn = is_red_turn;
@@ -127,19 +157,58 @@ void set_board(uint64_t game_id, const std::string& board_json_str, bool is_red_
     ai_board_instance->Scan();
 }
 
-std::string get_ai_move_stateful(uint64_t game_id, int depth) {
+// Converts a move in the side-to-move's coordinates to UCCI from red's perspective
+std::string red_perspective_ucci(bool is_red_turn, unsigned char src, unsigned char dst) {
+    if (!src && !dst) {
+        return "";
+    }
+    if (!is_red_turn) {
+        src = 254 - src;
+        dst = 254 - dst;
+    }
+    char ucci[5];
+    board::Board::Translate(src, dst, ucci);
+    return std::string(ucci);
+}
+
+std::string get_ai_move_stateful(uint64_t game_id, int depth, pybind11::object progress, int movetime) {
     board::AIBoard5* thinker = ai_manager.get_board(game_id);
     if (!thinker) {
         return "ERROR:Invalid game ID";
     }
 
     bool is_red_turn = thinker->turn;
+    thinker->movetime = movetime;
+
+    // progress(depth, score, move, time_ms) is called from the search after every completed depth.
+    // The search runs without the GIL, so the callback re-acquires it.
+    if (!progress.is_none()) {
+        thinker->on_depth = [progress, is_red_turn](int d, short score, unsigned char src, unsigned char dst, int ms) {
+            pybind11::gil_scoped_acquire acquire;
+            try {
+                progress(d, score, red_perspective_ucci(is_red_turn, src, dst), ms);
+            } catch (pybind11::error_already_set& e) {
+                e.discard_as_unraisable("get_ai_move progress callback");
+            }
+        };
+    }
 
     // The thinker is already set up with the correct state.
     // We need to create a temporary thinker instance for the search,
     // or make the Think method const.
     // For now, we will just call Think on the existing instance.
-    std::string best_move_ucci = thinker->Think(depth);
+    std::string best_move_ucci;
+    {
+        // Release the GIL so other Python threads (e.g. progress streaming) keep running during the search
+        pybind11::gil_scoped_release release;
+        begin_search(thinker);
+        best_move_ucci = thinker->Think(depth);
+        end_search(thinker, false);
+    }
+    thinker->on_depth = nullptr;
+    if (thinker->stop) {
+        return "ERROR:Stopped";
+    }
 
     if (best_move_ucci.rfind("ERROR", 0) == 0 || best_move_ucci.length() != 4) {
         return best_move_ucci; // Return error or invalid move string
@@ -166,6 +235,17 @@ std::string get_ai_move_stateful(uint64_t game_id, int depth) {
     return best_move_ucci;
 }
 
+// Sets (or with stop=false clears) the stop flag of a game. A running get_ai_move returns "ERROR:Stopped"
+// within milliseconds; a flag set before the search starts aborts it immediately.
+bool stop_search(uint64_t game_id, bool stop) {
+    board::AIBoard5* thinker = ai_manager.get_board(game_id);
+    if (!thinker) {
+        return false;
+    }
+    thinker->stop = stop;
+    return true;
+}
+
 int get_board_evaluation_stateful(uint64_t game_id) {
     board::AIBoard5* board_eval = ai_manager.get_board(game_id);
      if (!board_eval) {
@@ -190,6 +270,58 @@ int get_board_evaluation_stateful(uint64_t game_id) {
     return score_val;
 }
 
+// Shallow search of about budget_ms milliseconds for the advantage bar: quiescence first, then
+// deeper iterations. The budget is counted in nodes on the game's own transposition table, so the
+// same position always gets the same result unless the wall-clock safety limit cut the search
+// short (search_info(game_id)["exact"] is False then). Returns (score, depth reached), the score
+// relative to the side to move; depth -1 means only the static evaluation finished.
+pybind11::tuple evaluate_stateful(uint64_t game_id, int budget_ms) {
+    board::AIBoard5* thinker = ai_manager.get_board(game_id);
+    if (!thinker) {
+        return pybind11::make_tuple(0, -1);
+    }
+    short score = 0;
+    int depth = -1;
+    {
+        pybind11::gil_scoped_release release;
+        begin_search(thinker);
+        score = mtd_evaluate5(thinker, budget_ms, &depth);
+        end_search(thinker, true);
+    }
+    return pybind11::make_tuple(score, depth);
+}
+
+// Statistics of the last get_ai_move/evaluate of a game: completed depth, nodes and TT probes/hits;
+// exact tells whether the last evaluate ended on its node budget (a deterministic result)
+pybind11::dict search_info(uint64_t game_id) {
+    pybind11::dict info;
+    board::AIBoard5* thinker = ai_manager.get_board(game_id);
+    if (!thinker) {
+        return info;
+    }
+    info["depth"] = thinker->completed_depth;
+    info["nodes"] = thinker->nodes;
+    info["tt_probes"] = thinker->tt_probes;
+    info["tt_hits"] = thinker->tt_hits;
+    info["exact"] = thinker->eval_exact;
+    return info;
+}
+
+// Process-wide engine counters and the fill rate of the shared transposition table
+pybind11::dict engine_stats() {
+    pybind11::dict stats;
+    stats["searches"] = engine_counters.searches.load();
+    stats["evaluations"] = engine_counters.evaluations.load();
+    stats["nodes"] = engine_counters.nodes.load();
+    stats["tt_probes"] = engine_counters.tt_probes.load();
+    stats["tt_hits"] = engine_counters.tt_hits.load();
+    stats["tt_entries"] = (uint64_t)TP5_SCORE_SIZE;
+    stats["tt_fill"] = tp_table5.Fill();
+    stats["tt_shared"] = tp_table5.Shared();
+    stats["games"] = ai_manager.size();
+    return stats;
+}
+
 
 PYBIND11_MODULE(cppjieqi, m) {
     m.doc() = "pybind11 plugin for Jieqi AI engine";
@@ -202,9 +334,35 @@ PYBIND11_MODULE(cppjieqi, m) {
           pybind11::arg("board_str"),
           pybind11::arg("is_red_turn"),
           pybind11::arg("history"));
-    m.def("get_ai_move", &get_ai_move_stateful, "Gets the best move from the AI engine for a given game",
+    m.def("get_ai_move", &get_ai_move_stateful, "Gets the best move from the AI engine for a given game. "
+          "If given, progress(depth, score, move, time_ms) is called after every completed iterative-deepening depth. "
+          "depth caps the iterative deepening, no deeper depth is started once movetime milliseconds have passed",
+          pybind11::arg("game_id"),
+          pybind11::arg("depth") = 8,
+          pybind11::arg("progress") = pybind11::none(),
+          pybind11::arg("movetime") = 15000);
+    m.def("stop", &stop_search, "Aborts the running search of a game (stop=False clears the flag before the next search)",
           pybind11::arg("game_id"),
-          pybind11::arg("depth") = 8);
+          pybind11::arg("stop") = true);
     m.def("get_board_evaluation", &get_board_evaluation_stateful, "Gets the static evaluation of the board for a given game",
           pybind11::arg("game_id"));
+    m.def("evaluate", &evaluate_stateful, "Searches the position for at most budget_ms milliseconds and returns "
+          "(score, depth): the score relative to the side to move and the deepest completed depth "
+          "(0 = quiescence only, -1 = static evaluation)",
+          pybind11::arg("game_id"),
+          pybind11::arg("budget_ms") = 10);
+    m.def("attach_shared_tt", [](const std::string& name) { return tp_table5.AttachShared(name.c_str()); },
+          "Moves the engine transposition table into the POSIX shared memory segment name (e.g. \"/jieqi-tt\"), "
+          "creating it if needed, so all processes attaching the same name share one table. Only get_ai_move uses it: "
+          "bounds left by other processes' searches of other roots are approximate and speed up the search without "
+          "guaranteeing the cold-table result, while evaluate uses each game's own table. Call before any search; "
+          "returns False (keeping the private table) if shared memory is unavailable or the segment is incompatible",
+          pybind11::arg("name"));
+    m.def("detach_shared_tt", [](bool unlink) { tp_table5.DetachShared(unlink); },
+          "Switches back to an empty private transposition table, unlink=True also removes the shared segment",
+          pybind11::arg("unlink") = false);
+    m.def("search_info", &search_info, "Returns {depth, nodes, tt_probes, tt_hits} of the last get_ai_move/evaluate of a game",
+          pybind11::arg("game_id"));
+    m.def("engine_stats", &engine_stats, "Returns process-wide engine counters (searches, evaluations, nodes, "
+          "tt_probes, tt_hits) and the transposition table size and fill rate");
 }
@@ -765,6 +765,104 @@ void board::AIBoard4::CopyData(const unsigned char di[VERSION_MAX][2][123]){
     CalcVersion(0);
 }
 
+void board::AIBoard4::InitializeWorkers(int num_threads){
+    //工作线程副本在本线程构造(构造函数会写_dir和全局注册表), 之后只在搜索时读
+    if(num_threads <= 0 || (pool && pool -> Size() == num_threads)){
+        return;
+    }
+    pool.reset();
+    workers.clear();
+    worker_tptables.clear();
+    for(int i = 0; i < num_threads; ++i){
+        worker_tptables.emplace_back(MAX_ZOBRIST_WORKER);
+        workers.emplace_back(new AIBoard4(original_turn ? state_red : state_black, original_turn, round, aidi, score, worker_tptables.back().data(), hist));
+        workers.back() -> tpmask = MAX_ZOBRIST_WORKER - 1;
+        memcpy(workers.back() -> zobrist, zobrist, sizeof(zobrist));
+        copy_pst(workers.back() -> pst, pst);
+    }
+    pool.reset(new ThreadPool4(num_threads));
+}
+
+void board::AIBoard4::SyncFrom(const AIBoard4* another){
+    //只复制搜索需要的状态, cache/score_cache中是another当前路径以上的悔棋信息, 副本不会退回到那里
+    memcpy(state_red, another -> state_red, sizeof(state_red));
+    memcpy(state_black, another -> state_black, sizeof(state_black));
+    memcpy(aiaverage, another -> aiaverage, sizeof(aiaverage));
+    memcpy(aisumall, another -> aisumall, sizeof(aisumall));
+    memcpy(aidi, another -> aidi, sizeof(aidi));
+    memcpy(original_turns, another -> original_turns, sizeof(original_turns));
+    turn = another -> turn;
+    round = another -> round;
+    version = another -> version;
+    ply = another -> ply;
+    score = another -> score;
+    zobrist_hash = another -> zobrist_hash;
+    zobrist_cache = another -> zobrist_cache;
+    hist = another -> hist;
+    lastinserts.clear();
+    cache = decltype(cache)();
+    score_cache = decltype(score_cache)();
+    moves.clear();
+    Scan();
+}
+
+board::ThreadPool4::ThreadPool4(int num_threads): _next(0){
+    for(int i = 0; i < num_threads; ++i){
+        _threads.emplace_back(&ThreadPool4::_loop, this, i);
+    }
+}
+
+board::ThreadPool4::~ThreadPool4(){
+    {
+        std::lock_guard<std::mutex> lock(_mutex);
+        _stop = true;
+    }
+    _cv_start.notify_all();
+    for(auto& t : _threads){
+        t.join();
+    }
+}
+
+void board::ThreadPool4::Run(int num_tasks, const std::function<void(int, int)>& task){
+    if(num_tasks <= 0){
+        return;
+    }
+    std::unique_lock<std::mutex> lock(_mutex);
+    _task = &task;
+    _num_tasks = num_tasks;
+    _next = 0;
+    _running = (int)_threads.size();
+    ++_generation;
+    _cv_start.notify_all();
+    _cv_done.wait(lock, [this](){ return _running == 0; });
+    _task = NULL;
+}
+
+void board::ThreadPool4::_loop(int worker_id){
+    uint64_t generation = 0;
+    while(true){
+        const std::function<void(int, int)>* task = NULL;
+        int num_tasks = 0;
+        {
+            std::unique_lock<std::mutex> lock(_mutex);
+            _cv_start.wait(lock, [this, generation](){ return _stop || _generation != generation; });
+            if(_stop){
+                return;
+            }
+            generation = _generation;
+            task = _task;
+            num_tasks = _num_tasks;
+        }
+        for(int task_id = _next.fetch_add(1); task_id < num_tasks; task_id = _next.fetch_add(1)){
+            (*task)(worker_id, task_id);
+        }
+        std::lock_guard<std::mutex> lock(_mutex);
+        if(--_running == 0){
+            _cv_done.notify_one();
+        }
+    }
+}
+
 std::string board::AIBoard4::Think(int maxdepth){
     SetScoreFunction("thinker4", 2);
     return _thinker_func(this, maxdepth);
@@ -1069,6 +1167,7 @@ std::string thinker4(board::AIBoard4* bp, int maxdepth){
         size_t int_ms = (size_t)std::chrono::duration_cast<std::chrono::milliseconds>(std::chrono::high_resolution_clock::now() - start).count();
         if(score > BAN_VALUE || depth == maxdepth){
             if(depth <= 6){
+                bp -> InitializeWorkers(DOUBLE_RECURSIVE_THREADS);
                 calleval4(bp, -MATE_UPPER, MATE_UPPER, {2, 4}, true, src, dst);
             }
             bp -> Scan();
@@ -1298,23 +1397,36 @@ short alphabeta_doublerecursive4(board::AIBoard4* self, const int ver, short alp
     return best;
 }
 
-void _inner_recur(board::AIBoard4* self, const int ver, std::unordered_map<unsigned char, char>& uncertainty_dict, std::vector<unsigned char>& uncertainty_keys, \
-    std::unordered_map<std::pair<int, int>, short, myhash<int, int>>& result_dict, std::unordered_map<std::pair<int, int>, short, myhash<int, int>>& counter_dict, \
-    const int index, const int me, const int op, const short score, const short alpha, const short beta, \
-    std::vector<int>& depths, const bool nullmove, unsigned char& argmaxsrc, unsigned char& argmaxdst){
+std::pair<int64_t, int64_t> _inner_recur(board::AIBoard4* self, const int ver, std::unordered_map<unsigned char, char>& uncertainty_dict, std::vector<unsigned char>& uncertainty_keys, \
+    const int index, const short score, const short alpha, const short beta, \
+    std::vector<int>& depths, const bool nullmove, unsigned char& argmaxsrc, unsigned char& argmaxdst, std::vector<assignment4>* tasks, const int64_t weight){
+    //返回(加权分数和, 权重和)。从剩余子力中选出c的权重为选之前c的个数
+    //tasks不为空时只收集分配方案及其权重(weight为走到这里的各步权重之积), 由_parallel_recur()交给工作线程搜索
     const int THRES = 300;
     bool needclamp = false;
     if(index == 0 && uncertainty_keys.empty()){
-        result_dict[{1, 1}] += alphabeta_doublerecursive4(self, ver, alpha, beta, depths, ROOT, nullmove, nullmove, uncertainty_dict, &needclamp, argmaxsrc, argmaxdst);
-        counter_dict[{1, 1}] += 1;
-        return;
+        short res = alphabeta_doublerecursive4(self, ver, alpha, beta, depths, ROOT, nullmove, nullmove, uncertainty_dict, &needclamp, argmaxsrc, argmaxdst);
+        return {res, 1};
     }
+    std::pair<int64_t, int64_t> ret = {0, 0};
     if((size_t)index >= uncertainty_keys.size()){
+        if(tasks){
+            const char* state_pointer = self -> turn ? self -> state_red : self -> state_black;
+            assignment4 task;
+            task.pieces.reserve(uncertainty_keys.size());
+            for(const unsigned char key : uncertainty_keys){
+                task.pieces.push_back(state_pointer[key]);
+            }
+            memcpy(task.aidi, self -> aidi[ver], sizeof(task.aidi));
+            task.weight = weight;
+            task.score = score;
+            tasks -> push_back(std::move(task));
+            return ret;
+        }
         self -> score = score;
         self -> CalcVersion(ver);
         short res =  alphabeta_doublerecursive4(self, ver, alpha, beta, depths, ROOT, nullmove, nullmove, uncertainty_dict, &needclamp, argmaxsrc, argmaxdst);
-        result_dict[{me, op}] += ((needclamp && res >= THRES) ? THRES : res);
-        counter_dict[{me, op}] += 1;
+        ret = {((needclamp && res >= THRES) ? THRES : res), 1};
     }else{
         bool turn = self -> turn, notturn = !self -> turn;
         char* state_pointer = turn ? self -> state_red : self -> state_black;
@@ -1326,16 +1438,19 @@ void _inner_recur(board::AIBoard4* self, const int ver, std::unordered_map<unsig
                 for(char c : MINGZI){
                     int intchar = turn ? (int)c : ((int)c) ^ 32;
                     if(self -> aidi[ver][turn][intchar] > 0){
+                        const int64_t w = self -> aidi[ver][turn][intchar];
                         --self -> aidi[ver][turn][intchar];
-                        uint32_t zobrist_before = self -> zobrist_hash;
+                        uint64_t zobrist_before = self -> zobrist_hash;
                         int zobrist_key = turn ? key : 254 - key;
                         self -> zobrist_hash ^= self -> zobrist[(int)self -> state_red[zobrist_key]][zobrist_key];
                         state_pointer[key] = c;
                         state_pointer_oppo[254 - key] = self -> swapcase(c);
                         self -> zobrist_hash ^= self -> zobrist[(int)self -> state_red[zobrist_key]][zobrist_key];
                         short score_diff = self -> pst[(int)c][key] - self -> aiaverage[ver-1][turn][1][key];
-                        _inner_recur(self, ver, uncertainty_dict, uncertainty_keys, result_dict, counter_dict, index+1, me*(self -> aidi[ver][turn][intchar] + 1), op, score + score_diff/2, alpha, beta, depths, \
-                            nullmove, argmaxsrc, argmaxdst);
+                        auto sub = _inner_recur(self, ver, uncertainty_dict, uncertainty_keys, index+1, score + score_diff/2, alpha, beta, depths, \
+                            nullmove, argmaxsrc, argmaxdst, tasks, weight * w);
+                        ret.first += w * sub.first;
+                        ret.second += w * sub.second;
                         state_pointer[key] = 'U';
                         state_pointer_oppo[254 - key] = 'u';
                         self -> zobrist_hash = zobrist_before;
@@ -1349,16 +1464,19 @@ void _inner_recur(board::AIBoard4* self, const int ver, std::unordered_map<unsig
                 for(char c: MINGZI){
                     int intchar = notturn ? (int)c : ((int)c) ^ 32;
                     if(self -> aidi[ver][notturn][intchar] > 0){
+                        const int64_t w = self -> aidi[ver][notturn][intchar];
                         --self -> aidi[ver][notturn][intchar];
-                        uint32_t zobrist_before = self -> zobrist_hash;
+                        uint64_t zobrist_before = self -> zobrist_hash;
                         int zobrist_key = turn ? key : 254 - key;
                         self -> zobrist_hash ^= self -> zobrist[(int)self -> state_red[zobrist_key]][zobrist_key];
                         state_pointer[key] = self -> swapcase(c);
                         state_pointer_oppo[254 - key] = c;
                         self -> zobrist_hash ^= self -> zobrist[(int)self -> state_red[zobrist_key]][zobrist_key];
                         short score_diff = self -> pst[(int)c][254 - key] - self -> aiaverage[ver-1][notturn][1][254 - key];
-                        _inner_recur(self, ver, uncertainty_dict, uncertainty_keys, result_dict, counter_dict, index+1, me, op*(self -> aidi[ver][notturn][intchar] + 1), score-score_diff/2, alpha, beta, depths, \
-                            nullmove, argmaxsrc, argmaxdst);
+                        auto sub = _inner_recur(self, ver, uncertainty_dict, uncertainty_keys, index+1, score-score_diff/2, alpha, beta, depths, \
+                            nullmove, argmaxsrc, argmaxdst, tasks, weight * w);
+                        ret.first += w * sub.first;
+                        ret.second += w * sub.second;
                         state_pointer[key] = 'u';
                         state_pointer_oppo[254 - key] = 'U';
                         self -> zobrist_hash = zobrist_before;
@@ -1369,6 +1487,58 @@ void _inner_recur(board::AIBoard4* self, const int ver, std::unordered_map<unsig
             }
         }//逐步展开暗子
     }
+    return ret;
+}
+
+std::pair<int64_t, int64_t> _parallel_recur(board::AIBoard4* self, const int ver, std::unordered_map<unsigned char, char>& uncertainty_dict, std::vector<unsigned char>& uncertainty_keys, \
+    const short alpha, const short beta, std::vector<int>& depths, const bool nullmove){
+    //先在本线程枚举全部分配方案, 再由每个工作线程在自己的棋盘副本上搜索, 结果写入各自的下标, 最后按权重汇总
+    const int THRES = 300;
+    std::vector<assignment4> tasks;
+    unsigned char x = 0, y = 0;
+    _inner_recur(self, ver, uncertainty_dict, uncertainty_keys, 0, self -> score, alpha, beta, depths, nullmove, x, y, &tasks);
+    if(!tasks.empty()){
+        for(auto& worker : self -> workers){
+            worker -> SyncFrom(self);
+        }
+    }
+    std::vector<short> results(tasks.size(), 0);
+    self -> pool -> Run((int)tasks.size(), [&](int worker_id, int task_id){
+        board::AIBoard4* bp = self -> workers[worker_id].get();
+        const assignment4& task = tasks[task_id];
+        const bool turn = bp -> turn;
+        char* state_pointer = turn ? bp -> state_red : bp -> state_black;
+        char* state_pointer_oppo = turn ? bp -> state_black : bp -> state_red;
+        const uint64_t zobrist_before = bp -> zobrist_hash;
+        for(size_t k = 0; k < uncertainty_keys.size(); ++k){
+            const unsigned char key = uncertainty_keys[k];
+            const int zobrist_key = turn ? key : 254 - key;
+            bp -> zobrist_hash ^= bp -> zobrist[(int)bp -> state_red[zobrist_key]][zobrist_key];
+            state_pointer[key] = task.pieces[k];
+            state_pointer_oppo[254 - key] = bp -> swapcase(task.pieces[k]);
+            bp -> zobrist_hash ^= bp -> zobrist[(int)bp -> state_red[zobrist_key]][zobrist_key];
+        }
+        memcpy(bp -> aidi[ver], task.aidi, sizeof(task.aidi));
+        bp -> score = task.score;
+        bp -> CalcVersion(ver);
+        std::vector<int> depths_copy = depths;
+        bool needclamp = false;
+        unsigned char t1 = 0, t2 = 0;
+        short res = alphabeta_doublerecursive4(bp, ver, alpha, beta, depths_copy, ROOT, nullmove, nullmove, uncertainty_dict, &needclamp, t1, t2);
+        results[task_id] = ((needclamp && res >= THRES) ? THRES : res);
+        for(const unsigned char key : uncertainty_keys){
+            const char c = uncertainty_dict.find(key) -> second;
+            state_pointer[key] = c;
+            state_pointer_oppo[254 - key] = bp -> swapcase(c);
+        }
+        bp -> zobrist_hash = zobrist_before;
+    });
+    std::pair<int64_t, int64_t> ret = {0, 0};
+    for(size_t i = 0; i < tasks.size(); ++i){
+        ret.first += tasks[i].weight * results[i];
+        ret.second += tasks[i].weight;
+    }
+    return ret;
 }
 
 
@@ -1376,8 +1546,6 @@ short eval4(board::AIBoard4* self, const int ver, const short alpha, const short
     self -> original_turns[ver] = self -> turn;
     std::unordered_map<unsigned char, char> uncertainty_dict;
     std::vector<unsigned char> uncertainty_keys;
-    std::unordered_map<std::pair<int, int>, short, myhash<int, int>> result_dict;
-    std::unordered_map<std::pair<int, int>, short, myhash<int, int>> counter_dict;
     const char* state_pointer = self -> turn ? self -> state_red : self -> state_black;
     bool needclamp = false;
     std::unordered_map<unsigned char, char> empty_map;
@@ -1400,16 +1568,15 @@ short eval4(board::AIBoard4* self, const int ver, const short alpha, const short
             }
         }
         unsigned char x = 0, y = 0;
-        _inner_recur(self, ver, uncertainty_dict, uncertainty_keys, result_dict, counter_dict, 0, 1, 1, self -> score, alpha, beta, depths, nullmove, x, y);
-        int nu = 0, de = 0; //numerator, denominator;
-        for(auto it = result_dict.begin(); it != result_dict.end(); ++it){
-            auto& item = it -> first;
-            auto combinations = item.first * item.second;
-            nu += (self -> turn == self -> original_turns[ver-1] ? 1 : -1) * (it -> second) * combinations;
-            de += counter_dict[item] * combinations;
+        std::pair<int64_t, int64_t> result; //(numerator, denominator)
+        if(self -> pool && !uncertainty_keys.empty()){
+            result = _parallel_recur(self, ver, uncertainty_dict, uncertainty_keys, alpha, beta, depths, nullmove);
+        }else{
+            result = _inner_recur(self, ver, uncertainty_dict, uncertainty_keys, 0, self -> score, alpha, beta, depths, nullmove, x, y);
         }
+        const int64_t nu = (self -> turn == self -> original_turns[ver-1] ? 1 : -1) * result.first;
         self -> score = scoretmp;
-        return self -> div(nu, de);
+        return (short)self -> div<int64_t>(nu, result.second);
     }
     return 0;
 }
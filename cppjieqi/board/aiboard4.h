@@ -39,6 +39,11 @@ extern unsigned char L1[256][256];
 #include <stdio.h>
 #include <ctype.h>
 #include <stack>
+#include <memory>
+#include <thread>
+#include <mutex>
+#include <atomic>
+#include <condition_variable>
 #include <math.h>
 #include <time.h>
 #include <stdlib.h>
@@ -68,6 +73,8 @@ extern unsigned char L1[256][256];
 #define SELFMASK ((self -> turn) ? SELFMASKRED : SELFMASKBLACK)
 #define MAX_ZOBRIST 4194304
 #define MASK_ZOBRIST (MAX_ZOBRIST - 1)
+#define MAX_ZOBRIST_WORKER (MAX_ZOBRIST >> 4) //工作线程副本的置换表大小
+#define DOUBLE_RECURSIVE_THREADS 4 //展开暗子时的工作线程数, 0为单线程
 #define MATE_UPPER 2600
 #define WIN_VALUE 2500
 #define BAN_VALUE 2550
@@ -227,6 +234,41 @@ struct scoretuple{
     unsigned char dst;
 };
 
+//展开暗子的一种分配方案, 由工作线程在棋盘副本上搜索
+struct assignment4{
+    std::vector<char> pieces; //按uncertainty_keys顺序, 走子方视角下的棋子
+    unsigned char aidi[2][123];
+    int64_t weight; //这种分配方案的权重, 即选子时各步剩余个数之积
+    short score;
+};
+
+namespace board{
+//固定线程数的线程池, Run()把任务分给工作线程并等待全部完成
+class ThreadPool4{
+public:
+    explicit ThreadPool4(int num_threads);
+    ThreadPool4(const ThreadPool4&) = delete;
+    ~ThreadPool4();
+    int Size() const{
+        return (int)_threads.size();
+    }
+    //对task_id = 0..num_tasks-1调用task(worker_id, task_id)
+    void Run(int num_tasks, const std::function<void(int, int)>& task);
+private:
+    std::vector<std::thread> _threads;
+    std::mutex _mutex;
+    std::condition_variable _cv_start;
+    std::condition_variable _cv_done;
+    const std::function<void(int, int)>* _task = NULL;
+    std::atomic<int> _next;
+    int _num_tasks = 0;
+    int _running = 0;
+    uint64_t _generation = 0;
+    bool _stop = false;
+    void _loop(int worker_id);
+};
+}
+
 namespace board{
 class AIBoard4 : public Thinker{
 public:
@@ -278,6 +320,10 @@ public:
     std::stack<gameinfo> score_cache;
     std::unordered_set<uint64_t> zobrist_cache;
     tp* tptable; //
+    uint64_t tpmask = MASK_ZOBRIST;
+    std::vector<std::unique_ptr<AIBoard4>> workers; //展开暗子用的棋盘副本, 每个工作线程一个
+    std::vector<std::vector<tp>> worker_tptables;
+    std::unique_ptr<ThreadPool4> pool;
     std::unordered_map<std::string, bool>* hist; //
     std::unordered_map<std::string, std::pair<unsigned char, unsigned char>> kaijuku;
     std::unordered_map<std::pair<uint64_t, int>, debugtuple, myhash<uint64_t, int>> moves;
@@ -305,6 +351,8 @@ public:
     bool ExecutedDebugger(bool *oppo_mate);
     bool Ismate_After_Move(unsigned char src, unsigned char dst);
     void CalcVersion(const int ver);
+    void InitializeWorkers(int num_threads);
+    void SyncFrom(const AIBoard4* another);
     void CopyData(const unsigned char di[VERSION_MAX][2][123]);
     virtual std::string Think(int maxdepth);
     void PrintPos(bool turn) const;
@@ -436,7 +484,7 @@ public:
     };
 
     void RecordHash(int depth, int val, int score, int hashf, unsigned char src, unsigned char dst, int recordplace){
-        tp* phashe = tptable + (int)(MASK & MASK_ZOBRIST);
+        tp* phashe = tptable + (int)(MASK & tpmask);
         bool originnull = false, movenotnull = (src != 0 && dst != 0);
         if(phashe -> key == zobrist_hash && phashe -> turn == turn){
             //原先的HashItem存在的情况
@@ -491,7 +539,7 @@ public:
             return -MATE_UPPER;
         }
         *hashnode = NULL;
-        tp* phashe = tptable + (int)(MASK & MASK_ZOBRIST);
+        tp* phashe = tptable + (int)(MASK & tpmask);
         if(phashe -> key == zobrist_hash && phashe -> turn == turn){
             *hashnode = phashe;
             bool originnull = (phashe -> src == 0 || phashe -> dst == 0);
@@ -620,10 +668,9 @@ void complicated_kongtoupao_score_function4(board::AIBoard4* bp, short* kongtoup
 short complicated_score_function4(board::AIBoard4* self, const char* state_pointer, unsigned char src, unsigned char dst);
 short alphabeta4(board::AIBoard4* self, const short alpha, const short beta, int depth, int type, const bool nullmove, const bool nullmovenow, unsigned char& src, unsigned char& dst);
 short alphabeta_doublerecursive4(board::AIBoard4* self, const int ver, short alpha, short beta, std::vector<int>& depths, const int type, const bool nullmove, const bool nullmovenow, std::unordered_map<unsigned char, char>& uncertainty_dict, bool* needclamp, unsigned char& argmaxsrc, unsigned char& argmaxdst);
-void _inner_recur(board::AIBoard4* self, const int ver, std::unordered_map<unsigned char, char>& uncertainty_dict, std::vector<unsigned char>& uncertainty_keys, \
-    std::unordered_map<std::pair<int, int>, short, myhash<int, int>>& result_dict, std::unordered_map<std::pair<int, int>, short, myhash<int, int>>& counter_dict, \
-    const int index, const int me, const int op, const short score, const short alpha, const short beta, \
-    std::vector<int>& depths, const bool nullmove, unsigned char& argmaxsrc, unsigned char& argmaxdst);
+std::pair<int64_t, int64_t> _inner_recur(board::AIBoard4* self, const int ver, std::unordered_map<unsigned char, char>& uncertainty_dict, std::vector<unsigned char>& uncertainty_keys, \
+    const int index, const short score, const short alpha, const short beta, \
+    std::vector<int>& depths, const bool nullmove, unsigned char& argmaxsrc, unsigned char& argmaxdst, std::vector<assignment4>* tasks = NULL, const int64_t weight = 1);
 short eval4(board::AIBoard4* self, const int ver, const short alpha, const short beta, std::vector<int>& depths, const bool nullmove, unsigned char& argmaxsrc, unsigned char& argmaxdst);
 short calleval4(board::AIBoard4* self, short alpha, short beta, std::vector<int> depths, const bool nullmove, unsigned char& argmaxsrc, unsigned char& argmaxdst);
 void debugset(board::AIBoard4* self);
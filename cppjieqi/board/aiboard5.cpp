@@ -3,24 +3,12 @@
 #include <ctype.h>
 #include "../global/global.h"
 #include "../score/score.h"
-
-
-namespace board {
-    // Helper function to convert the internal 256-char board representation
-    // to the 90-char web/history representation for consistent lookups.
-    std::string internal_to_web(const char* internal_board) {
-        std::string web_string;
-        web_string.reserve(90);
-        for (int r = 0; r < 10; ++r) {
-            for (int c = 0; c < 9; ++c) {
-                // This logic mirrors the web->internal conversion
-                int internal_pos = 195 - 16 * r + c;
-                web_string += internal_board[internal_pos];
-            }
-        }
-        return web_string;
-    }
-}
+#ifndef WIN32
+#include <fcntl.h>
+#include <sys/mman.h>
+#include <sys/stat.h>
+#include <unistd.h>
+#endif
 
 
 #define TXY(x, y) (unsigned char)translate_x_y(x, y)
@@ -100,9 +88,91 @@ const std::unordered_map<std::string, std::string> board::AIBoard5::_uni_pieces
 };
 
 char board::AIBoard5::_dir[91][8] = {{0}};
+std::once_flag board::AIBoard5::_static_once;
 std::unordered_map<std::string, SCORE5> score_bean5;
 std::unordered_map<std::string, KONGTOUPAO_SCORE5> kongtoupao_score_bean5;
 std::unordered_map<std::string, THINKER5> thinker_bean5;
+board::TranspositionTable5 tp_table5;
+
+board::TranspositionTable5::TranspositionTable5(uint32_t score_size, uint32_t move_size): _score_size(score_size), _move_size(move_size){
+    //calloc得到的全0内存就是空表(valid位都是0)
+    _use((std::atomic<uint64_t>*)calloc(_bytes(), 1), false);
+}
+
+board::TranspositionTable5::~TranspositionTable5(){
+    _release();
+}
+
+void board::TranspositionTable5::_use(std::atomic<uint64_t>* base, bool shared){
+    _base = base;
+    _score = base + HEADER_WORDS;
+    _move = _score + 2 * (size_t)_score_size;
+    _shared = shared;
+}
+
+void board::TranspositionTable5::_release(){
+    if(!_base){
+        return;
+    }
+    #ifndef WIN32
+    if(_shared){
+        munmap((void*)_base, _bytes());
+    }else
+    #endif
+    {
+        free((void*)_base);
+    }
+    _base = _score = _move = nullptr;
+    _shared = false;
+}
+
+bool board::TranspositionTable5::AttachShared(const char* name){
+    #ifndef WIN32
+    const int fd = shm_open(name, O_CREAT | O_RDWR, 0600);
+    if(fd < 0){
+        return false;
+    }
+    //新建的段长度为0, 由第一个进程扩展; ftruncate扩展出的部分全为0, 即空表
+    struct stat st;
+    const size_t bytes = _bytes();
+    if(fstat(fd, &st) != 0 || ((size_t)st.st_size != bytes && (st.st_size != 0 || ftruncate(fd, bytes) != 0))){
+        close(fd);
+        return false;
+    }
+    void* p = mmap(NULL, bytes, PROT_READ | PROT_WRITE, MAP_SHARED, fd, 0);
+    close(fd);
+    if(p == MAP_FAILED){
+        return false;
+    }
+    std::atomic<uint64_t>* base = (std::atomic<uint64_t>*)p;
+    uint64_t magic = 0;
+    if(!base[0].compare_exchange_strong(magic, MAGIC) && magic != MAGIC){
+        munmap(p, bytes); //其他版本的引擎创建的段
+        return false;
+    }
+    _release();
+    _use(base, true);
+    _shared_name = name;
+    return true;
+    #else
+    (void)name;
+    return false;
+    #endif
+}
+
+void board::TranspositionTable5::DetachShared(bool unlink){
+    if(!_shared){
+        return;
+    }
+    _release();
+    #ifndef WIN32
+    if(unlink){
+        shm_unlink(_shared_name.c_str());
+    }
+    #endif
+    _shared_name.clear();
+    _use((std::atomic<uint64_t>*)calloc(_bytes(), 1), false);
+}
 
 board::AIBoard5::AIBoard5() noexcept: 
                     lastinsert(false),
@@ -113,39 +183,77 @@ board::AIBoard5::AIBoard5() noexcept:
                     original_depth(0),
                     zobrist_hash(0),
                     score(0),
-                    tp_move(NULL),
-                    tp_score(NULL),
+                    tp_table(&tp_table5),
                     _kaijuku_file("../kaijuku"),
                     _myname("AI5"),
                     _has_initialized(false),
                     _score_func(NULL),
                     _kongtoupao_score_func(NULL){
-    this -> tp_move = &tp_move_bean[5];
-    this -> tp_score = &tp_score_bean[5];
     SetScoreFunction("complicated_score_function5", 0);
     SetScoreFunction("complicated_kongtoupao_score_function5", 1);
-    score_cache.push(score);
+    score_cache[0] = score;
     memset(state_red, 0, sizeof(state_red));
     memset(state_black, 0, sizeof(state_black));
     strncpy(state_red, _initial_state, _chess_board_size);
     strncpy(state_black, _initial_state, _chess_board_size);
     copy_pst(this -> pst, ::pstglobal[3]);
-    _initialize_dir();
+    memset(aidi, 0, sizeof(aidi));
+    _clear_eval_cache();
+    std::call_once(_static_once, [](){ _initialize_dir(); register_score_functions5(); });
+    _initialize_king_zone();
     _initialize_zobrist();
-    zobrist_cache.insert((zobrist_hash << 1)|original_turn);
+    bitpos.Set(state_red);
+    zobrist_cache[0] = (zobrist_hash << 1)|turn;
+    _initialize_hist_zobrist();
     Scan();
-    register_score_functions5();
     read_kaijuku(_kaijuku_file, kaijuku);
     _has_initialized = true;
 }
 
 void board::AIBoard5::Reset() noexcept {
     zobrist_hash = 0;
+    _clear_eval_cache();
     _initialize_zobrist();
-    zobrist_cache.clear();
-    zobrist_cache.insert((zobrist_hash << 1)|original_turn);
-    zobrist_repetition_counts.clear();
-    zobrist_repetition_counts[zobrist_hash]++;
+    bitpos.Set(state_red);
+    ply = 0;
+    //搜索中的score是从根节点开始按着法分数累加的, 根节点要从局面本身算出, 否则评估和置换表中的分数都只是相对根节点的;
+    //暗子按未知子的平均价值计入, 与翻子/吃暗子的着法分数一致
+    Scan();
+    score = score_rough + covered * aiaverage[version][turn?1:0][0][0] - covered_opponent * aiaverage[version][turn?0:1][0][0];
+    score_cache[0] = score;
+    zobrist_cache[0] = (zobrist_hash << 1)|turn;
+    _initialize_hist_zobrist();
+}
+
+void board::AIBoard5::_initialize_hist_zobrist(){
+    //把hist中的90字符web局面换算成zobrist, 搜索时用二分查找代替字符串比较
+    hist_zobrist.clear();
+    if(!hist){
+        return;
+    }
+    hist_zobrist.reserve(hist -> size());
+    for(const auto& it : *hist){
+        const std::string& web_board = it.first;
+        if(web_board.size() < 90){
+            continue;
+        }
+        uint32_t hash = 0;
+        for(int r = 0; r < 10; ++r){
+            for(int c = 0; c < 9; ++c){
+                const char p = web_board[r * 9 + c];
+                const int internal_pos = 195 - 16 * r + c;
+                if(::isalpha(p)){
+                    hash ^= _zobrist[(int)p][internal_pos];
+                }
+            }
+        }
+        hist_zobrist.push_back(hash);
+    }
+    std::sort(hist_zobrist.begin(), hist_zobrist.end());
+}
+
+bool board::AIBoard5::InHistory() const{
+    return std::binary_search(hist_zobrist.begin(), hist_zobrist.end(), zobrist_hash);
 }
 
 board::AIBoard5::AIBoard5(const char another_state[MAX], bool turn, int round, const unsigned char di[VERSION_MAX][2][123], short score, std::unordered_map<std::string, bool>* hist) noexcept:
@@ -157,8 +265,7 @@ board::AIBoard5::AIBoard5(const char another_state[MAX], bool turn, int round, c
                                                                                                                             original_depth(0),
                                                                                                                             zobrist_hash(0),
                                                                                                                             score(score),
-                                                                                                                            tp_move(&tp_move_bean[0]),
-                                                                                                                            tp_score(&tp_score_bean[0]),
+                                                                                                                            tp_table(&tp_table5),
                                                                                                                             hist(hist),
                                                                                                                             _kaijuku_file("../kaijuku"),
                                                                                                                             _myname("AI5"),
@@ -166,11 +273,9 @@ board::AIBoard5::AIBoard5(const char another_state[MAX], bool turn, int round, c
                                                                                                                             _score_func(NULL),
                                                                                                                             _kongtoupao_score_func(NULL){
     
-    this -> tp_move = &tp_move_bean[5];
-    this -> tp_score = &tp_score_bean[5];
     SetScoreFunction("complicated_score_function5", 0);
     SetScoreFunction("complicated_kongtoupao_score_function5", 1);
-    score_cache.push(score);
+    score_cache[0] = score;
     memset(state_red, 0, sizeof(state_red));
     memset(state_black, 0, sizeof(state_black));
     strncpy(state_red, another_state, _chess_board_size);
@@ -182,17 +287,39 @@ board::AIBoard5::AIBoard5(const char another_state[MAX], bool turn, int round, c
     }
     copy_pst(this -> pst, ::pstglobal[3]);
     CopyData(di);
-    _initialize_dir();
+    std::call_once(_static_once, [](){ _initialize_dir(); register_score_functions5(); });
+    _initialize_king_zone();
     _initialize_zobrist();
-    zobrist_cache.insert((zobrist_hash << 1)|original_turn);
+    bitpos.Set(state_red);
+    zobrist_cache[0] = (zobrist_hash << 1)|turn;
+    _initialize_hist_zobrist();
     Scan();
-    register_score_functions5();
     if(round == 0){
         read_kaijuku(_kaijuku_file, kaijuku);
     }
     _has_initialized = true;
 }
 
+void board::AIBoard5::_initialize_king_zone(){
+    //与ScanProtectors()读取的格子一致, 红黑视角下关于254-x对称
+    memset(_king_zone, false, sizeof(_king_zone));
+    const unsigned char guards[10] = {195, 203, 198, 200, 183, 51, 59, 54, 56, 71};
+    for(const unsigned char pos : guards){
+        _king_zone[pos] = true;
+    }
+    for(int x = 0; x < 4; ++x){
+        for(int y = 0; y < 5; ++y){
+            _king_zone[197 - 16 * x + y] = true; //penaltyarea
+            _king_zone[53 + 16 * x + y] = true; //penaltyareaoppo
+        }
+    }
+}
+
+void board::AIBoard5::_clear_eval_cache(){
+    memset(_scan_cache, 0, sizeof(_scan_cache));
+    memset(_protector_cache, 0, sizeof(_protector_cache));
+}
+
 void board::AIBoard5::_initialize_dir(){
     memset(_dir, 0, sizeof(_dir));
     _dir[(int)'P'][0] = NORTH;
@@ -280,10 +407,16 @@ std::string board::AIBoard5::SearchScoreFunction(int type){
 bool board::AIBoard5::Move(const unsigned char encode_from, const unsigned char encode_to, short score_step){
     const unsigned char reverse_encode_from = reverse(encode_from);
     const unsigned char reverse_encode_to = reverse(encode_to);
+    const unsigned char red_from = turn ? encode_from : reverse_encode_from;
+    const unsigned char red_to = turn ? encode_to : reverse_encode_to;
+    const char moved = state_red[red_from];
+    const char eat = state_red[red_to];
+    ++ply;
+    assert(ply < MAX_PLY);
     if(turn){
-        cache.push({encode_from, encode_to, state_red[encode_to]});
-        zobrist_hash ^= _zobrist[(int)state_red[encode_to]][encode_to];
-        zobrist_hash ^= _zobrist[(int)state_red[encode_from]][encode_from];
+        cache[ply] = std::make_tuple(encode_from, encode_to, state_red[encode_to]);
+        _toggle_zobrist(encode_to);
+        _toggle_zobrist(encode_from);
         if(state_red[encode_from] >= 'D' && state_red[encode_from] <= 'I'){
             state_red[encode_to] = 'U';
             state_red[encode_from] = '.';
@@ -295,11 +428,11 @@ bool board::AIBoard5::Move(const unsigned char encode_from, const unsigned char
             state_black[reverse_encode_to] = state_black[reverse_encode_from];
             state_black[reverse_encode_from] = '.';
         }
-        zobrist_hash ^= _zobrist[(int)state_red[encode_to]][encode_to];
+        _toggle_zobrist(encode_to);
     } else{
-        cache.push({encode_from, encode_to, state_black[encode_to]});
-        zobrist_hash ^= _zobrist[(int)state_red[reverse_encode_to]][reverse_encode_to];
-        zobrist_hash ^= _zobrist[(int)state_red[reverse_encode_from]][reverse_encode_from];
+        cache[ply] = std::make_tuple(encode_from, encode_to, state_black[encode_to]);
+        _toggle_zobrist(reverse_encode_to);
+        _toggle_zobrist(reverse_encode_from);
         if(state_black[encode_from] >= 'D' && state_black[encode_from] <= 'I'){
             state_black[encode_to] = 'U';
             state_black[encode_from] = '.';
@@ -311,44 +444,44 @@ bool board::AIBoard5::Move(const unsigned char encode_from, const unsigned char
             state_red[reverse_encode_to] = state_red[reverse_encode_from];
             state_red[reverse_encode_from] = '.';
         }
-        zobrist_hash ^= _zobrist[(int)state_red[reverse_encode_to]][reverse_encode_to];
+        _toggle_zobrist(reverse_encode_to);
     }
+    bitpos.Move(red_from, red_to, moved, state_red[red_to], eat);
     turn = !turn;
     score = -(score + score_step);
     if(turn){
        ++round;
     }
-    score_cache.push(score);
-    auto zobrist_turn = (zobrist_hash << 1)|turn;
-    bool retval = (zobrist_cache.find(zobrist_turn) == zobrist_cache.end());
+    score_cache[ply] = score;
+    const uint32_t zobrist_turn = (zobrist_hash << 1)|turn;
+    zobrist_cache[ply] = zobrist_turn;
+    bool retval = true;
+    for(int i = ply - 1; i >= 0; --i){
+        if(zobrist_cache[i] == zobrist_turn){
+            retval = false;
+            break;
+        }
+    }
     if(retval){
-        zobrist_cache.insert(zobrist_turn);
         Scan();
     }
-    zobrist_repetition_counts[zobrist_hash]++;
     lastinsert = retval;
     return retval;
 }
 
 void board::AIBoard5::NULLMove(){
+    ++ply;
+    assert(ply < MAX_PLY);
     turn = !turn;
-    zobrist_cache.insert((zobrist_hash << 1)|turn);
     score = -score;
-    score_cache.push(score);
-    zobrist_repetition_counts[zobrist_hash]++;
+    score_cache[ply] = score;
+    zobrist_cache[ply] = (zobrist_hash << 1)|turn;
     Scan();
 }
 
 void board::AIBoard5::UndoMove(int type){
-    score_cache.pop();
-    score = score_cache.top();
-    if(lastinsert){
-        zobrist_cache.erase((zobrist_hash<<1)|turn);
-    }
-    zobrist_repetition_counts[zobrist_hash]--;
     if(type == 1){//非空移动
-        const std::tuple<unsigned char, unsigned char, char> from_to_eat = cache.top();
-        cache.pop();
+        const std::tuple<unsigned char, unsigned char, char> from_to_eat = cache[ply];
         const unsigned char encode_from = std::get<0>(from_to_eat);
         const unsigned char encode_to = std::get<1>(from_to_eat);
         const char eat = std::get<2>(from_to_eat);
@@ -358,8 +491,11 @@ void board::AIBoard5::UndoMove(int type){
         turn = !turn;
         const unsigned char reverse_encode_from = reverse(encode_from);
         const unsigned char reverse_encode_to = reverse(encode_to);
+        const unsigned char red_from = turn ? encode_from : reverse_encode_from;
+        const unsigned char red_to = turn ? encode_to : reverse_encode_to;
+        const char placed = state_red[red_to];
         if(turn){
-            zobrist_hash ^= _zobrist[(int)state_red[encode_to]][encode_to];
+            _toggle_zobrist(encode_to);
             if(state_red[encode_to] == 'U'){
                 state_red[encode_from] = LUT5[encode_from];
                 state_red[encode_to] = eat;
@@ -371,10 +507,10 @@ void board::AIBoard5::UndoMove(int type){
                 state_black[reverse_encode_from] = state_black[reverse_encode_to];
                 state_black[reverse_encode_to] = swapcase(eat);
             }
-            zobrist_hash ^= _zobrist[(int)state_red[encode_from]][encode_from];
-            zobrist_hash ^= _zobrist[(int)state_red[encode_to]][encode_to];
+            _toggle_zobrist(encode_from);
+            _toggle_zobrist(encode_to);
         }else{
-            zobrist_hash ^= _zobrist[(int)state_red[reverse_encode_to]][reverse_encode_to];
+            _toggle_zobrist(reverse_encode_to);
             if(state_black[encode_to] == 'U'){
                 state_black[encode_from] = LUT5[encode_from];
                 state_black[encode_to] = eat;
@@ -386,17 +522,53 @@ void board::AIBoard5::UndoMove(int type){
                 state_red[reverse_encode_from] = state_red[reverse_encode_to];
                 state_red[reverse_encode_to] = swapcase(eat);
             }
-            zobrist_hash ^= _zobrist[(int)state_red[reverse_encode_from]][reverse_encode_from];
-            zobrist_hash ^= _zobrist[(int)state_red[reverse_encode_to]][reverse_encode_to];
+            _toggle_zobrist(reverse_encode_from);
+            _toggle_zobrist(reverse_encode_to);
         }
+        bitpos.UndoMove(red_from, red_to, state_red[red_from], placed, state_red[red_to]);
         //Scan(); //这里不需要再Scan，因为Scan是用来统计移动分数的和Quiescence的，Move之前就应该已经统计完成
     }else if(type == 0){
         turn = !turn;
     }
-    zobrist_repetition_counts[zobrist_hash]--;
+    --ply;
+    score = score_cache[ply];
 }
 
 void board::AIBoard5::Scan(){
+    scanentry& entry = _scan_cache[zobrist_hash & (EVAL_CACHE_SIZE - 1)];
+    if(entry.valid && entry.key == zobrist_hash && entry.turn == turn){
+        all = entry.all;
+        che = entry.che;
+        che_opponent = entry.che_opponent;
+        zu = entry.zu;
+        covered = entry.covered;
+        covered_opponent = entry.covered_opponent;
+        endline = 0;
+        score_rough = entry.score_rough;
+        kongtoupao = entry.kongtoupao;
+        kongtoupao_opponent = entry.kongtoupao_opponent;
+        kongtoupao_score = entry.kongtoupao_score;
+        kongtoupao_score_opponent = entry.kongtoupao_score_opponent;
+        return;
+    }
+    _scan();
+    entry.key = zobrist_hash;
+    entry.turn = turn;
+    entry.valid = true;
+    entry.all = all;
+    entry.che = che;
+    entry.che_opponent = che_opponent;
+    entry.zu = zu;
+    entry.covered = covered;
+    entry.covered_opponent = covered_opponent;
+    entry.score_rough = score_rough;
+    entry.kongtoupao = kongtoupao;
+    entry.kongtoupao_opponent = kongtoupao_opponent;
+    entry.kongtoupao_score = kongtoupao_score;
+    entry.kongtoupao_score_opponent = kongtoupao_score_opponent;
+}
+
+void board::AIBoard5::_scan(){
     all = 0;
     che = 0;
     che_opponent = 0;
@@ -455,6 +627,23 @@ void board::AIBoard5::Scan(){
 }
 
 short board::AIBoard5::ScanProtectors(){
+    protectorentry& entry = _protector_cache[king_zone_hash & (PROTECTOR_CACHE_SIZE - 1)];
+    if(entry.valid && entry.key == king_zone_hash && entry.turn == turn){
+        protector = entry.protector;
+        protector_oppo = entry.protector_oppo;
+        return entry.bonus;
+    }
+    const short bonus = _scan_protectors();
+    entry.key = king_zone_hash;
+    entry.turn = turn;
+    entry.valid = true;
+    entry.protector = protector;
+    entry.protector_oppo = protector_oppo;
+    entry.bonus = bonus;
+    return bonus;
+}
+
+short board::AIBoard5::_scan_protectors(){
     const char *_state_pointer = turn?state_red:state_black;
     protector = 4;
     protector_oppo = 4;
@@ -566,13 +755,8 @@ void board::AIBoard5::KongTouPao(const char* _state_pointer, int pos, bool mysel
     } //else
 } //KongTouPao
 
-template<bool needscore, bool return_after_mate>
-bool board::AIBoard5::GenMovesWithScore(std::tuple<short, unsigned char, unsigned char> legal_moves[MAX_POSSIBLE_MOVES], int& num_of_legal_moves, std::pair<unsigned char, unsigned char>* killer, short& killer_score, unsigned char& mate_src, unsigned char& mate_dst, bool& killer_is_alive){
-    num_of_legal_moves = 0;
-    killer_score = 0;
-    bool mate = false;
-    killer_is_alive = false;
-    const char *_state_pointer = turn?state_red:state_black;
+template<bool captures_only, typename F>
+bool board::AIBoard5::_ForEachMoveMailbox(const char* _state_pointer, F&& emit){
     for(unsigned char i = 51; i <= 203; ++i){
         if((i & 15) < 3 || (i & 15) > 11) { continue; }
         const char p = _state_pointer[i];
@@ -594,36 +778,16 @@ bool board::AIBoard5::GenMovesWithScore(std::tuple<short, unsigned char, unsigne
                     }
                     if(cfoot == 0){
                         if(q == '.'){
-                            short score_tmp = 0;
-                            if(needscore){
-                                score_tmp = _score_func(this, _state_pointer, i, j);
+                            if(captures_only){
+                                continue;
                             }
-                            legal_moves[num_of_legal_moves] = std::make_tuple(score_tmp, i, j);
-                            if(killer && killer -> first == i && killer -> second == j && needscore){
-                                killer_score = score_tmp;
-                                killer_is_alive = true;
-                            }
-                            ++num_of_legal_moves;
+                            if(emit(i, j)){ return true; }
                         } else{
                             ++cfoot;
                         }
                     }else{
                         if(islower(q)) {
-                            short score_tmp = 0;
-                            if(needscore){
-                                score_tmp = _score_func(this, _state_pointer, i, j);
-                            }
-                            legal_moves[num_of_legal_moves] = std::make_tuple(score_tmp, i, j);
-                            if(killer && killer -> first == i && killer -> second == j && needscore){
-                                killer_score = score_tmp;
-                                killer_is_alive = true;
-                            }
-                            ++num_of_legal_moves;
-                            if(q == 'k') { 
-                                mate = true; 
-                                mate_src = i, mate_dst = j;
-                                if(return_after_mate){ return true; }
-                            }
+                            if(emit(i, j)){ return true; }
                             break;
                         } else if(isupper(q)) {
                             break;
@@ -637,19 +801,7 @@ bool board::AIBoard5::GenMovesWithScore(std::tuple<short, unsigned char, unsigne
         else if(p == 'K'){
             for(unsigned char scanpos = i - 16; scanpos > A9; scanpos -= 16){
                 if(_state_pointer[scanpos] == 'k'){
-                    short score_tmp = 0;
-                    if(needscore){
-                        score_tmp = _score_func(this, _state_pointer, i, scanpos);
-                    }
-                    legal_moves[num_of_legal_moves] = std::make_tuple(score_tmp, i, scanpos);
-                    if(killer && killer -> first == i && killer -> second == scanpos && needscore){
-                        killer_score = score_tmp;
-                        killer_is_alive = true;
-                    }
-                    ++num_of_legal_moves;
-                    mate = true;
-                    mate_src = i, mate_dst = scanpos;
-                    if(return_after_mate){ return true; }
+                    if(emit(i, scanpos)){ return true; }
                 } else if(_state_pointer[scanpos] != '.'){
                     break;
                 }
@@ -694,27 +846,58 @@ bool board::AIBoard5::GenMovesWithScore(std::tuple<short, unsigned char, unsigne
                 else if((p == 'B' || p == 'F') && _state_pointer[i + d/2] != '.') {
                     break;
                 }
-                short score_tmp = 0;
-                if(needscore){
-                    score_tmp = _score_func(this, _state_pointer, i, j);
-                }
-                legal_moves[num_of_legal_moves] = std::make_tuple(score_tmp, i, j);
-                if(killer && killer -> first == i && killer -> second == j && needscore){
-                    killer_score = score_tmp;
-                    killer_is_alive = true;
-                }
-                if(q == 'k'){
-                    mate = true;
-                    mate_src = i, mate_dst = j;
-                    if(return_after_mate){ return true; }
+                if(captures_only && q == '.'){
+                    //只生成吃子着法, 车/暗车继续沿射线扫描
+                    if(p != 'D' && p != 'R'){
+                        break;
+                    }
+                    continue;
                 }
-                ++num_of_legal_moves;
+                if(emit(i, j)){ return true; }
                 if((p != 'D' && p != 'R') || islower(q)){
                     break;
                 }
             } //j
         } //dir
     } //for
+    return false;
+}//_ForEachMoveMailbox()
+
+template<bool needscore, bool return_after_mate, bool captures_only>
+bool board::AIBoard5::GenMovesWithScore(std::tuple<short, unsigned char, unsigned char> legal_moves[MAX_POSSIBLE_MOVES], int& num_of_legal_moves, std::pair<unsigned char, unsigned char>* killer, short& killer_score, unsigned char& mate_src, unsigned char& mate_dst, bool& killer_is_alive){
+    num_of_legal_moves = 0;
+    killer_score = 0;
+    bool mate = false;
+    killer_is_alive = false;
+    const char *_state_pointer = turn?state_red:state_black;
+    //两种棋盘表示共用的着法处理: 打分, 记录杀手, 判断能否吃将
+    auto emit = [&](unsigned char i, unsigned char j) -> bool {
+        short score_tmp = 0;
+        if(needscore){
+            score_tmp = _score_func(this, _state_pointer, i, j);
+        }
+        legal_moves[num_of_legal_moves] = std::make_tuple(score_tmp, i, j);
+        if(killer && killer -> first == i && killer -> second == j && needscore){
+            killer_score = score_tmp;
+            killer_is_alive = true;
+        }
+        ++num_of_legal_moves;
+        if(_state_pointer[j] == 'k'){
+            mate = true;
+            mate_src = i, mate_dst = j;
+            return return_after_mate;
+        }
+        return false;
+    };
+#if BITBOARD
+    if(bitpos.ForEachMove<captures_only>(turn, emit)){
+        return true;
+    }
+#else
+    if(_ForEachMoveMailbox<captures_only>(_state_pointer, emit)){
+        return true;
+    }
+#endif
     if(needscore){
         std::sort(legal_moves, legal_moves + num_of_legal_moves, GreaterTuple<short, unsigned char, unsigned char>);
     }
@@ -724,6 +907,9 @@ bool board::AIBoard5::GenMovesWithScore(std::tuple<short, unsigned char, unsigne
 
 template<bool doublereverse>
 bool board::AIBoard5::Mate(){
+#if BITBOARD
+    return bitpos.KingCapturable(doublereverse ? !turn : turn);
+#else
     if(doublereverse)
         turn = !turn;
     std::tuple<short, unsigned char, unsigned char> legal_moves_tmp[MAX_POSSIBLE_MOVES];
@@ -735,6 +921,7 @@ bool board::AIBoard5::Mate(){
     if(doublereverse)
         turn = !turn;
     return mate;
+#endif
 }
 
 bool board::AIBoard5::Executed(bool* oppo_mate, std::tuple<short, unsigned char, unsigned char> legal_moves_tmp[], int num_of_legal_moves_tmp, bool calc){
@@ -779,15 +966,8 @@ bool board::AIBoard5::Ismate_After_Move(unsigned char src, unsigned char dst){
     //a8(R)
     //a8a9后R位于a9形成将军return true
     //a8a7后不形成将军return false
-    short score = 0;
-    unsigned char mate_src, mate_dst;
-    std::tuple<short, unsigned char, unsigned char> legal_moves_tmp[MAX_POSSIBLE_MOVES];
-    int num_of_legal_moves_tmp = 0;
-    bool killer_is_alive = false;
     Move(src, dst, 0);
-    turn = !turn;
-    bool mate = GenMovesWithScore<false, true>(legal_moves_tmp, num_of_legal_moves_tmp, NULL, score, mate_src, mate_dst, killer_is_alive);
-    turn = !turn;
+    bool mate = Mate<true>();
     UndoMove(1);
     return mate;
 }
@@ -797,6 +977,7 @@ void board::AIBoard5::CopyData(const unsigned char di[VERSION_MAX][2][123]){
     memset(aisumall, 0, sizeof(aisumall));
     memset(aidi, 0, sizeof(aidi));
     memcpy(aidi, di, sizeof(aidi));
+    _clear_eval_cache(); //aiaverage变了, 缓存的score_rough失效
     const float discount_factor = 1.5;
 
     for(int ver = 0; ver < VERSION_MAX; ++ver){
@@ -866,7 +1047,8 @@ std::string board::AIBoard5::Kaiju(){
 }
 
 std::string board::AIBoard5::Think(int maxdepth){
-    (void)maxdepth; // Ignore the depth from python
+    //python传入的深度只作为上限: 迭代加深从第5层开始, 最多到第7层
+    max_depth = std::max(5, std::min(7, maxdepth));
     SetScoreFunction("mtd_thinker5", 2);
     return round == 0 ? Kaiju() : _thinker_func(this);
 }
@@ -1154,22 +1336,34 @@ std::string mtd_thinker5(board::AIBoard5* bp){
     constexpr short EVAL_ROBUSTNESS = 0;
     bp -> Scan();
     bool traverse_all_strategy = true;
-    int max_depth = (bp -> round < 15?7:7);
-    int quiesc_depth = (bp -> round < 15?1:2);
+    int max_depth = bp -> max_depth;
     int depth = 0;
+    bp -> completed_depth = 0;
     auto start = std::chrono::high_resolution_clock::now();
     for(depth = 5; depth <= max_depth; ++depth){
         short lower = -MATE_UPPER, upper = MATE_UPPER;
-        while(lower < upper - EVAL_ROBUSTNESS){
+        while(lower < upper - EVAL_ROBUSTNESS && !bp -> Stopped()){
             short gamma = (lower + upper + 1)/2; //不会溢出
-            short score = mtd_alphabeta5(bp, gamma, depth + quiesc_depth, true, true, true, quiesc_depth, traverse_all_strategy);
+            short score = mtd_alphabeta5(bp, gamma, depth, true, true, true, traverse_all_strategy);
             if(score >= gamma) { lower = score; }
             if(score < gamma) { upper = score; }
         }
-        mtd_alphabeta5(bp, lower, depth + quiesc_depth, true, true, true, quiesc_depth, traverse_all_strategy);
+        if(!bp -> Stopped()){
+            mtd_alphabeta5(bp, lower, depth, true, true, true, traverse_all_strategy);
+        }
         size_t int_ms = (size_t)std::chrono::duration_cast<std::chrono::milliseconds>(std::chrono::high_resolution_clock::now() - start).count();
-        if(int_ms > 15000 || depth == max_depth){
-            auto move = (*bp -> tp_move)[{bp -> zobrist_hash, bp -> turn}];
+        if(!bp -> Stopped()){
+            bp -> completed_depth = depth;
+        }
+        if(!bp -> Stopped() && bp -> on_depth){
+            std::pair<unsigned char, unsigned char> best = {0, 0};
+            bp -> tp_table -> ProbeMove(bp -> zobrist_hash, bp -> turn, bp -> tt_generation, best);
+            bp -> on_depth(depth, lower, best.first, best.second, (int)int_ms);
+        }
+        //被中断时返回置换表中的走法(来自中断前的搜索), 没有时返回第一个合法走法
+        if(bp -> Stopped() || int_ms > (size_t)bp -> movetime || depth == max_depth){
+            std::pair<unsigned char, unsigned char> move = {0, 0};
+            bp -> tp_table -> ProbeMove(bp -> zobrist_hash, bp -> turn, bp -> tt_generation, move);
             // Validate the move from transposition table
             bool move_is_valid = false;
             if(move != std::pair<unsigned char, unsigned char>({0, 0})){
@@ -1194,12 +1388,12 @@ std::string mtd_thinker5(board::AIBoard5* bp){
                 bool killer_is_alive = false;
                 short killer_score = 0;
                 bp -> GenMovesWithScore<true, false>(legal_moves_tmp, num_of_legal_moves_tmp, NULL, killer_score, mate_src, mate_dst, killer_is_alive);
-                std::cout << "My name: " << bp -> GetName() << " [AM I FAILED?]" << num_of_legal_moves_tmp << " My move: " << bp -> translate_ucci(std::get<1>(legal_moves_tmp[0]), std::get<2>(legal_moves_tmp[0])) << ", duration = " << int_ms << ", depth = " << depth << ", quiesc_depth = " << quiesc_depth << "." << std::endl;
+                std::cout << "My name: " << bp -> GetName() << " [AM I FAILED?]" << num_of_legal_moves_tmp << " My move: " << bp -> translate_ucci(std::get<1>(legal_moves_tmp[0]), std::get<2>(legal_moves_tmp[0])) << ", duration = " << int_ms << ", depth = " << depth << "." << std::endl;
                 if(num_of_legal_moves_tmp != 0){
                     return bp -> translate_ucci(std::get<1>(legal_moves_tmp[0]), std::get<2>(legal_moves_tmp[0]));
                 }
             } else {
-                std::cout << "My name: " << bp -> GetName() << " My move: " << bp -> translate_ucci(move.first, move.second) << ", duration = " << int_ms << ", depth = " << depth << ", quiesc_depth = " << quiesc_depth << "." << std::endl;
+                std::cout << "My name: " << bp -> GetName() << " My move: " << bp -> translate_ucci(move.first, move.second) << ", duration = " << int_ms << ", depth = " << depth << "." << std::endl;
                 return bp -> translate_ucci(move.first, move.second);
             }
         }
@@ -1207,31 +1401,94 @@ std::string mtd_thinker5(board::AIBoard5* bp){
     return "";
 }
 
-short mtd_quiescence5(board::AIBoard5* self, const short gamma, int quiesc_depth, const bool root){
+short mtd_evaluate5(board::AIBoard5* bp, int budget_ms, int* reached_depth){
+    //限时的浅层评估: 从静态搜索(第0层)开始迭代加深, 预算按节点数(budget_ms * EVAL_NODES_PER_MS)计,
+    //在对局私有的置换表上用新的generation搜索, 同一局面和预算总是得到同样的结果; deadline只是防止机器过忙时超时太多,
+    //被它或stop打断时eval_exact为false. 中断的那一层不算, 返回最后一个完整层的分数(走子方视角),
+    //一层都没完成时返回静态评估, 深度为-1
     constexpr short MATE_UPPER = 3696;
-    constexpr int TOPK = 3;
+    constexpr int MAX_EVAL_DEPTH = 6;
+    constexpr uint64_t EVAL_NODES_PER_MS = 200;
+    if(!bp -> eval_table){
+        bp -> eval_table.reset(new board::TranspositionTable5(TP5_EVAL_SCORE_SIZE, TP5_EVAL_MOVE_SIZE));
+    }
+    board::TranspositionTable5* shared_table = bp -> tp_table;
+    bp -> tp_table = bp -> eval_table.get();
+    bp -> tt_generation = bp -> tp_table -> NewGeneration();
+    bp -> Scan();
+    short result = bp -> score + bp -> kongtoupao_score - bp -> kongtoupao_score_opponent;
+    *reached_depth = bp -> completed_depth = -1;
+    bp -> node_limit = bp -> nodes + (uint64_t)std::max(budget_ms, 1) * EVAL_NODES_PER_MS;
+    bp -> deadline = std::chrono::steady_clock::now() + std::chrono::milliseconds(2 * budget_ms + 50);
+    bp -> timed = true;
+    bp -> timed_out = false;
+    for(int depth = 0; depth <= MAX_EVAL_DEPTH; ++depth){
+        short lower = -MATE_UPPER, upper = MATE_UPPER;
+        while(lower < upper && !bp -> Stopped()){
+            short gamma = (lower + upper + 1)/2;
+            short score = mtd_alphabeta5(bp, gamma, depth, true, true, true, true);
+            if(score >= gamma) { lower = score; }
+            if(score < gamma) { upper = score; }
+        }
+        if(bp -> Stopped()){
+            break;
+        }
+        result = lower;
+        *reached_depth = bp -> completed_depth = depth;
+        if(lower >= MATE_UPPER/2 || lower <= -MATE_UPPER/2){
+            break;
+        }
+    }
+    //节点预算之外的原因(deadline, stop)结束时结果与机器负载有关
+    bp -> eval_exact = !bp -> stop && (!bp -> timed_out || bp -> nodes >= bp -> node_limit);
+    bp -> timed = false;
+    bp -> timed_out = false;
+    bp -> node_limit = 0;
+    bp -> tt_generation = 0;
+    bp -> tp_table = shared_table;
+    return result;
+}
+
+short mtd_quiescence5(board::AIBoard5* self, const short gamma, const int qply, const bool root){
+    //只搜索吃子着法的静态搜索; 被将军时搜索全部应将着法, 不允许stand-pat
+    constexpr short MATE_UPPER = 3696;
+    constexpr short DELTA_MARGIN = 200; //空头炮与保护子两项的最大波动
+    constexpr int MAX_QUIESCENCE_PLY = 32;
     unsigned char mate_src = 0, mate_dst = 0;
-    std::function<short()> evaluate = [self]() -> short{
+    auto evaluate = [self]() -> short{
         return self -> score + self -> kongtoupao_score - self -> kongtoupao_score_opponent + self -> ScanProtectors();
     };
+    if(self -> Aborted()){
+        return 0; //返回值会被调用者丢弃
+    }
+    if(self -> score < -MATE_UPPER/2){
+        return -MATE_UPPER;
+    }
+    //stand-pat必须在任何Move之前计算, 因为Move会重新Scan
+    const short stand_pat = evaluate();
+    if(qply >= MAX_QUIESCENCE_PLY){
+        return stand_pat;
+    }
     std::tuple<short, unsigned char, unsigned char> legal_moves_tmp[MAX_POSSIBLE_MOVES];
     int num_of_legal_moves_tmp = 0;
-    const char* _state_pointer = self -> turn? self -> state_red : self -> state_black;
     bool killer_is_alive = false;
     short killer_score = 0;
-    bool mate = quiesc_depth ? self -> GenMovesWithScore<true, false>(legal_moves_tmp, num_of_legal_moves_tmp, NULL, killer_score, mate_src, mate_dst, killer_is_alive) : \
-        self -> GenMovesWithScore<false, true>(legal_moves_tmp, num_of_legal_moves_tmp, NULL, killer_score, mate_src, mate_dst, killer_is_alive);
-    if(mate) { (*self -> tp_move)[{self -> zobrist_hash, self -> turn}] = {mate_src, mate_dst}; return MATE_UPPER; }
-    if(self -> Executed(&mate, legal_moves_tmp, num_of_legal_moves_tmp, true)){
-        return -MATE_UPPER;
-    }
-    if(quiesc_depth == 0) { 
-        return evaluate();
+    bool mate = self -> GenMovesWithScore<true, false, true>(legal_moves_tmp, num_of_legal_moves_tmp, NULL, killer_score, mate_src, mate_dst, killer_is_alive);
+    if(mate) { self -> tp_table -> StoreMove(self -> zobrist_hash, self -> turn, self -> tt_generation, {mate_src, mate_dst}); return MATE_UPPER; }
+    bool in_check = self -> Mate<true>();
+    if(in_check){
+        self -> GenMovesWithScore<true, false>(legal_moves_tmp, num_of_legal_moves_tmp, NULL, killer_score, mate_src, mate_dst, killer_is_alive);
+        if(self -> Executed(&in_check, legal_moves_tmp, num_of_legal_moves_tmp, false)){
+            return -MATE_UPPER;
+        }
+    }else if(stand_pat >= gamma){
+        return stand_pat;
     }
     std::pair<short, short> entry(-MATE_UPPER, MATE_UPPER);
-    std::pair<uint32_t, int> pair = {self -> zobrist_hash, (quiesc_depth << 1) + (int)self -> turn};
-    if(self -> tp_score -> find(pair) != self -> tp_score -> end()){
-        entry = (*self -> tp_score)[pair];
+    const int depth_turn = (int)self -> turn;
+    ++self -> tt_probes;
+    if(self -> tp_table -> ProbeScore(self -> zobrist_hash, depth_turn, self -> tt_generation, entry)){
+        ++self -> tt_hits;
     }
     if(entry.first >= gamma){
         return entry.first;
@@ -1239,86 +1496,80 @@ short mtd_quiescence5(board::AIBoard5* self, const short gamma, int quiesc_depth
     if(entry.second < gamma){
         return entry.second;
     }
-    short score = 0, best = -MATE_UPPER; 
-    std::function<bool(short, unsigned char, unsigned char, short*)> judge = [&](short score, unsigned char src, unsigned char dst, short* best){
+    short score = 0, best = in_check ? -MATE_UPPER : stand_pat;
+    auto judge = [&](short score, unsigned char src, unsigned char dst, short* best) -> bool{
         bool update = score > *best;
         if(update){
             *best = score;
         }
         if(*best >= gamma && update){
             if(src && dst && root){
-                (*self -> tp_move)[{self -> zobrist_hash, self -> turn}] = {src, dst};
+                self -> tp_table -> StoreMove(self -> zobrist_hash, self -> turn, self -> tt_generation, {src, dst});
             }
             return true;
         }
         return false;
     };
-    bool into = false;
     for(int j = 0; j < num_of_legal_moves_tmp; ++j){
         auto move_score_tuple = legal_moves_tmp[j];
         unsigned char src = std::get<1>(move_score_tuple), dst = std::get<2>(move_score_tuple);
-        bool mate_oppo = self -> Ismate_After_Move(src, dst);
-        if(j < TOPK || _state_pointer[dst] == 'r' || _state_pointer[dst] == 'n' || _state_pointer[dst] == 'c' || _state_pointer[dst] == 'u' ||  (_state_pointer[dst] >= 'd' && _state_pointer[dst] <= 'i') || mate || mate_oppo){//走这步可以将到对手, 或正在被对手将军
-            into = true;
-            bool retval = self -> Move(src, dst, std::get<0>(move_score_tuple));
-            if(retval){
-                score = -mtd_quiescence5(self, 1 - gamma, quiesc_depth - 1, false);
-            }
-            self -> UndoMove(1);
-            if(retval && judge(score, src, dst, &best)){
-                break;
-            }
+        //delta pruning: 着法按分数降序排列, 一步吃子都追不上gamma, 后面的更不可能
+        if(!in_check && stand_pat + std::get<0>(move_score_tuple) + DELTA_MARGIN < gamma){
+            break;
+        }
+        bool retval = self -> Move(src, dst, std::get<0>(move_score_tuple));
+        if(retval){
+            score = -mtd_quiescence5(self, 1 - gamma, qply + 1, false);
+        }
+        self -> UndoMove(1);
+        if(self -> Stopped()){
+            return best;
+        }
+        if(retval && judge(score, src, dst, &best)){
+            break;
         }
-    }
-    if(!into) {
-        self -> Scan();
-        return evaluate();
     }
     if(best >= gamma){
-        (*self -> tp_score)[pair] = {best, entry.second};
+        self -> tp_table -> StoreScore(self -> zobrist_hash, depth_turn, self -> tt_generation, {best, entry.second});
     }else{
-        (*self -> tp_score)[pair] = {entry.first, best};
+        self -> tp_table -> StoreScore(self -> zobrist_hash, depth_turn, self -> tt_generation, {entry.first, best});
     }
     return best;
 }
 
-short mtd_alphabeta5(board::AIBoard5* self, const short gamma, int depth, const bool root, const bool nullmove, const bool nullmove_now, const int quiesc_depth, const bool traverse_all_strategy){
+short mtd_alphabeta5(board::AIBoard5* self, const short gamma, int depth, const bool root, const bool nullmove, const bool nullmove_now, const bool traverse_all_strategy){
     constexpr short MATE_UPPER = 3696;
     unsigned char mate_src = 0, mate_dst = 0;
     if(root) { 
         self -> Scan();
         self -> original_depth = depth;
     }
-    if(!root){
-        std::string web_board_str = board::internal_to_web(self->state_red);
-        if(self -> hist -> find(web_board_str) != self -> hist -> end()){
-            // Repetition detected. This is a draw.
-            return 0;
-        }
+    if(!root && self -> InHistory()){
+        // Repetition detected. This is a draw.
+        return 0;
+    }
+    if(self -> Aborted()){
+        return 0; //返回值会被调用者丢弃
+    }
+    if(depth <= 0){
+        return mtd_quiescence5(self, gamma, 0, true);
     }
     std::tuple<short, unsigned char, unsigned char> legal_moves_tmp[MAX_POSSIBLE_MOVES];
     int num_of_legal_moves_tmp = 0;
-    depth = std::max(depth, quiesc_depth);
     std::pair<unsigned char, unsigned char> killer = {0, 0};
     bool killer_is_alive = false;
     short killer_score = 0;
-    if(self -> tp_move -> find({self -> zobrist_hash, self -> turn}) != self -> tp_move -> end()){
-        killer = (*self -> tp_move)[{self -> zobrist_hash, self -> turn}];
-        killer_is_alive = true;
-    }
-    bool mate = (depth == quiesc_depth ? self -> GenMovesWithScore<false, true>(legal_moves_tmp, num_of_legal_moves_tmp, killer_is_alive?&killer:NULL, killer_score, mate_src, mate_dst, killer_is_alive) : \
-        self -> GenMovesWithScore<true, false>(legal_moves_tmp, num_of_legal_moves_tmp, killer_is_alive?&killer:NULL, killer_score, mate_src, mate_dst, killer_is_alive));
-    if(mate) { (*self -> tp_move)[{self -> zobrist_hash, self -> turn}] = {mate_src, mate_dst}; return MATE_UPPER; }
+    killer_is_alive = self -> tp_table -> ProbeMove(self -> zobrist_hash, self -> turn, self -> tt_generation, killer);
+    bool mate = self -> GenMovesWithScore<true, false>(legal_moves_tmp, num_of_legal_moves_tmp, killer_is_alive?&killer:NULL, killer_score, mate_src, mate_dst, killer_is_alive);
+    if(mate) { self -> tp_table -> StoreMove(self -> zobrist_hash, self -> turn, self -> tt_generation, {mate_src, mate_dst}); return MATE_UPPER; }
     if(self -> Executed(&mate, legal_moves_tmp, num_of_legal_moves_tmp, true) || self -> score < -MATE_UPPER/2){
         return -MATE_UPPER;
     }
-    if(depth == quiesc_depth){
-        return mtd_quiescence5(self, gamma, quiesc_depth, true);
-    }
     std::pair<short, short> entry(-MATE_UPPER, MATE_UPPER);
-    std::pair<uint32_t, int> pair = {self -> zobrist_hash, (depth << 1) + (int)self -> turn};
-    if(self -> tp_score -> find(pair) != self -> tp_score -> end()){
-        entry = (*self -> tp_score)[pair];
+    const int depth_turn = (depth << 1) + (int)self -> turn;
+    ++self -> tt_probes;
+    if(self -> tp_table -> ProbeScore(self -> zobrist_hash, depth_turn, self -> tt_generation, entry)){
+        ++self -> tt_hits;
     }
     if(entry.first >= gamma && (!root || killer_is_alive)){
         return entry.first;
@@ -1327,14 +1578,14 @@ short mtd_alphabeta5(board::AIBoard5* self, const short gamma, int depth, const
         return entry.second;
     }
     short score = 0, best = -MATE_UPPER;
-    std::function<bool(short, unsigned char, unsigned char, short*)> judge = [&](short score, unsigned char src, unsigned char dst, short* best){
+    auto judge = [&](short score, unsigned char src, unsigned char dst, short* best) -> bool{
         bool update = score > *best;
         if(update){
             *best = score;
         }
         if(*best >= gamma && update){
             if(src && dst){
-                (*self -> tp_move)[{self -> zobrist_hash, self -> turn}] = {src, dst};
+                self -> tp_table -> StoreMove(self -> zobrist_hash, self -> turn, self -> tt_generation, {src, dst});
             }
             return true;
         }
@@ -1343,8 +1594,11 @@ short mtd_alphabeta5(board::AIBoard5* self, const short gamma, int depth, const
     do{
         if(nullmove && nullmove_now && depth > 3 && !mate && !root){
             self -> NULLMove();
-            score = -mtd_alphabeta5(self, 1 - gamma, depth - 3, false, nullmove, nullmove, quiesc_depth, traverse_all_strategy); //Attempt: false --> nullmove
+            score = -mtd_alphabeta5(self, 1 - gamma, depth - 3, false, nullmove, nullmove, traverse_all_strategy); //Attempt: false --> nullmove
             self -> UndoMove(0);
+            if(self -> Stopped()){
+                break;
+            }
             if(judge(score, 0, 0, &best) && (!root || !traverse_all_strategy)){
                 break;
             }
@@ -1352,9 +1606,12 @@ short mtd_alphabeta5(board::AIBoard5* self, const short gamma, int depth, const
         if(killer_is_alive){
             bool retval = self -> Move(killer.first, killer.second, killer_score);
             if(retval){
-                score = -mtd_alphabeta5(self, 1 - gamma, depth - 1, false, nullmove, nullmove, quiesc_depth, traverse_all_strategy);
+                score = -mtd_alphabeta5(self, 1 - gamma, depth - 1, false, nullmove, nullmove, traverse_all_strategy);
             }
             self -> UndoMove(1);
+            if(self -> Stopped()){
+                break;
+            }
             if(retval && judge(score, killer.first, killer.second, &best) && (!root || !traverse_all_strategy)){
                 break;
             }
@@ -1364,31 +1621,26 @@ short mtd_alphabeta5(board::AIBoard5* self, const short gamma, int depth, const
             auto move_score_tuple = legal_moves_tmp[j];
             auto src = std::get<1>(move_score_tuple), dst = std::get<2>(move_score_tuple);
 
-            /*
-            if (self->Ismate_After_Move(src, dst)) {
-                self->Move(src, dst, 0); // Temporarily make the move to get the zobrist hash
-                uint32_t next_zobrist_hash = self->zobrist_hash;
-                self->UndoMove(1); // Undo the temporary move
-                if (self->zobrist_repetition_counts.count(next_zobrist_hash) && self->zobrist_repetition_counts[next_zobrist_hash] >= 2) {
-                    continue; // Skip this move as it leads to a perpetual check
-                }
-            }
-            */
-
             bool retval = self -> Move(src, dst, std::get<0>(move_score_tuple));
             if(retval){
-                score = -mtd_alphabeta5(self, 1 - gamma, depth - 1, false, nullmove, nullmove, quiesc_depth, traverse_all_strategy);
+                score = -mtd_alphabeta5(self, 1 - gamma, depth - 1, false, nullmove, nullmove, traverse_all_strategy);
             }
             self -> UndoMove(1);
+            if(self -> Stopped()){
+                break;
+            }
             if(retval && judge(score, src, dst, &best) && (!root || !traverse_all_strategy)){
                 break;
             }
         }
     }while(false);
+    if(self -> Stopped()){
+        return best;
+    }
     if(best >= gamma){
-        (*self -> tp_score)[pair] = {best, entry.second};
+        self -> tp_table -> StoreScore(self -> zobrist_hash, depth_turn, self -> tt_generation, {best, entry.second});
     }else{
-        (*self -> tp_score)[pair] = {entry.first, best};
+        self -> tp_table -> StoreScore(self -> zobrist_hash, depth_turn, self -> tt_generation, {entry.first, best});
     }
     return best;
 }
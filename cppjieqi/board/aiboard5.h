@@ -23,7 +23,6 @@ extern unsigned char L1[256][256];
 #include <vector>
 #include <string>
 #include <tuple>
-#include <set>
 #include <unordered_map>
 #include <unordered_set>
 #include <iostream>
@@ -33,27 +32,145 @@ extern unsigned char L1[256][256];
 #include <cmath>
 #include <random>
 #include <chrono>
+#include <atomic>
+#include <mutex>
+#include <memory>
 #include <string.h>
 #include <assert.h>
 #include <stdio.h>
 #include <ctype.h>
-#include <stack>
 #include <time.h>
 #include <stdlib.h>
 #include <functional>
 #include "../global/global.h"
 #include "../score/score.h"
 #include "thinker.h"
+#include "bitposition.h"
 #define ROOTED 0
 #define CLEAR_EVERY_DEPTH false
+#define BITBOARD 1 //1: 用BitPosition生成着法/判断将军, 0: 用mailbox(state_red/state_black)
 #define CH(X) self->C(X)
+#define EVAL_CACHE_SIZE (1 << 16)
+#define PROTECTOR_CACHE_SIZE (1 << 12)
+#define MAX_PLY 256
+#define TP5_SCORE_SIZE (1 << 21)
+#define TP5_MOVE_SIZE (1 << 20)
+#define TP5_EVAL_SCORE_SIZE (1 << 16) //限时评估用的对局私有置换表
+#define TP5_EVAL_MOVE_SIZE (1 << 15)
 
-extern std::unordered_map<int, std::unordered_map<std::pair<uint32_t, bool>, std::pair<unsigned char, unsigned char>, myhash<uint32_t, bool>>> tp_move_bean;
-extern std::unordered_map<int, std::unordered_map<std::pair<uint32_t, int>, std::pair<short, short>, myhash<uint32_t, int>>> tp_score_bean;
 namespace board{
     class AIBoard5;
+
+//AI5全局置换表, 定长数组, 搜索过程中不分配内存. 默认在进程私有内存中, AttachShared()之后放在POSIX共享内存中,
+//同一台机器上的多个进程(如gunicorn的多个worker)共用一张表. 表项都是64位原子字, 无锁读写,
+//每项两个字data和check = data ^ tag, tag = key | generation << 32;
+//读到其他线程/进程写了一半的表项或者其他generation的表项时校验失败, 当作没有命中:
+//tp_score: (zobrist_key, depth * 2 + turn) --> (lower, upper)
+//tp_move: (zobrist_key, turn) --> move
+//generation 0由所有对局搜索共用; 限时评估在对局私有的小表上每次用NewGeneration()得到新的generation,
+//只看到本次评估写入的表项, 相当于每个根节点清空一次表.
+//共享表中其他进程(或其他根节点)留下的表项与本进程中之前的搜索留下的一样: 根节点分数由局面算出, 但着法分数与路径有关,
+//这些界只是近似, 能加快对局搜索, 不保证与空表时的结果相同; 限时评估不读这张表, 结果与其他进程无关
+class TranspositionTable5{
+public:
+    //score_size, move_size是2的幂
+    explicit TranspositionTable5(uint32_t score_size = TP5_SCORE_SIZE, uint32_t move_size = TP5_MOVE_SIZE);
+    ~TranspositionTable5();
+    TranspositionTable5(const TranspositionTable5&) = delete;
+    TranspositionTable5& operator=(const TranspositionTable5&) = delete;
+    inline bool ProbeScore(uint32_t key, int depth_turn, uint32_t generation, std::pair<short, short>& entry) const {
+        const std::atomic<uint64_t>* e = _score + 2 * (size_t)_score_index(key, depth_turn);
+        const uint64_t data = e[0].load(std::memory_order_relaxed);
+        const uint64_t check = e[1].load(std::memory_order_relaxed);
+        if((data & SCORE_VALID) && (data ^ check) == _tag(key, generation) && (uint16_t)(data >> 32) == (uint16_t)depth_turn){
+            entry = {(short)(uint16_t)data, (short)(uint16_t)(data >> 16)};
+            return true;
+        }
+        return false;
+    }
+    inline void StoreScore(uint32_t key, int depth_turn, uint32_t generation, const std::pair<short, short>& entry){
+        std::atomic<uint64_t>* e = _score + 2 * (size_t)_score_index(key, depth_turn);
+        const uint64_t data = (uint64_t)(uint16_t)entry.first | ((uint64_t)(uint16_t)entry.second << 16) | \
+            ((uint64_t)(uint16_t)depth_turn << 32) | SCORE_VALID;
+        e[0].store(data, std::memory_order_relaxed);
+        e[1].store(data ^ _tag(key, generation), std::memory_order_relaxed);
+    }
+    inline bool ProbeMove(uint32_t key, bool turn, uint32_t generation, std::pair<unsigned char, unsigned char>& move) const {
+        const std::atomic<uint64_t>* e = _move + 2 * (size_t)(key & (_move_size - 1));
+        const uint64_t data = e[0].load(std::memory_order_relaxed);
+        const uint64_t check = e[1].load(std::memory_order_relaxed);
+        if((data & MOVE_VALID) && (data ^ check) == _tag(key, generation) && (bool)((data >> 32) & 1) == turn){
+            move = {(unsigned char)(data >> 40), (unsigned char)(data >> 48)};
+            return true;
+        }
+        return false;
+    }
+    inline void StoreMove(uint32_t key, bool turn, uint32_t generation, const std::pair<unsigned char, unsigned char>& move){
+        std::atomic<uint64_t>* e = _move + 2 * (size_t)(key & (_move_size - 1));
+        const uint64_t data = ((uint64_t)turn << 32) | ((uint64_t)move.first << 40) | ((uint64_t)move.second << 48) | MOVE_VALID;
+        e[0].store(data, std::memory_order_relaxed);
+        e[1].store(data ^ _tag(key, generation), std::memory_order_relaxed);
+    }
+    //新的generation(不为0), 之前generation的表项都作废; 计数器在表头中, 共享内存中的表由所有进程共用
+    uint32_t NewGeneration(){
+        uint32_t generation = 0;
+        while(generation == 0){
+            generation = (uint32_t)(_base[GENERATION_WORD].fetch_add(1, std::memory_order_relaxed) + 1);
+        }
+        return generation;
+    }
+    void Clear(){
+        for(size_t i = 0; i < 2 * ((size_t)_score_size + _move_size); ++i){
+            _score[i].store(0, std::memory_order_relaxed); //_move紧跟在_score后面
+        }
+    }
+    //分数表的占用率, 按前1/32的条目估计(下标是散列过的, 分布均匀)
+    double Fill() const {
+        const uint32_t SAMPLE = _score_size >> 5;
+        uint32_t used = 0;
+        for(uint32_t i = 0; i < SAMPLE; ++i){
+            used += (_score[2 * i].load(std::memory_order_relaxed) & SCORE_VALID) != 0;
+        }
+        return (double)used / SAMPLE;
+    }
+    //把置换表换到名为name(如"/jieqi-tt")的POSIX共享内存段中, 段不存在时创建; 原来的内容不会复制过去.
+    //只能在没有搜索进行时调用. 失败(不支持共享内存, 段的布局不同等)时返回false, 继续使用原来的表
+    bool AttachShared(const char* name);
+    //换回进程私有的空表, unlink为true时同时删除共享内存段
+    void DetachShared(bool unlink = false);
+    bool Shared() const {
+        return _shared;
+    }
+private:
+    static constexpr uint64_t SCORE_VALID = 1ull << 48;
+    static constexpr uint64_t MOVE_VALID = 1ull << 56;
+    static constexpr uint64_t MAGIC = 0x4a49455154543502ull; //共享内存段的头, 表项格式改变时修改最后一个字节
+    static constexpr size_t HEADER_WORDS = 8;
+    static constexpr size_t GENERATION_WORD = 1; //头中的generation计数器
+    static_assert(std::atomic<uint64_t>::is_always_lock_free, "transposition table entries must be lock-free");
+    static inline uint64_t _tag(uint32_t key, uint32_t generation){
+        return (uint64_t)key | ((uint64_t)generation << 32);
+    }
+    inline uint32_t _score_index(uint32_t key, int depth_turn) const {
+        return (key ^ ((uint32_t)depth_turn * 0x9E3779B1u)) & (_score_size - 1);
+    }
+    size_t _bytes() const {
+        return (HEADER_WORDS + 2 * ((size_t)_score_size + _move_size)) * sizeof(uint64_t);
+    }
+    void _use(std::atomic<uint64_t>* base, bool shared);
+    void _release();
+    std::atomic<uint64_t>* _base = nullptr;
+    std::atomic<uint64_t>* _score = nullptr;
+    std::atomic<uint64_t>* _move = nullptr;
+    const uint32_t _score_size;
+    const uint32_t _move_size;
+    bool _shared = false;
+    std::string _shared_name;
+};
 }
 
+extern board::TranspositionTable5 tp_table5;
+
 typedef short(*SCORE5)(board::AIBoard5* bp, const char* state_pointer, unsigned char src, unsigned char dst);
 typedef void(*KONGTOUPAO_SCORE5)(board::AIBoard5* bp, short* kongtoupao_score, short* kongtoupao_score_opponent);
 typedef std::string(*THINKER5)(board::AIBoard5* bp);
@@ -92,21 +209,45 @@ public:
     short kongtoupao_score = 0;
     short kongtoupao_score_opponent = 0;
     uint32_t zobrist_hash = 0;
+    uint32_t king_zone_hash = 0; //只包含ScanProtectors()读取的格子
     char state_red[MAX];
     char state_black[MAX];
-    std::stack<std::tuple<unsigned char, unsigned char, char>> cache;
+    BitPosition bitpos; //与state_red同步的位棋盘
+    //以下按ply下标的数组记录悔棋信息, 搜索中不分配堆内存
+    int ply = 0;
+    std::tuple<unsigned char, unsigned char, char> cache[MAX_PLY]; //(from, to, eat)
     short score;//局面分数
     short pst[123][256];
-    std::stack<short> score_cache;
-    std::unordered_set<uint32_t> zobrist_cache;
-    std::unordered_map<uint32_t, int> zobrist_repetition_counts;
-    std::set<unsigned char> rooted_chesses;
-    //tp_move: (zobrist_key, turn) --> move
-    std::unordered_map<std::pair<uint32_t, bool>, std::pair<unsigned char, unsigned char>, myhash<uint32_t, bool>>* tp_move;
-    //tp_score: (zobrist_key, turn, depth <depth * 2 + turn>) --> (lower, upper)
-    std::unordered_map<std::pair<uint32_t, int>, std::pair<short, short>, myhash<uint32_t, int>>* tp_score;
+    short score_cache[MAX_PLY];
+    uint32_t zobrist_cache[MAX_PLY]; //(zobrist_hash << 1) | turn
+    TranspositionTable5* tp_table;
     std::unordered_map<std::string, bool>* hist;
+    std::vector<uint32_t> hist_zobrist; //hist中局面的zobrist, 已排序
     std::unordered_map<std::string, std::pair<unsigned char, unsigned char>> kaijuku;
+    //迭代加深每完成一层时调用: (深度, 走子方视角的分数, 走子方视角的src, dst, 用时毫秒), 供Python端推送搜索进度
+    std::function<void(int, short, unsigned char, unsigned char, int)> on_depth;
+    //置为true时正在进行的搜索尽快返回(其他线程调用), 中断后的结果不写入置换表
+    std::atomic<bool> stop{false};
+    //迭代加深的最大深度和时间预算(毫秒), 完成一层后超过预算就不再加深
+    int max_depth = 7;
+    int movetime = 15000;
+    //搜索的节点数, 置换表探测/命中次数和最后一次搜索完成的深度, 每次搜索前由bindings清零, 供Python端统计
+    uint64_t nodes = 0;
+    uint64_t tt_probes = 0;
+    uint64_t tt_hits = 0;
+    int completed_depth = 0;
+    //timed为true时超过deadline置timed_out(每1024个节点检查一次时间), node_limit不为0时节点数达到node_limit也置timed_out,
+    //与stop一样中断搜索; 两者分开, 限时评估结束时只清除自己的超时状态, 不会吞掉其他线程发来的stop
+    bool timed = false;
+    bool timed_out = false;
+    std::chrono::steady_clock::time_point deadline;
+    uint64_t node_limit = 0;
+    //对局搜索用全局的tp_table5, generation为0; 限时评估换成对局私有的eval_table(第一次评估时分配),
+    //每次评估用一个新的generation, 看不到之前评估的表项, 也不会被其他对局的搜索覆盖
+    uint32_t tt_generation = 0;
+    std::unique_ptr<TranspositionTable5> eval_table;
+    //最后一次限时评估是否由节点预算结束(没有被deadline或stop打断), 这时结果只取决于局面和预算
+    bool eval_exact = false;
     AIBoard5() noexcept;
     AIBoard5(const char another_state[MAX], bool turn, int round, const unsigned char di[VERSION_MAX][2][123], short score, std::unordered_map<std::string, bool>* hist) noexcept;
     AIBoard5(const AIBoard5& another_board) = delete;
@@ -118,12 +259,26 @@ public:
         return _myname;
     }
     bool Move(const unsigned char encode_from, const unsigned char encode_to, short score_step);
+    bool InHistory() const;
     void NULLMove();
     void UndoMove(int type);
     short ScanProtectors();
     void Scan();
+    inline bool Stopped() const {
+        return stop || timed_out;
+    }
+    inline bool Aborted(){
+        ++nodes;
+        if(timed && (nodes & 1023) == 0 && std::chrono::steady_clock::now() > deadline){
+            timed_out = true;
+        }
+        if(node_limit && nodes >= node_limit){
+            timed_out = true;
+        }
+        return Stopped();
+    }
     void KongTouPao(const char* _state_pointer, int pos, bool t);
-    template<bool needscore, bool return_after_mate> 
+    template<bool needscore, bool return_after_mate, bool captures_only = false>
     bool GenMovesWithScore(std::tuple<short, unsigned char, unsigned char> legal_moves[MAX_POSSIBLE_MOVES], int& num_of_legal_moves, std::pair<unsigned char, unsigned char>* killer, short& killer_score, unsigned char& mate_src, unsigned char& mate_dst, bool& killer_is_alive);
     template<bool doublereverse> bool Mate();
     bool Executed(bool* oppo_mate, std::tuple<short, unsigned char, unsigned char> legal_moves_tmp[], int num_of_legal_moves_tmp, bool calc);
@@ -251,11 +406,17 @@ private:
     const char* _kaijuku_file;
     std::string _myname;
     uint32_t _zobrist[123][256];
+    bool _king_zone[256];
+    scanentry _scan_cache[EVAL_CACHE_SIZE];
+    protectorentry _protector_cache[PROTECTOR_CACHE_SIZE];
     bool _has_initialized = false;
     static const int _chess_board_size;
     static const char _initial_state[MAX];
     static const std::unordered_map<std::string, std::string> _uni_pieces;
     static char _dir[91][8];
+    //_dir和score_bean5等注册表是所有实例共用的, 只在第一个实例构造时初始化一次:
+    //搜索时释放了GIL, 新建实例时其他实例可能正在另一个线程中读取它们
+    static std::once_flag _static_once;
     SCORE5 _score_func = NULL;
     KONGTOUPAO_SCORE5 _kongtoupao_score_func = NULL;
     THINKER5 _thinker_func = NULL;
@@ -270,29 +431,57 @@ private:
         return ret;
     };
     std::function<void(void)> _initialize_zobrist = [this](){
+        //种子只取决于暗子分布aidi: 同一分布下每个实例, 每次set_board生成的键都相同, 置换表中的结果在多次搜索之间
+        //仍然有效; 分布不同时暗子的估值不同, 键也不同. (原来每个键都新建一个mt19937, 一次要近100毫秒)
+        uint32_t seed = 2166136261u;
+        const unsigned char* di_bytes = &aidi[0][0][0];
+        for(size_t k = 0; k < sizeof(aidi); ++k){
+            seed = (seed ^ di_bytes[k]) * 16777619u;
+        }
+        std::mt19937 gen(seed);
         for(int i = 0; i < 123; ++i){
             for(int j = 0; j < 256; ++j){
                 if(i != '.'){
-                    _zobrist[i][j] = randU32();
+                    _zobrist[i][j] = gen();
 				}
                 else
                     _zobrist[i][j] = 0;
             }
         }
+        king_zone_hash = 0;
         for(int j = 51; j <= 203; ++j){
             if(::isalpha(state_red[j])){
                 zobrist_hash ^= _zobrist[(int)state_red[j]][j];
+                if(_king_zone[j]){
+                    king_zone_hash ^= _zobrist[(int)state_red[j]][j];
+                }
             }
         }
     };
-    void _initialize_dir();
+    //对state_red[pos]处的棋子异或zobrist, Move/UndoMove中成对调用
+    inline void _toggle_zobrist(unsigned char pos){
+        const uint32_t z = _zobrist[(int)state_red[pos]][pos];
+        zobrist_hash ^= z;
+        if(_king_zone[pos]){
+            king_zone_hash ^= z;
+        }
+    }
+    template<bool captures_only, typename F>
+    bool _ForEachMoveMailbox(const char* _state_pointer, F&& emit);
+    static void _initialize_dir();
+    void _initialize_king_zone();
+    void _initialize_hist_zobrist();
+    void _clear_eval_cache();
+    void _scan();
+    short _scan_protectors();
 };
 }
 
 std::string mtd_thinker5(board::AIBoard5* self);
+short mtd_evaluate5(board::AIBoard5* self, int budget_ms, int* reached_depth);
 void complicated_kongtoupao_score_function5(board::AIBoard5* board_pointer, short* kongtoupao_score, short* kongtoupao_score_opponent);
 short complicated_score_function5(board::AIBoard5* bp, const char* state_pointer, unsigned char src, unsigned char dst);
-short mtd_quiescence5(board::AIBoard5* self, const short gamma, int quiesc_depth, const bool root);
-short mtd_alphabeta5(board::AIBoard5* self, const short gamma, int depth, const bool root, const bool nullmove, const bool lastmate, const int quiesc_depth, const bool traverse_all_strategy);
+short mtd_quiescence5(board::AIBoard5* self, const short gamma, const int qply, const bool root);
+short mtd_alphabeta5(board::AIBoard5* self, const short gamma, int depth, const bool root, const bool nullmove, const bool lastmate, const bool traverse_all_strategy);
 
 #endif
@@ -0,0 +1,197 @@
+#include "bitposition.h"
+
+signed char SQ256_TO_90[256];
+unsigned char SQ90_TO_256[90];
+unsigned char SQ_ROW[90];
+unsigned char SQ_COL[90];
+bitboard KING_MOVES[2][90];
+bitboard ADVISOR_MOVES[90];
+bitboard DARK_ADVISOR_MOVES[2][90];
+bitboard PAWN_MOVES[2][90];
+bitboard DARK_PAWN_MOVES[2][90];
+bitboard SOUTH_RAY[2][90];
+leaper KNIGHT[90];
+leaper DARK_KNIGHT[2][90];
+leaper ELEPHANT[90];
+leaper DARK_ELEPHANT[2][90];
+unsigned short RANK_SLIDE[9][512];
+unsigned short RANK_CANNON[9][512];
+unsigned short FILE_SLIDE[10][1024];
+unsigned short FILE_CANNON[10][1024];
+bitboard FILE_SCATTER[9][1024];
+
+namespace{
+//side方视角下的(row, col) -> 红方视角的sq, 越界返回-1
+inline int perspective_sq(int side, int row, int col){
+    if(row < 0 || row > 9 || col < 0 || col > 8){
+        return -1;
+    }
+    return side ? row * 9 + col : 89 - (row * 9 + col);
+}
+
+inline int perspective_row(int side, int sq){
+    return side ? SQ_ROW[sq] : 9 - SQ_ROW[sq];
+}
+
+inline int perspective_col(int side, int sq){
+    return side ? SQ_COL[sq] : 8 - SQ_COL[sq];
+}
+
+//dr, dc: 目标相对起点的偏移; lr, lc: 马腿/象眼相对起点的偏移
+void add_leaper(leaper& l, int side, int sq, int dr, int dc, int lr, int lc){
+    const int row = perspective_row(side, sq), col = perspective_col(side, sq);
+    const int target = perspective_sq(side, row + dr, col + dc);
+    if(target < 0){
+        return;
+    }
+    l.target[l.count] = (unsigned char)target;
+    l.leg[l.count] = (unsigned char)perspective_sq(side, row + lr, col + lc);
+    ++l.count;
+}
+
+void add_step(bitboard& b, int side, int sq, int dr, int dc){
+    const int target = perspective_sq(side, perspective_row(side, sq) + dr, perspective_col(side, sq) + dc);
+    if(target >= 0){
+        b |= BB(target);
+    }
+}
+
+//size格的一行(列)中, 位于pos的车/炮在占位occ下的走法(车含第一个阻挡子, 炮为隔子吃的目标)
+void initialize_line(int size, int pos, int occ, unsigned short& slide, unsigned short& cannon){
+    slide = cannon = 0;
+    for(int d = -1; d <= 1; d += 2){
+        bool screen = false;
+        for(int x = pos + d; x >= 0 && x < size; x += d){
+            if(!screen){
+                slide |= (1 << x);
+                if(occ & (1 << x)){
+                    screen = true;
+                }
+            }else if(occ & (1 << x)){
+                cannon |= (1 << x);
+                break;
+            }
+        }
+    }
+}
+}
+
+void InitializeBitTables(){
+    memset(SQ256_TO_90, -1, sizeof(SQ256_TO_90));
+    for(int sq = 0; sq < 90; ++sq){
+        SQ_ROW[sq] = sq / 9;
+        SQ_COL[sq] = sq % 9;
+        SQ90_TO_256[sq] = (unsigned char)(195 - 16 * SQ_ROW[sq] + SQ_COL[sq]);
+        SQ256_TO_90[SQ90_TO_256[sq]] = (signed char)sq;
+    }
+
+    for(int c = 0; c < 9; ++c){
+        for(int occ = 0; occ < 512; ++occ){
+            initialize_line(9, c, occ, RANK_SLIDE[c][occ], RANK_CANNON[c][occ]);
+        }
+    }
+    for(int r = 0; r < 10; ++r){
+        for(int occ = 0; occ < 1024; ++occ){
+            initialize_line(10, r, occ, FILE_SLIDE[r][occ], FILE_CANNON[r][occ]);
+        }
+    }
+    for(int c = 0; c < 9; ++c){
+        for(int mask = 0; mask < 1024; ++mask){
+            bitboard b = 0;
+            for(int r = 0; r < 10; ++r){
+                if(mask & (1 << r)){
+                    b |= BB(r * 9 + c);
+                }
+            }
+            FILE_SCATTER[c][mask] = b;
+        }
+    }
+
+    memset(KNIGHT, 0, sizeof(KNIGHT));
+    memset(DARK_KNIGHT, 0, sizeof(DARK_KNIGHT));
+    memset(ELEPHANT, 0, sizeof(ELEPHANT));
+    memset(DARK_ELEPHANT, 0, sizeof(DARK_ELEPHANT));
+    for(int side = 0; side < 2; ++side){
+        for(int sq = 0; sq < 90; ++sq){
+            const int row = perspective_row(side, sq), col = perspective_col(side, sq);
+            //帅: 九宫内一步
+            KING_MOVES[side][sq] = 0;
+            const int kdr[4] = {1, 0, -1, 0}, kdc[4] = {0, 1, 0, -1};
+            for(int k = 0; k < 4; ++k){
+                const int r = row + kdr[k], c = col + kdc[k];
+                if(r >= 0 && r <= 2 && c >= 3 && c <= 5){
+                    KING_MOVES[side][sq] |= BB(perspective_sq(side, r, c));
+                }
+            }
+            //仕: 明仕可以出九宫; 暗仕只能走到九宫中心
+            if(side){
+                ADVISOR_MOVES[sq] = 0;
+                add_step(ADVISOR_MOVES[sq], side, sq, 1, 1);
+                add_step(ADVISOR_MOVES[sq], side, sq, -1, 1);
+                add_step(ADVISOR_MOVES[sq], side, sq, 1, -1);
+                add_step(ADVISOR_MOVES[sq], side, sq, -1, -1);
+            }
+            DARK_ADVISOR_MOVES[side][sq] = 0;
+            if(row == 0 && (col == 3 || col == 5)){
+                DARK_ADVISOR_MOVES[side][sq] = BB(perspective_sq(side, 1, 4));
+            }
+            //兵: 过河后可以横走; 暗兵只能前进
+            PAWN_MOVES[side][sq] = 0;
+            DARK_PAWN_MOVES[side][sq] = 0;
+            add_step(PAWN_MOVES[side][sq], side, sq, 1, 0);
+            add_step(DARK_PAWN_MOVES[side][sq], side, sq, 1, 0);
+            if(row >= 5){
+                add_step(PAWN_MOVES[side][sq], side, sq, 0, 1);
+                add_step(PAWN_MOVES[side][sq], side, sq, 0, -1);
+            }
+            SOUTH_RAY[side][sq] = 0;
+            for(int r = row - 1; r >= 0; --r){
+                SOUTH_RAY[side][sq] |= BB(perspective_sq(side, r, col));
+            }
+            //马/象左右对称, 只需要填一次
+            if(side){
+                add_leaper(KNIGHT[sq], side, sq, 2, 1, 1, 0);
+                add_leaper(KNIGHT[sq], side, sq, 1, 2, 0, 1);
+                add_leaper(KNIGHT[sq], side, sq, -1, 2, 0, 1);
+                add_leaper(KNIGHT[sq], side, sq, -2, 1, -1, 0);
+                add_leaper(KNIGHT[sq], side, sq, -2, -1, -1, 0);
+                add_leaper(KNIGHT[sq], side, sq, -1, -2, 0, -1);
+                add_leaper(KNIGHT[sq], side, sq, 1, -2, 0, -1);
+                add_leaper(KNIGHT[sq], side, sq, 2, -1, 1, 0);
+                add_leaper(ELEPHANT[sq], side, sq, 2, 2, 1, 1);
+                add_leaper(ELEPHANT[sq], side, sq, -2, 2, -1, 1);
+                add_leaper(ELEPHANT[sq], side, sq, 2, -2, 1, -1);
+                add_leaper(ELEPHANT[sq], side, sq, -2, -2, -1, -1);
+            }
+            //暗马/暗相只能向前
+            add_leaper(DARK_KNIGHT[side][sq], side, sq, 2, 1, 1, 0);
+            add_leaper(DARK_KNIGHT[side][sq], side, sq, 1, 2, 0, 1);
+            add_leaper(DARK_KNIGHT[side][sq], side, sq, 1, -2, 0, -1);
+            add_leaper(DARK_KNIGHT[side][sq], side, sq, 2, -1, 1, 0);
+            add_leaper(DARK_ELEPHANT[side][sq], side, sq, 2, 2, 1, 1);
+            add_leaper(DARK_ELEPHANT[side][sq], side, sq, 2, -2, 1, -1);
+        }
+    }
+}
+
+board::BitPosition::BitPosition() noexcept{
+    static const bool initialized = (InitializeBitTables(), true);
+    (void)initialized;
+    memset(pieces, 0, sizeof(pieces));
+    memset(occupied, 0, sizeof(occupied));
+    memset(rank_occ, 0, sizeof(rank_occ));
+    memset(file_occ, 0, sizeof(file_occ));
+}
+
+void board::BitPosition::Set(const char* state_red){
+    memset(pieces, 0, sizeof(pieces));
+    memset(occupied, 0, sizeof(occupied));
+    memset(rank_occ, 0, sizeof(rank_occ));
+    memset(file_occ, 0, sizeof(file_occ));
+    for(int sq = 0; sq < 90; ++sq){
+        const char p = state_red[SQ90_TO_256[sq]];
+        if(isalpha(p)){
+            _put(sq, p);
+        }
+    }
+}
@@ -0,0 +1,176 @@
+/*
+* 90格位棋盘(bitboard)表示, 供AIBoard5生成着法和判断将军
+* 坐标: sq = row * 9 + col, row = 0为红方底线, 与256格表示的换算为 195 - 16 * row + col
+*/
+#ifndef bitposition_h
+#define bitposition_h
+
+#include <stdint.h>
+#include <string.h>
+#include <ctype.h>
+
+typedef unsigned __int128 bitboard;
+#define BB(sq) (((bitboard)1) << (sq))
+
+//跳子(马/相)走法: target[k]需要leg[k](马腿/象眼)为空
+struct leaper{
+    unsigned char count;
+    unsigned char target[8];
+    unsigned char leg[8];
+};
+
+extern signed char SQ256_TO_90[256];
+extern unsigned char SQ90_TO_256[90];
+extern unsigned char SQ_ROW[90];
+extern unsigned char SQ_COL[90];
+//[2]: 0黑方, 1红方, 各自视角下"向前"不同
+extern bitboard KING_MOVES[2][90];
+extern bitboard ADVISOR_MOVES[90];
+extern bitboard DARK_ADVISOR_MOVES[2][90];
+extern bitboard PAWN_MOVES[2][90];
+extern bitboard DARK_PAWN_MOVES[2][90];
+extern bitboard SOUTH_RAY[2][90]; //暗车不能后退
+extern leaper KNIGHT[90];
+extern leaper DARK_KNIGHT[2][90];
+extern leaper ELEPHANT[90];
+extern leaper DARK_ELEPHANT[2][90];
+//车炮按行/列占位查表
+extern unsigned short RANK_SLIDE[9][512];
+extern unsigned short RANK_CANNON[9][512];
+extern unsigned short FILE_SLIDE[10][1024];
+extern unsigned short FILE_CANNON[10][1024];
+extern bitboard FILE_SCATTER[9][1024];
+void InitializeBitTables();
+
+inline int PopLSB(bitboard& b){
+    const uint64_t lo = (uint64_t)b;
+    const int idx = lo ? __builtin_ctzll(lo) : 64 + __builtin_ctzll((uint64_t)(b >> 64));
+    b &= b - 1;
+    return idx;
+}
+
+namespace board{
+class BitPosition{
+public:
+    bitboard pieces[123];
+    bitboard occupied[2]; //0: 黑方(小写), 1: 红方(大写)
+    unsigned short rank_occ[10];
+    unsigned short file_occ[9];
+    BitPosition() noexcept;
+    //state_red: 256格红方视角棋盘
+    void Set(const char* state_red);
+    //from, to为256格红方视角坐标; moved: 原棋子, placed: 到达后的棋子(暗子走后变为U/u), eat: 被吃的子
+    inline void Move(unsigned char from, unsigned char to, char moved, char placed, char eat){
+        _remove(SQ256_TO_90[from], moved);
+        if(eat != '.'){
+            _remove(SQ256_TO_90[to], eat);
+        }
+        _put(SQ256_TO_90[to], placed);
+    }
+    inline void UndoMove(unsigned char from, unsigned char to, char moved, char placed, char eat){
+        _remove(SQ256_TO_90[to], placed);
+        if(eat != '.'){
+            _put(SQ256_TO_90[to], eat);
+        }
+        _put(SQ256_TO_90[from], moved);
+    }
+    //与AIBoard5的mailbox生成器相同的接口: emit(src, dst)使用走子方视角的256格坐标, 返回true时立即停止
+    template<bool captures_only, typename F>
+    bool ForEachMove(bool red, F&& emit) const {
+        const bitboard enemy = occupied[red ? 0 : 1];
+        return _ForEachPieceTargets(red, [&](int from, bitboard targets) -> bool {
+            if(captures_only){
+                targets &= enemy;
+            }
+            const unsigned char src = red ? SQ90_TO_256[from] : 254 - SQ90_TO_256[from];
+            while(targets){
+                const int to = PopLSB(targets);
+                if(emit(src, (unsigned char)(red ? SQ90_TO_256[to] : 254 - SQ90_TO_256[to]))){
+                    return true;
+                }
+            }
+            return false;
+        });
+    }
+    //red方是否可以吃掉对方的将/帅
+    bool KingCapturable(bool red) const {
+        const bitboard king = pieces[red ? (int)'k' : (int)'K'];
+        if(!king){
+            return false;
+        }
+        return _ForEachPieceTargets(red, [king](int, bitboard targets) -> bool {
+            return (targets & king) != 0;
+        });
+    }
+
+private:
+    inline void _put(int sq, char c){
+        const bitboard b = BB(sq);
+        pieces[(int)c] |= b;
+        occupied[isupper(c) ? 1 : 0] |= b;
+        rank_occ[SQ_ROW[sq]] |= (1 << SQ_COL[sq]);
+        file_occ[SQ_COL[sq]] |= (1 << SQ_ROW[sq]);
+    }
+    inline void _remove(int sq, char c){
+        const bitboard b = ~BB(sq);
+        pieces[(int)c] &= b;
+        occupied[isupper(c) ? 1 : 0] &= b;
+        rank_occ[SQ_ROW[sq]] &= ~(1 << SQ_COL[sq]);
+        file_occ[SQ_COL[sq]] &= ~(1 << SQ_ROW[sq]);
+    }
+    inline bitboard _rook(int sq) const {
+        const int r = SQ_ROW[sq], c = SQ_COL[sq];
+        return (((bitboard)RANK_SLIDE[c][rank_occ[r]]) << (9 * r)) | FILE_SCATTER[c][FILE_SLIDE[r][file_occ[c]]];
+    }
+    inline bitboard _cannon(int sq, bitboard all) const {
+        const int r = SQ_ROW[sq], c = SQ_COL[sq];
+        const bitboard capture = (((bitboard)RANK_CANNON[c][rank_occ[r]]) << (9 * r)) | FILE_SCATTER[c][FILE_CANNON[r][file_occ[c]]];
+        return (_rook(sq) & ~all) | capture;
+    }
+    inline bitboard _leaper(const leaper& l, bitboard all) const {
+        bitboard targets = 0;
+        for(int k = 0; k < l.count; ++k){
+            if(!(all & BB(l.leg[k]))){
+                targets |= BB(l.target[k]);
+            }
+        }
+        return targets;
+    }
+    //f(from, targets): targets已去掉本方棋子
+    template<typename F>
+    bool _ForEachPieceTargets(bool red, F&& f) const {
+        static const char kinds[] = "RNBAKCPDEFGHI";
+        const int side = red ? 1 : 0;
+        const int lower = red ? 0 : 32;
+        const bitboard own = occupied[side];
+        const bitboard all = occupied[0] | occupied[1];
+        for(const char* kind = kinds; *kind; ++kind){
+            bitboard bb = pieces[(int)*kind + lower];
+            while(bb){
+                const int sq = PopLSB(bb);
+                bitboard targets = 0;
+                switch(*kind){
+                    case 'R': targets = _rook(sq); break;
+                    case 'D': targets = _rook(sq) & ~SOUTH_RAY[side][sq]; break;
+                    case 'C': case 'H': targets = _cannon(sq, all); break;
+                    case 'N': targets = _leaper(KNIGHT[sq], all); break;
+                    case 'E': targets = _leaper(DARK_KNIGHT[side][sq], all); break;
+                    case 'B': targets = _leaper(ELEPHANT[sq], all); break;
+                    case 'F': targets = _leaper(DARK_ELEPHANT[side][sq], all); break;
+                    case 'A': targets = ADVISOR_MOVES[sq]; break;
+                    case 'G': targets = DARK_ADVISOR_MOVES[side][sq]; break;
+                    case 'P': targets = PAWN_MOVES[side][sq]; break;
+                    case 'I': targets = DARK_PAWN_MOVES[side][sq]; break;
+                    case 'K': targets = KING_MOVES[side][sq] | (_rook(sq) & pieces[red ? (int)'k' : (int)'K']); break; //对脸
+                }
+                if(f(sq, targets & ~own)){
+                    return true;
+                }
+            }
+        }
+        return false;
+    }
+};
+}
+
+#endif
@@ -180,6 +180,34 @@ void board::Board::initialize_di(){
     memmove(this -> di_black, this -> di, sizeof(this -> di));
 }
 
+void board::Board::initialize_di_unknown(){
+    //暗子可能是初始15个子中还没有翻开的任何一个(被吃掉的暗子也不知道是什么), 所以di取这些子的全体;
+    //initialize_di按GenerateRandomMap随机抽出的子计数, 同一局面每次得到的暗子分布都不同
+    memset(this -> di, 0, sizeof(this -> di));
+    const char pieces[] = {'R', 'R', 'N', 'N', 'B', 'B', 'A', 'A', 'C', 'C', 'P', 'P', 'P', 'P', 'P'};
+    for(int i = 0; i < VERSION_MAX; ++i){
+        for(const char c : pieces){
+            ++di[i][1][(int)c];
+            ++di[i][0][(int)swapcase(c)];
+        }
+    }
+    for(int pos = 51; pos <= 203; ++pos){
+        const char c = state_red[pos];
+        if(::isupper(c) && c != 'K' && MINGZI.find(c) != std::string::npos){
+            for(int i = 0; i < VERSION_MAX; ++i){
+                di[i][1][(int)c] -= di[i][1][(int)c] > 0;
+            }
+        }
+        if(::islower(c) && c != 'k' && MINGZI.find(swapcase(c)) != std::string::npos){
+            for(int i = 0; i < VERSION_MAX; ++i){
+                di[i][0][(int)c] -= di[i][0][(int)c] > 0;
+            }
+        }
+    }
+    memmove(this -> di_red, this -> di, sizeof(this -> di));
+    memmove(this -> di_black, this -> di, sizeof(this -> di));
+}
+
 void board::Board::_initialize_dir(){
     memset(_dir, 0, sizeof(_dir));
     _dir[(int)'P'][0] = NORTH;
@@ -71,6 +71,7 @@ public:
     Board() noexcept;
     void Reset(std::unordered_map<bool, std::unordered_map<unsigned char, char>>* random_map);
     void initialize_di();
+    void initialize_di_unknown(); //不知道暗子真实身份时(如web端传入的局面)用, 不依赖random_map
     const std::vector<std::string>& GetHistory() const;
     std::vector<std::string> GetStateString() const;
     bool GetTurn() const;
@@ -153,4 +153,32 @@ struct tp{
    int recordplace;
 };
 
+//Scan()结果缓存, key = zobrist
+struct scanentry{
+   uint32_t key;
+   bool turn;
+   bool valid;
+   unsigned char all;
+   unsigned char che;
+   unsigned char che_opponent;
+   unsigned char zu;
+   unsigned char covered;
+   unsigned char covered_opponent;
+   unsigned char kongtoupao;
+   unsigned char kongtoupao_opponent;
+   short score_rough;
+   short kongtoupao_score;
+   short kongtoupao_score_opponent;
+};
+
+//ScanProtectors()结果缓存, key = 九宫及兵临九宫区域的zobrist签名
+struct protectorentry{
+   uint32_t key;
+   bool turn;
+   bool valid;
+   unsigned char protector;
+   unsigned char protector_oppo;
+   short bonus;
+};
+
 #endif
@@ -0,0 +1,149 @@
+// 检查AIBoard5的稳态搜索不分配堆内存: 先搜索一次预热(置换表, 历史局面等), 再统计第二次mtd_thinker5期间的
+// operator new和malloc/calloc/realloc调用次数, 不为0时返回非0
+// 用法: alloc_test <score.conf路径>, 在cppjieqi目录下运行(开局库从../kaijuku读取)
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include <atomic>
+#include <new>
+#include <string>
+#include <unordered_map>
+#include "../board/board.h"
+#include "../board/aiboard5.h"
+#include "../global/global.h"
+
+extern short pstglobal[5][123][256];
+extern bool read_score_table(const char* score_file, short pst[123][256]);
+extern void IntializeL1();
+
+static std::atomic<bool> counting{false};
+static std::atomic<size_t> allocations{0};
+
+static inline void count_allocation(){
+    if(counting.load(std::memory_order_relaxed)){
+        allocations.fetch_add(1, std::memory_order_relaxed);
+    }
+}
+
+void* operator new(size_t size){
+    count_allocation();
+    if(void* p = malloc(size ? size : 1)){
+        return p;
+    }
+    throw std::bad_alloc();
+}
+void* operator new[](size_t size){
+    return operator new(size);
+}
+void* operator new(size_t size, const std::nothrow_t&) noexcept{
+    count_allocation();
+    return malloc(size ? size : 1);
+}
+void* operator new[](size_t size, const std::nothrow_t& tag) noexcept{
+    return operator new(size, tag);
+}
+void operator delete(void* p) noexcept{ free(p); }
+void operator delete[](void* p) noexcept{ free(p); }
+void operator delete(void* p, size_t) noexcept{ free(p); }
+void operator delete[](void* p, size_t) noexcept{ free(p); }
+
+#ifdef __GLIBC__
+//glibc中malloc等可以被替换, 真正的分配交给__libc_*; operator new内部的malloc也会被计数一次, 只影响次数不影响结论
+extern "C" void* __libc_malloc(size_t size);
+extern "C" void* __libc_calloc(size_t n, size_t size);
+extern "C" void* __libc_realloc(void* p, size_t size);
+extern "C" void* malloc(size_t size){
+    count_allocation();
+    return __libc_malloc(size);
+}
+extern "C" void* calloc(size_t n, size_t size){
+    count_allocation();
+    return __libc_calloc(n, size);
+}
+extern "C" void* realloc(void* p, size_t size){
+    count_allocation();
+    return __libc_realloc(p, size);
+}
+#endif
+
+//与bindings.cpp中的set_board相同: 90个字符的棋盘(红方视角, 从上到下)设置到AIBoard5上
+static void set_board(board::AIBoard5* ai, const char* board_str, bool is_red_turn){
+    board::Board setup_board;
+    setup_board.turn = is_red_turn;
+    setup_board.round = 1;
+    for(int r = 0; r < 10; ++r){
+        for(int c = 0; c < 9; ++c){
+            setup_board.state_red[setup_board.translate_x_y(r, c)] = board_str[r * 9 + c];
+        }
+    }
+    memcpy(setup_board.state_black, setup_board.state_red, 257);
+    setup_board.rotate(setup_board.state_black);
+    setup_board.initialize_di_unknown();
+    ai -> turn = is_red_turn;
+    ai -> round = 1;
+    memcpy(ai -> state_red, setup_board.state_red, 257);
+    memcpy(ai -> state_black, setup_board.state_black, 257);
+    ai -> CopyData(is_red_turn ? setup_board.di_red : setup_board.di_black);
+    ai -> Reset();
+    ai -> Scan();
+}
+
+int main(int argc, char** argv){
+    if(argc < 2){
+        fprintf(stderr, "usage: %s score.conf\n", argv[0]);
+        return 2;
+    }
+    IntializeL1();
+    memset(pstglobal, 0, sizeof(pstglobal));
+    if(!read_score_table(argv[1], pstglobal[3])){
+        fprintf(stderr, "failed to read %s\n", argv[1]);
+        return 2;
+    }
+
+    //预热用开局红方b2e2翻出炮, 黑方h7e7翻出炮之后的局面(与web端测试用的局面相同), 统计用左右对称的另一个局面,
+    //置换表中没有它的结果, 第二次搜索同样要完整地迭代加深
+    const char* warmup_board =
+        "DEFGKGFED"
+        "........."
+        "....C..H."
+        "I.I.I.I.I"
+        "........."
+        "........."
+        "i.i.i.i.i"
+        ".h..c...."
+        "........."
+        "defgkgfed";
+    const char* board_str =
+        "DEFGKGFED"
+        "........."
+        ".H..C...."
+        "I.I.I.I.I"
+        "........."
+        "........."
+        "i.i.i.i.i"
+        "....c..h."
+        "........."
+        "defgkgfed";
+    char initial_state[257] = {0};
+    unsigned char di[VERSION_MAX][2][123] = {{{0}}};
+    std::unordered_map<std::string, bool> hist;
+    hist["x"] = true;
+    board::AIBoard5 ai(initial_state, true, 0, di, 0, &hist);
+
+    set_board(&ai, warmup_board, true);
+    std::string warmup = mtd_thinker5(&ai);
+
+    set_board(&ai, board_str, true);
+    allocations = 0;
+    counting = true;
+    std::string move = mtd_thinker5(&ai);
+    counting = false;
+
+    printf("warm-up move %s, move %s, %zu allocations\n", warmup.c_str(), move.c_str(), allocations.load());
+    if(move.size() != 4 || allocations != 0){
+        printf("FAILED\n");
+        return 1;
+    }
+    printf("OK\n");
+    return 0;
+}
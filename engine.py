@@ -0,0 +1,384 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+统一的引擎接口: 让Python代码可以用同一套方法驱动C++引擎(cppjieqi)和Python引擎(musesfish_pvs)
+
+局面表示与web/app.py一致:
+    board: 90个字符的字符串, 第r行第c列为board[r * 9 + c], r = 0为红方底线, 大写为红方
+    red_turn: 是否轮到红方走
+    history: 之前出现过的局面(同样是90个字符的字符串)
+走法统一使用红方视角的UCCI表示, 例如兵一进一为'i3i4'
+
+用法:
+    python engine.py bench [cpp|muses] [positions] [depth]
+    python engine.py match [cpp|muses] [cpp|muses] [games] [movetime]
+"""
+
+import sys
+import time
+import random
+import math
+from collections import namedtuple
+
+import musesfish_pvs as muses
+
+# search()的结果
+# move -- 最佳走法(UCCI), 没有可走的棋时为None
+# score -- 走子方视角的分数, 引擎不提供时为None
+# depth -- 完成的搜索深度, 引擎不提供时为None
+# nodes -- 搜索的节点数, 引擎不提供时为None
+# time -- 用时(秒)
+# trace -- 每完成一层的(depth, time, nodes), 用于统计time-to-depth
+SearchResult = namedtuple('SearchResult', 'move score depth nodes time trace')
+
+DARK_PIECES = 'DEFGHIdefghi'
+MAX_DEPTH = 32
+DARK_COUNT = {'R': 2, 'N': 2, 'B': 2, 'A': 2, 'C': 2, 'P': 5}
+_BLANK_256 = (' ' * 15 + '\n') * 16
+
+
+def square(ucci):
+    # 'a0' -> 90格下标
+    return int(ucci[1]) * 9 + ord(ucci[0]) - ord('a')
+
+
+def ucci_square(sq):
+    row, col = divmod(sq, 9)
+    return chr(col + ord('a')) + str(row)
+
+
+def board_from_256(board):
+    # musesfish的256格红方视角棋盘 -> 90格字符串
+    return ''.join(board[195 - 16 * (k // 9) + k % 9] for k in range(90))
+
+
+def board_to_256(board, red_turn):
+    # 90格字符串 -> musesfish的走子方视角256格棋盘(走子方为大写)
+    b = list(_BLANK_256)
+    for k, p in enumerate(board):
+        i = 195 - 16 * (k // 9) + k % 9
+        if red_turn:
+            b[i] = p
+        else:
+            b[254 - i] = p.swapcase()
+    return ''.join(b)
+
+
+INITIAL_BOARD = board_from_256(muses.initial_covered)
+
+
+def make_move(board, move, red_turn, reveal=None):
+    ''' 在90格棋盘上走一步, 返回(新棋盘, 被吃的子). 暗子走动后翻开为reveal '''
+    src, dst = square(move[:2]), square(move[2:])
+    p, eat = board[src], board[dst]
+    if p in DARK_PIECES:
+        if reveal is None:
+            raise ValueError("move %s needs the identity of the dark piece" % move)
+        p = reveal.upper() if red_turn else reveal.lower()
+    b = list(board)
+    b[src], b[dst] = '.', p
+    return ''.join(b), eat
+
+
+class Engine(object):
+    """
+    引擎接口. 子类实现_load(), _search()和_evaluate(), 走法和局面的记录由基类完成
+    """
+    name = 'engine'
+
+    def __init__(self):
+        self.board = INITIAL_BOARD
+        self.red_turn = True
+        self.history = []
+        self.searches = 0
+        self.total_nodes = 0
+        self.total_time = 0.0
+        self.last = None
+
+    def set_position(self, board, red_turn=True, history=()):
+        self.board = board
+        self.red_turn = red_turn
+        self.history = list(history)
+        self._load()
+
+    def apply_move(self, move, reveal=None):
+        ''' 走一步, 暗子走动时需要给出翻开后的棋子reveal '''
+        board, eat = make_move(self.board, move, self.red_turn, reveal)
+        self.set_position(board, not self.red_turn, self.history + [self.board])
+        return eat
+
+    def search(self, depth=None, movetime=None):
+        ''' 搜索到depth层或者用时超过movetime秒为止, 返回SearchResult '''
+        start = time.time()
+        result = self._search(depth, movetime)
+        result = result._replace(time=time.time() - start)
+        self.searches += 1
+        self.total_nodes += result.nodes or 0
+        self.total_time += result.time
+        self.last = result
+        return result
+
+    def evaluate(self):
+        ''' 走子方视角的静态评估 '''
+        return self._evaluate()
+
+    def stats(self):
+        return {
+            'engine': self.name,
+            'searches': self.searches,
+            'nodes': self.total_nodes,
+            'time': round(self.total_time, 3),
+            'nps': int(self.total_nodes / self.total_time) if self.total_time > 0 else 0,
+            'last_depth': self.last.depth if self.last else 0,
+        }
+
+    def close(self):
+        pass
+
+    def _load(self):
+        raise NotImplementedError
+
+    def _search(self, depth, movetime):
+        raise NotImplementedError
+
+    def _evaluate(self):
+        raise NotImplementedError
+
+
+class CppEngine(Engine):
+    """
+    cppjieqi(AIBoard5)的适配器. 注意C++引擎的迭代加深固定在5~7层, depth只作为上限, movetime只在
+    每层结束后检查; 也不导出分数, 深度和节点数, 所以score/depth/nodes为None
+    """
+    name = 'cppjieqi'
+
+    def __init__(self):
+        import cppjieqi
+        self.cpp = cppjieqi
+        cppjieqi.initialize()
+        self.game_id = cppjieqi.create_game()
+        super(CppEngine, self).__init__()
+        self._load()
+
+    def close(self):
+        if self.game_id is not None:
+            self.cpp.delete_game(self.game_id)
+            self.game_id = None
+
+    def _load(self):
+        self.cpp.set_board(self.game_id, self.board, self.red_turn, self.history)
+
+    def _search(self, depth, movetime):
+        move = self.cpp.get_ai_move(self.game_id, depth or 8,
+                                    movetime=int(movetime * 1000) if movetime is not None else 15000)
+        if not move or 'ERROR' in move or len(move) != 4:
+            move = None
+        # Think()会改动内部状态, 重新设置一次局面
+        self._load()
+        return SearchResult(move, None, None, None, 0.0, [])
+
+    def _evaluate(self):
+        return self.cpp.get_board_evaluation(self.game_id)
+
+
+class MusesfishEngine(Engine):
+    """
+    musesfish_pvs的适配器. 每个实例有自己的Context和Searcher, 置换表在多次搜索之间保留
+    """
+    name = 'musesfish'
+
+    def __init__(self, workers=muses.SEARCH_WORKERS):
+        self.ctx = muses.Context()
+        self.searcher = muses.Searcher(self.ctx, workers=workers)
+        super(MusesfishEngine, self).__init__()
+        self._load()
+
+    def close(self):
+        self.searcher.close()
+
+    def _load(self):
+        # 暗子的可能数目: 初始数目减去场上已经翻开的明子(被吃掉的明子无从得知, 所以sumall可能偏大)
+        ctx = self.ctx
+        r, b = dict(DARK_COUNT), {k.lower(): v for k, v in DARK_COUNT.items()}
+        for p in self.board:
+            if p in r:
+                r[p] = max(0, r[p] - 1)
+            elif p in b:
+                b[p] = max(0, b[p] - 1)
+        ctx.di = {0: {True: r, False: b}}
+        ctx.sumall = {0: {True: sum(r.values()), False: sum(b.values())}}
+        self.searcher.calc_average()
+        # 历史局面从对手视角记录, 与main()中ctx.setcache()的用法一致, 供generate_forbiddenmoves()使用
+        ctx.cache = {}
+        for board in self.history:
+            ctx.setcache(board_to_256(board, not self.red_turn))
+        pos = muses.Position(board_to_256(self.board, self.red_turn), 0, self.red_turn, 0, ctx).set()
+        self.pos = pos._replace(score=pos.score_rough + pos.kongtou_score - pos.kongtou_score_opponent).set()
+
+    def _to_ucci(self, move):
+        i, j = move if self.red_turn else (254 - move[0], 254 - move[1])
+        return muses.render(i) + muses.render(j)
+
+    def _search(self, depth, movetime):
+        start = time.time()
+        pos = self.pos
+        muses.generate_forbiddenmoves(pos, check_bozi=False)
+        best, trace = SearchResult(None, None, 0, 0, 0.0, []), []
+        # 只给movetime时一直加深到超时为止
+        maxdepth = depth or (MAX_DEPTH if movetime is not None else 1)
+        for d, move, score in self.searcher.search(pos, maxdepth=maxdepth):
+            trace.append((d, time.time() - start, self.searcher.nodes))
+            if move is not None:
+                best = SearchResult(self._to_ucci(move), score, d, self.searcher.nodes, 0.0, trace)
+            if movetime is not None and time.time() - start > movetime:
+                break
+        self.pos.set()
+        return best._replace(nodes=self.searcher.nodes, trace=trace)
+
+    def _evaluate(self):
+        return self.pos.score_rough + self.pos.kongtou_score - self.pos.kongtou_score_opponent
+
+
+ENGINES = {'cpp': CppEngine, 'muses': MusesfishEngine}
+
+
+###############################################################################
+# Benchmark and tournament
+###############################################################################
+
+class Game(object):
+    """
+    裁判: 保存真实的暗子身份, 用musesfish的走法生成判断走法是否合法
+    """
+
+    def __init__(self, seed=None):
+        rand = random.Random(seed)
+        self.board = INITIAL_BOARD
+        self.red_turn = True
+        self.history = []
+        self.moves = []
+        self.identity = {}
+        for red in (True, False):
+            squares = [k for k, p in enumerate(self.board) if p in (DARK_PIECES[:6] if red else DARK_PIECES[6:])]
+            pieces = [p if red else p.lower() for p, n in DARK_COUNT.items() for _ in range(n)]
+            rand.shuffle(pieces)
+            self.identity.update(zip(squares, pieces))
+
+    def legal_moves(self):
+        pos = muses.Position(board_to_256(self.board, self.red_turn), 0, self.red_turn, 0, None)
+        moves = []
+        for i, j in pos.gen_moves():
+            if not self.red_turn:
+                i, j = 254 - i, 254 - j
+            moves.append(muses.render(i) + muses.render(j))
+        return moves
+
+    def play(self, move):
+        ''' 走一步, 返回被吃的子 '''
+        src = square(move[:2])
+        board, eat = make_move(self.board, move, self.red_turn, self.identity.get(src))
+        self.identity.pop(src, None)
+        self.history.append(self.board)
+        self.moves.append(move)
+        self.board, self.red_turn = board, not self.red_turn
+        return eat
+
+
+def random_positions(n=8, plies=16, seed=2021):
+    ''' 从初始局面随机走plies步得到的n个中局局面, 返回[(board, red_turn, history)] '''
+    rand = random.Random(seed)
+    positions = []
+    while len(positions) < n:
+        game = Game(rand.random())
+        for _ in range(plies):
+            moves = [m for m in game.legal_moves() if game.board[square(m[2:])] not in 'Kk']
+            if not moves:
+                break
+            game.play(rand.choice(moves))
+        else:
+            positions.append((game.board, game.red_turn, game.history))
+    return positions
+
+
+def benchmark(engine, positions=None, depth=None, movetime=None):
+    '''
+    在一组局面上搜索, 统计NPS和每一层的平均完成时间(time-to-depth)
+    '''
+    positions = random_positions() if positions is None else positions
+    to_depth = {}
+    for n, (board, red_turn, history) in enumerate(positions):
+        engine.set_position(board, red_turn, history)
+        result = engine.search(depth, movetime)
+        for d, t, _ in result.trace:
+            to_depth.setdefault(d, []).append(t)
+        print("position %d: %s score %s depth %s nodes %s time %.3fs" % (
+            n, result.move, result.score, result.depth, result.nodes, result.time))
+    stats = engine.stats()
+    stats['time_to_depth'] = {d: round(sum(t) / len(t), 3) for d, t in sorted(to_depth.items())}
+    print(stats)
+    return stats
+
+
+def play_game(red, black, movetime=None, depth=None, max_plies=200, seed=None):
+    '''
+    red和black对弈一局, 返回1(红胜), 0(和棋)或-1(黑胜)以及Game. 走出不合法的棋或无棋可走判负
+    '''
+    game = Game(seed)
+    engines = (red, ) if red is black else (red, black)  # 自己和自己下时只维护一份局面
+    for engine in engines:
+        engine.set_position(game.board, game.red_turn, game.history)
+    while len(game.moves) < max_plies:
+        engine = red if game.red_turn else black
+        sign = 1 if game.red_turn else -1
+        move = engine.search(depth, movetime).move
+        if move not in game.legal_moves():
+            return -sign, game
+        reveal = game.identity.get(square(move[:2]))
+        if game.play(move) in 'Kk':
+            return sign, game
+        for e in engines:
+            e.apply_move(move, reveal)
+    return 0, game
+
+
+def tournament(engine_a, engine_b, games=2, movetime=None, depth=None, max_plies=200, seed=2021):
+    '''
+    engine_a和engine_b交换先后手对弈games局, 返回engine_a的胜/和/负和估计的Elo差
+    '''
+    rand = random.Random(seed)
+    wins = draws = losses = 0
+    for n in range(games):
+        game_seed = rand.random()
+        a_red = n % 2 == 0
+        red, black = (engine_a, engine_b) if a_red else (engine_b, engine_a)
+        result, game = play_game(red, black, movetime, depth, max_plies, game_seed)
+        result = result if a_red else -result
+        wins, draws, losses = wins + (result > 0), draws + (result == 0), losses + (result < 0)
+        print("game %d: %s(%s) vs %s, %s, %d plies" % (
+            n, engine_a.name, 'red' if a_red else 'black', engine_b.name, {1: 'win', 0: 'draw', -1: 'loss'}[result],
+            len(game.moves)))
+    score = (wins + draws / 2) / games
+    elo = -400 * math.log10(1 / score - 1) if 0 < score < 1 else (math.inf if score else -math.inf)
+    print("%s vs %s: +%d =%d -%d, elo %+.0f" % (engine_a.name, engine_b.name, wins, draws, losses, elo))
+    return {'wins': wins, 'draws': draws, 'losses': losses, 'elo': elo}
+
+
+def main(argv):
+    if len(argv) > 1 and argv[1] == 'match':
+        a, b = ENGINES[argv[2]](), ENGINES[argv[3]]()
+        games = int(argv[4]) if len(argv) > 4 else 2
+        movetime = float(argv[5]) if len(argv) > 5 else 1.0
+        tournament(a, b, games, movetime=movetime)
+        a.close()
+        b.close()
+    else:
+        e = ENGINES[argv[2] if len(argv) > 2 else 'muses']()
+        positions = int(argv[3]) if len(argv) > 3 else 8
+        depth = int(argv[4]) if len(argv) > 4 else None
+        benchmark(e, random_positions(positions), depth=depth)
+        e.close()
+
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -4,9 +4,12 @@
 #Updated by Si Miao 2021/05/20
 from __future__ import print_function
 import re, sys, time
-from itertools import count
+from itertools import chain, count, takewhile
 from collections import namedtuple
 import random
+import heapq
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 from board import board, common_20210604_fixed as common, library
 from copy import deepcopy
 import readline
@@ -14,38 +17,16 @@ import json
 
 NULLMOVE = True
 QS = True
+ARRAY_POSITION = True # 搜索时使用可原地走子/撤销的ArrayPosition
 
 debug_var = ''
 B = board.Board()
 piece = {'P': 44, 'N': 108, 'B': 23, 'R': 233, 'A': 23, 'C': 101, 'K': 2500}
 put = lambda board, i, p: board[:i] + p + board[i+1:]
-r = {'R': 2, 'N': 2, 'B': 2, 'A': 2, 'C': 2, 'P': 5}
-b = {'r': 2, 'n': 2, 'b': 2, 'a': 2, 'c': 2, 'p': 5}
-di = {0: {True: deepcopy(r), False: deepcopy(b)}}
-sumall = {
-    0: {True: sum(di[0][True][key] for key in di[0][True]), False: sum(di[0][False][key] for key in di[0][False])}}
 # 子力价值表参考“象眼”
-cache = {}
-forbidden_moves = set()
 kaijuku = deepcopy(library.kaijuku)
 
 
-def setcache(bo):
-    if bo not in cache:
-        cache[bo] = 1
-    else:
-        cache[bo] += 1
-
-
-def resetrbdict():
-    global r, b, di, sumall
-    r = {'R': 2, 'N': 2, 'B': 2, 'A': 2, 'C': 2, 'P': 5}
-    b = {'r': 2, 'n': 2, 'b': 2, 'a': 2, 'c': 2, 'p': 5}
-    di = {0: {True: deepcopy(r), False: deepcopy(b)}}
-    sumall = {
-        0: {True: sum(di[0][True][key] for key in di[0][True]), False: sum(di[0][False][key] for key in di[0][False])}}
-
-
 pst = deepcopy(common.pst)
 discount_factor = common.discount_factor  # 1.6
 
@@ -176,6 +157,120 @@ directions = {
     'K': (N, E, S, W)
 }
 
+
+###############################################################################
+# Move tables
+# 每种棋子在每个位置上的走法在导入时预先算好, 走子生成只需查表再判断占位
+###############################################################################
+
+def on_board(i):
+    return 3 <= i >> 4 <= 12 and 3 <= i & 15 <= 11
+
+
+def _build_rays(p):
+    # 车/暗车/炮/暗炮: 每个方向上依次经过的格子
+    rays = {}
+    for i in range(51, 204):
+        if on_board(i):
+            rays[i] = tuple(tuple(takewhile(on_board, count(i + d, d))) for d in directions[p])
+    return rays
+
+
+def _build_steps(p):
+    # 其余棋子: (目标格, 马腿/象眼), 没有马腿/象眼时为0
+    steps = {}
+    for i in range(51, 204):
+        if not on_board(i):
+            continue
+        targets = []
+        for d in directions[p]:
+            j = i + d
+            if not on_board(j):
+                continue
+            # 过河的卒/兵才能横着走
+            if p == 'P' and d in (E, W) and i > 128:
+                continue
+            if p == 'K' and (j < 160 or j & 15 > 8 or j & 15 < 6):
+                continue
+            if p == 'G' and j != 183:  # 暗士, 花心坐标: (11, 7), 11 * 16 + 7 = 183
+                continue
+            leg = 0
+            if p in ('N', 'E'):
+                n_diff_x = (j - i) & 15
+                if n_diff_x == 14 or n_diff_x == 2:
+                    leg = i + (1 if n_diff_x == 2 else -1)
+                else:
+                    leg = i + 16 if j > i else i - 16
+            elif p in ('B', 'F'):
+                leg = i + d // 2
+            targets.append((j, leg))
+        steps[i] = tuple(targets)
+    return steps
+
+
+RAYS = {p: _build_rays(p) for p in 'RDCH'}
+STEPS = {p: _build_steps(p) for p in 'PINEBFAGK'}
+FLYING = {i: tuple(range(i - 16, A9, -16)) for i in range(51, 204) if on_board(i)}  # 将帅对脸
+# STEPS的反查表: ATTACKERS[j] = ((起点, 棋子, 马腿/象眼), ...), 即哪些位置上的什么子可以一步走到j
+ATTACKERS = {j: tuple((i, p, leg) for p in STEPS for i in STEPS[p] for t, leg in STEPS[p][i] if t == j)
+             for j in range(51, 204) if on_board(j)}
+
+
+def king_attacked(board, flip=False):
+    '''
+    大写一方能否吃掉小写的将; flip为True时判断小写一方能否吃掉大写的帅
+    从将的位置沿直线扫描车/炮/对脸, 再查ATTACKERS判断其余棋子, 与gen_moves()的走法一致
+    '''
+    if flip:
+        if 'K' not in board: return False
+        t = 254 - board.index('K')
+        get = lambda x: SWAPCASE[board[254 - x]]
+    else:
+        if 'k' not in board: return False
+        t = board.index('k')
+        get = board.__getitem__
+    for d, ray in zip(directions['R'], RAYS['R'][t]):
+        screen = False
+        for j in ray:
+            q = get(j)
+            if q == '.': continue
+            if screen:
+                if q in 'CH': return True
+                break
+            # 暗车不能后退
+            if q == 'R' or (q == 'D' and d != N) or (q == 'K' and d == S): return True
+            screen = True
+    for i, p, leg in ATTACKERS[t]:
+        if get(i) == p and (not leg or get(leg) == '.'): return True
+    return False
+
+
+###############################################################################
+# Zobrist
+# 置换表的键: 棋盘各子的随机数异或, 再并入走子方, 分数(分数与走法有关, 不完全由棋盘决定)
+# 和版本号(估值用average[version], 不同版本的同一局面分数不同)
+###############################################################################
+
+MASK64 = (1 << 64) - 1
+_zobrist_random = random.Random(20210520)
+ZOBRIST = {p: [_zobrist_random.getrandbits(64) for _ in range(256)] for p in 'RNBAKCPDEFGHIUrnbakcpdefghiu'}
+ZOBRIST_TURN = _zobrist_random.getrandbits(64)
+ZOBRIST_DEPTH = [(_zobrist_random.getrandbits(64), _zobrist_random.getrandbits(64)) for _ in range(64)]  # [depth][root]
+
+
+def zobrist_board(board):
+    h = 0
+    for i in range(51, 204):
+        p = board[i]
+        if p in ZOBRIST:
+            h ^= ZOBRIST[p][i]
+    return h
+
+
+def zobrist_key(h, score, turn, version):
+    return h ^ (ZOBRIST_TURN if turn else 0) ^ ((hash(score) * 0x9E3779B97F4A7C15) & MASK64) ^ \
+        ((hash(version) * 0xC2B2AE3D27D4EB4F) & MASK64)
+
 uni_pieces = {
     '.': '．',
     'R': '\033[31m俥\033[0m',
@@ -209,22 +304,22 @@ uni_pieces = {
 MATE_LOWER = piece['K'] - (2*piece['R'] + 2*piece['N'] + 2*piece['B'] + 2*piece['A'] + 2*piece['C'] + 5*piece['P'])
 MATE_UPPER = piece['K'] + (2*piece['R'] + 2*piece['N'] + 2*piece['B'] + 2*piece['A'] + 2*piece['C'] + 5*piece['P'])
 
-# The table size is the maximum number of elements in the transposition table.
-TABLE_SIZE = 1e7
+# The transposition table has 2 ** TABLE_BITS slots.
+TABLE_BITS = 20
 
 # Constants for tuning search
 QS_LIMIT = 219
 EVAL_ROUGHNESS = 13
 DRAW_TEST = True
 THINK_TIME = 1
+SEARCH_WORKERS = 1 # 根节点并行搜索的进程数, 1为单进程搜索
 
 
 ###############################################################################
 # Mapping
-# To be more convenient, we initialize the mapping as a global const dictionary
+# 一盘棋的暗子映射和暗子统计都放在Context中, 由Searcher和Position共用,
+# 这样同一进程里可以同时进行多盘棋/多个搜索
 ###############################################################################
-mapping = {}
-average = {0: {}}
 
 # mapping: 暗子到明子映射
 # di:
@@ -248,18 +343,53 @@ average = {0: {}}
 #               Ture: 不确定子
 #                     pos: 棋盘位置
 #               False: 正在睡觉的暗子
+# cache: 出现过的局面及次数, 用于生成禁着
+# forbidden_moves: 根节点的禁着
+
+
+class Context(object):
+    def __init__(self, mapping=None):
+        self.mapping = {} if mapping is None else mapping
+        self.average = {0: {}}
+        self.cache = {}
+        self.forbidden_moves = set()
+        self.reset()
+
+    def reset(self):
+        r = {'R': 2, 'N': 2, 'B': 2, 'A': 2, 'C': 2, 'P': 5}
+        b = {'r': 2, 'n': 2, 'b': 2, 'a': 2, 'c': 2, 'p': 5}
+        self.di = {0: {True: r, False: b}}
+        self.sumall = {0: {True: sum(r.values()), False: sum(b.values())}}
+
+    def setcache(self, bo):
+        if bo not in self.cache:
+            self.cache[bo] = 1
+        else:
+            self.cache[bo] += 1
 
 ###############################################################################
 # Chess logic
 ###############################################################################
 
-class Position(namedtuple('Position', 'board score turn version')):
+class Position(namedtuple('Position', 'board score turn version ctx')):
     """ A state of a chess game
     board -- a 256 char representation of the board
     score -- the board evaluation
+    ctx -- the Context of the game
     """
+    mutable = False
+    oppo_cache = None
+    oppo_rooted_cache = None
+    move_values = None
+    possible_che = possible_che_opponent = None
+
+    def key(self):
+        # 置换表的键, 与ArrayPosition.key()相等的局面命中同一项
+        return zobrist_key(zobrist_board(self.board), self.score, self.turn, self.version)
 
     def set(self):
+        average = self.ctx.average
+        self.move_values = None
 
         self.che = 0
         self.che_opponent = 0
@@ -314,7 +444,10 @@ class Position(namedtuple('Position', 'board score turn version')):
 
             if p == 'c' and i & 15 == 7:
                 self.check_kongtoupao(i, False)
-       
+
+        return self.calc_kongtou_score()
+
+    def calc_kongtou_score(self):
         if (self.kongtoupao > 0 and self.kongtoupao_opponent <= 0) or (self.kongtoupao > self.kongtoupao_opponent > 0):
             if (self.che >= self.che_opponent and self.che > 0) or self.kongtoupao >= 3:
                 self.kongtou_score += 100
@@ -362,116 +495,122 @@ class Position(namedtuple('Position', 'board score turn version')):
             return
 
     def gen_moves(self):
-        # For each of our pieces, iterate through each possible 'ray' of moves,
-        # as defined in the 'directions' map. The rays are broken e.g. by
-        # captures or immediately in case of pieces such as knights.
+        # For each of our pieces, look up its targets in the precomputed
+        # RAYS/STEPS tables. The rays are broken e.g. by captures, and
+        # crawlers only need their leg/eye square to be empty.
+        board = self.board
         for i in range(51, 204):
 
-            p = self.board[i]
+            p = board[i]
 
             if not p.isupper() or p == 'U': continue
 
-            if p == 'K': 
-                for scanpos in range(i - 16, A9, -16):
-                    if self.board[scanpos] == 'k':
-                        yield (i, scanpos)
-                    elif self.board[scanpos] != '.':
-                        break
-
-            if p in ('C', 'H'): #明暗炮
-                for d in directions[p]:
+            if p in 'CH': #明暗炮
+                for ray in RAYS[p][i]:
                     cfoot = 0
-                    for j in count(i+d, d):
-                        q = self.board[j]
-                        if q.isspace(): break
-                        if cfoot == 0 and q == '.': yield (i, j)
-                        elif cfoot == 0 and q != '.': cfoot += 1
-                        elif cfoot == 1 and q.islower(): yield (i, j); break
-                        elif cfoot == 1 and q.isupper(): break;
-                continue
+                    for j in ray:
+                        q = board[j]
+                        if cfoot == 0:
+                            if q == '.': yield (i, j)
+                            else: cfoot = 1
+                        elif q != '.':
+                            if q.islower(): yield (i, j)
+                            break
 
-            for d in directions[p]:
-                for j in count(i+d, d):
-                    q = self.board[j]
-                    # Stay inside the board, and off friendly pieces
-                    if q.isspace() or q.isupper(): break
-                    # 过河的卒/兵才能横着走
-                    if p == 'P' and d in (E, W) and i > 128: break
-                    # j & 15 等价于 j % 16但是更快
-                    elif p == 'K' and (j < 160 or j & 15 > 8 or j & 15 < 6): break
-                    elif p == 'G' and j != 183: break # 暗士, 花心坐标: (11, 7), 11 * 16 + 7 = 183
-                    elif p in ('N', 'E'): # 暗马
-                        n_diff_x = (j - i) & 15
-                        if n_diff_x == 14 or n_diff_x == 2:
-                            if self.board[i + (1 if n_diff_x == 2 else -1)] != '.': break
-                        else:
-                            if j > i and self.board[i + 16] != '.': break
-                            elif j < i and self.board[i - 16] != '.': break
-                    elif p in ('B', 'F') and self.board[i + d // 2] != '.': break
-                    # Move it
+            elif p in 'RD': #明暗车
+                for ray in RAYS[p][i]:
+                    for j in ray:
+                        q = board[j]
+                        if q.isupper(): break
+                        yield (i, j)
+                        if q != '.': break
+
+            else:
+                if p == 'K':
+                    for scanpos in FLYING[i]:
+                        if board[scanpos] == 'k':
+                            yield (i, scanpos)
+                        elif board[scanpos] != '.':
+                            break
+                for j, leg in STEPS[p][i]:
+                    if board[j].isupper() or (leg and board[leg] != '.'): continue
                     yield (i, j)
-                    # Stop crawlers from sliding, and sliding after captures
-                    if p in 'PNBAKIEFG' or q.islower(): break
 
     def rooted(self):
         '''
         计算有根子
         '''
         rooted_chesses = set()
+        board = self.board
         for i in range(51, 204):
 
-            p = self.board[i]
+            p = board[i]
 
             if not p.isupper() or p == 'U': continue
 
-            if p in ('C', 'H'): #明暗炮
-                for d in directions[p]:
+            if p in 'CH': #明暗炮
+                for ray in RAYS[p][i]:
                     cfoot = 0
-                    for j in count(i+d, d):
-                        q = self.board[j]
-                        if q.isspace(): break
-                        if cfoot == 0 and q == '.': continue
-                        elif cfoot == 0 and q != '.': cfoot += 1
-                        elif cfoot == 1 and q.islower(): break
-                        elif cfoot == 1 and q.isupper(): rooted_chesses.add(j); break
-                    continue
+                    for j in ray:
+                        q = board[j]
+                        if cfoot == 0:
+                            if q != '.': cfoot = 1
+                        elif q != '.':
+                            if q.isupper(): rooted_chesses.add(j)
+                            break
+
+            elif p in 'RD': #明暗车
+                for ray in RAYS[p][i]:
+                    for j in ray:
+                        q = board[j]
+                        if q == '.': continue
+                        if q.isupper(): rooted_chesses.add(j)
+                        break
 
             else:
-                for d in directions[p]:
-                    for j in count(i+d, d):
-                        q = self.board[j]
-                        # Stay inside the board, and off friendly pieces
-                        # 过河的卒/兵才能横着走
-                        if q.isspace() or q.islower(): break
-                        if p == 'P' and d in (E, W) and i > 128: break
-                        # j & 15 等价于 j % 16但是更快
-                        elif p == 'K' and (j < 160 or j & 15 > 8 or j & 15 < 6): break
-                        elif p == 'G' and j != 183: break # 暗士, 花心坐标: (11, 7), 11 * 16 + 7 = 183
-                        elif p in ('N', 'E'): # 暗马
-                            n_diff_x = (j - i) & 15
-                            if n_diff_x == 14 or n_diff_x == 2:
-                                if self.board[i + (1 if n_diff_x == 2 else -1)] != '.': break
-                            else:
-                                if j > i and self.board[i + 16] != '.': break
-                                elif j < i and self.board[i - 16] != '.': break
-                        elif p in ('B', 'F') and self.board[i + d // 2] != '.': break
-                        # Move it
-                        if q.isupper(): rooted_chesses.add(j); break
-                        # Stop crawlers from sliding, and sliding after captures
-                        if p in 'PNBAKIEFG': break
+                for j, leg in STEPS[p][i]:
+                    if board[j].isupper() and not (leg and board[leg] != '.'):
+                        rooted_chesses.add(j)
         return rooted_chesses
 
+    def opponent(self):
+        # 对手视角的局面, 用到时才计算并缓存
+        if self.oppo_cache is None:
+            self.oppo_cache = self.rotate()
+        return self.oppo_cache
+
+    def oppo_rooted(self):
+        # 对方有根子(己方视角的坐标), 用到时才计算并缓存
+        if self.oppo_rooted_cache is None:
+            self.oppo_rooted_cache = set(254 - x for x in self.opponent().rooted())
+        return self.oppo_rooted_cache
+
+    def board_after(self, move):
+        i, j = move
+        return put(put(self.board, j, self.board[i] if self.board[i] in 'RNBAKCP' else 'U'), i, '.')
+
+    def gives_check(self, move):
+        # 走完move后能否吃掉对方的将
+        return king_attacked(self.board_after(move))
+
+    def exposes_king(self, move):
+        # 走完move后对方能否吃掉己方的帅
+        return king_attacked(self.board_after(move), flip=True)
+
+    def in_check(self):
+        return king_attacked(self.board, flip=True)
+
     def rotate(self):
         ''' Rotates the board, preserving enpassant '''
         p = Position(
-            self.board[-2::-1].swapcase() + " ", -self.score, not self.turn, self.version)
+            self.board[-2::-1].swapcase() + " ", -self.score, not self.turn, self.version, self.ctx)
         p.set()
         return p
 
     @staticmethod
-    def rotate_new(board, score, turn, version):
+    def rotate_new(board, score, turn, version, ctx):
         p = Position(
-            board[-2::-1].swapcase() + " ", -score, not turn, version)
+            board[-2::-1].swapcase() + " ", -score, not turn, version, ctx)
         p.set()
         return p
 
@@ -490,11 +629,12 @@ class Position(namedtuple('Position', 'board score turn version')):
         else:
             board = put(self.board, j, 'U')
         board = put(board, i, '.')
-        return Position.rotate_new(board, score, self.turn, self.version)
+        return Position.rotate_new(board, score, self.turn, self.version, self.ctx)
 
     def mymove_check(self, move, discount_red=True, discount_black=False):
         if move is None:
            return self.rotate().set(), None, None, None
+        mapping, di, sumall = self.ctx.mapping, self.ctx.di, self.ctx.sumall
         i, j = move
         # Copy variables and reset ep and kp
         ############################################################################
@@ -545,9 +685,10 @@ class Position(namedtuple('Position', 'board score turn version')):
         board = put(board, i, '.')
         sumall[self.version][True] = sum(di[self.version][True][key] for key in di[self.version][True])
         sumall[self.version][False] = sum(di[self.version][False][key] for key in di[self.version][False])
-        return Position.rotate_new(board, self.score, self.turn, self.version), checkmate, eat, dst
+        return Position.rotate_new(board, self.score, self.turn, self.version, self.ctx), checkmate, eat, dst
 
     def calc(self):
+         di, sumall = self.ctx.di, self.ctx.sumall
          shi_possibility = 0 if sumall[self.version][not self.turn] == 0 else di[self.version][not self.turn]['a' if self.turn else 'A']/sumall[self.version][not self.turn]
          base_possibility = 1
          if self.board[54] == 'g':
@@ -557,13 +698,25 @@ class Position(namedtuple('Position', 'board score turn version')):
          return base_possibility
 
     def value(self, move):
+        # 每步棋的分数只算一次, 走法排序和move()共用; 只和局面有关的量在第一次打分时算好
+        values = self.move_values
+        if values is None:
+            di, sumall = self.ctx.di, self.ctx.sumall
+            values = self.move_values = {}
+            self.possible_che = 0 if sumall[self.version][self.turn] == 0 else self.covered * di[self.version][self.turn][
+                'R' if self.turn else 'r']/sumall[self.version][self.turn]
+            self.possible_che_opponent = 0 if sumall[self.version][not self.turn] == 0 else self.covered_opponent * di[self.version][not self.turn][
+                'r' if self.turn else 'R'] / sumall[self.version][not self.turn]
+        v = values.get(move)
+        if v is None:
+            v = values[move] = self.calc_value(move)
+        return v
+
+    def calc_value(self, move):
+        di, sumall, average = self.ctx.di, self.ctx.sumall, self.ctx.average
         i, j = move
         p, q = self.board[i], self.board[j].upper()
-        possible_che = 0 if sumall[self.version][self.turn] == 0 else self.covered * di[self.version][self.turn][
-            'R' if self.turn else 'r']/sumall[self.version][self.turn]
-        possible_che_opponent = 0 if sumall[self.version][not self.turn] == 0 else self.covered_opponent * di[self.version][not self.turn][
-            'r' if self.turn else 'R'] / sumall[self.version][not self.turn]
-        bing_possibility = 0 if sumall[self.version][self.turn] == 0 else di[self.version][self.turn]['P' if self.turn else 'p']/sumall[self.version][self.turn]
+        possible_che, possible_che_opponent = self.possible_che, self.possible_che_opponent
         # Actual move
         # 这里有一个隐藏的很深的BUG。如果对手走出将帅对饮的一步棋，score应该很高(因为直接赢棋)。但由于减了pst[p][i], 减了自己的皇上，所以代码中的score是接近0的。
         # 因此，当对方是老将时应直接返回最大值，不能考虑己方。
@@ -792,6 +945,203 @@ class Position(namedtuple('Position', 'board score turn version')):
 
         return score
 
+
+SWAPCASE = {c: c.swapcase() for c in ' \n.RNBAKCPDEFGHIUrnbakcpdefghiu'}
+ROTATE = tuple(254 - i for i in range(255)) + (255, ) # 旋转棋盘时的下标对应关系, 第255格为补位的空格
+
+
+class ArrayPosition(object):
+    """ 可原地走子/撤销的局面, 供搜索使用
+    board -- 走子方视角的棋盘, 256个单字符组成的list
+    oppo -- 对手视角的棋盘(board旋转并交换大小写), 走子后两者互换, 旋转不需要重建棋盘
+    其余属性与Position.set()计算的相同, 走子时增量更新
+    """
+    mutable = True
+    oppo_cache = None
+    oppo_rooted_cache = None
+    move_values = None
+    possible_che = possible_che_opponent = None
+    # 撤销走子时需要恢复的属性
+    FEATURES = ('score', 'turn', 'zobrist', 'zobrist_oppo', 'score_rough', 'che', 'che_opponent', 'zu', 'zu_opponent', 'covered', 'covered_opponent',
+                'endline', 'endline_opponent', 'kongtoupao', 'kongtoupao_opponent', 'kongtou_score', 'kongtou_score_opponent',
+                'move_values', 'possible_che', 'possible_che_opponent')
+
+    def __init__(self, pos=None):
+        if pos is None:
+            return
+        self.board = list(pos.board)
+        self.oppo = [SWAPCASE[pos.board[k]] for k in ROTATE]
+        self.score, self.turn, self.version, self.ctx = pos.score, pos.turn, pos.version, pos.ctx
+        self.undo_stack = []
+        self.zobrist = zobrist_board(self.board)
+        self.zobrist_oppo = zobrist_board(self.oppo)
+        self.set()
+
+    def key(self):
+        return zobrist_key(self.zobrist, self.score, self.turn, self.version)
+
+    def set(self):
+        Position.set(self)
+        self.zu_opponent = 0
+        self.endline_opponent = 0
+        for i in range(51, 204):
+            p = self.board[i]
+            if p == 'p':
+                self.zu_opponent += 1
+            elif i >> 4 == 12 and p in 'DEFGRNC':
+                self.endline_opponent += 1
+        return self
+
+    check_kongtoupao = Position.check_kongtoupao
+    calc_kongtou_score = Position.calc_kongtou_score
+    gen_moves = Position.gen_moves
+    rooted = Position.rooted
+    calc = Position.calc
+    value = Position.value
+    calc_value = Position.calc_value
+    opponent = Position.opponent
+    in_check = Position.in_check
+
+    def _after_move_attacked(self, move, flip):
+        # 临时在board上走子, 判断后立即恢复
+        i, j = move
+        board = self.board
+        p, q = board[i], board[j]
+        board[j], board[i] = p if p in 'RNBAKCP' else 'U', '.'
+        attacked = king_attacked(board, flip)
+        board[i], board[j] = p, q
+        return attacked
+
+    def gives_check(self, move):
+        return self._after_move_attacked(move, False)
+
+    def exposes_king(self, move):
+        return self._after_move_attacked(move, True)
+
+    def oppo_rooted(self):
+        if self.oppo_rooted_cache is None:
+            # rooted()只读board, 临时交换两个视角即可, 不需要复制棋盘
+            self.board, self.oppo = self.oppo, self.board
+            rooted = self.rooted()
+            self.board, self.oppo = self.oppo, self.board
+            self.oppo_rooted_cache = set(254 - x for x in rooted)
+        return self.oppo_rooted_cache
+
+    def copy(self):
+        p = ArrayPosition()
+        p.__dict__.update(self.__dict__)
+        p.board = self.board[:]
+        p.oppo = self.oppo[:]
+        p.undo_stack = []
+        p.oppo_cache = p.oppo_rooted_cache = None
+        return p
+
+    def _update(self, i, p, sign):
+        # 在i处加上(sign = 1)或去掉(sign = -1)棋子p, 与Position.set()中的统计一致
+        average = self.ctx.average
+        if p in 'RNBAKCP':
+            self.score_rough += sign * pst[p][i]
+            if p == 'R':
+                self.che += sign
+            elif p == 'P':
+                self.zu += sign
+        elif p in 'DEFGHI':
+            self.covered += sign
+        elif p == 'U':
+            self.score_rough += sign * average[self.version][self.turn][True][i]
+            self.covered += sign
+        elif p in 'rnbakcp':
+            self.score_rough -= sign * pst[p.upper()][254 - i]
+            if p == 'r':
+                self.che_opponent += sign
+            elif p == 'p':
+                self.zu_opponent += sign
+        elif p in 'defghi':
+            self.covered_opponent += sign
+        elif p == 'u':
+            self.score_rough -= sign * average[self.version][not self.turn][True][254 - i]
+            self.covered_opponent += sign
+        if i >> 4 == 3:
+            if p in 'defgrnc':
+                self.endline += sign
+        elif i >> 4 == 12:
+            if p in 'DEFGRNC':
+                self.endline_opponent += sign
+
+    def _kongtou(self):
+        # 空头炮只和中路有关, 重新扫描中路即可
+        self.kongtoupao = 0
+        self.kongtoupao_opponent = 0
+        self.kongtou_score = 0
+        self.kongtou_score_opponent = 0
+        for i in range(55, 204, 16):
+            p = self.board[i]
+            if p == 'C':
+                self.check_kongtoupao(i, True)
+            elif p == 'c':
+                self.check_kongtoupao(i, False)
+        self.calc_kongtou_score()
+
+    def _rotate(self):
+        self.move_values = None
+        self.board, self.oppo = self.oppo, self.board
+        self.zobrist, self.zobrist_oppo = self.zobrist_oppo, self.zobrist
+        self.score, self.turn, self.score_rough = -self.score, not self.turn, -self.score_rough
+        self.che, self.che_opponent = self.che_opponent, self.che
+        self.zu, self.zu_opponent = self.zu_opponent, self.zu
+        self.covered, self.covered_opponent = self.covered_opponent, self.covered
+        self.endline, self.endline_opponent = self.endline_opponent, self.endline
+        self._kongtou()
+
+    def make(self, move):
+        '''
+        原地走子, 结果与Position.move()相同, 需要用unmake()撤销
+        '''
+        i, j = move
+        movevalue = self.value(move)
+        self.oppo_cache = self.oppo_rooted_cache = None
+        board, oppo = self.board, self.oppo
+        p, q = board[i], board[j]
+        self.undo_stack.append((i, j, p, q, tuple(getattr(self, f) for f in ArrayPosition.FEATURES)))
+        placed = p if p in 'RNBAKCP' else 'U'
+        self._update(i, p, -1)
+        if q != '.':
+            self._update(j, q, -1)
+        self._update(j, placed, 1)
+        board[j], board[i] = placed, '.'
+        oppo[254 - j], oppo[254 - i] = SWAPCASE[placed], '.'
+        self.zobrist ^= ZOBRIST[p][i] ^ ZOBRIST[placed][j]
+        self.zobrist_oppo ^= ZOBRIST[SWAPCASE[p]][254 - i] ^ ZOBRIST[SWAPCASE[placed]][254 - j]
+        if q != '.':
+            self.zobrist ^= ZOBRIST[q][j]
+            self.zobrist_oppo ^= ZOBRIST[SWAPCASE[q]][254 - j]
+        self.score = self.score + movevalue if movevalue < MATE_UPPER else MATE_UPPER
+        self._rotate()
+
+    def unmake(self):
+        i, j, p, q, features = self.undo_stack.pop()
+        self.oppo_cache = self.oppo_rooted_cache = None
+        self.board, self.oppo = self.oppo, self.board
+        board, oppo = self.board, self.oppo
+        board[i], board[j] = p, q
+        oppo[254 - i], oppo[254 - j] = SWAPCASE[p], SWAPCASE[q]
+        for f, v in zip(ArrayPosition.FEATURES, features):
+            setattr(self, f, v)
+
+    def rotate(self):
+        p = self.copy()
+        p._rotate()
+        return p
+
+    def nullmove(self):
+        return self.rotate()
+
+    def move(self, move):
+        p = self.copy()
+        p.make(move)
+        p.undo_stack = []
+        return p
+
 ###############################################################################
 # Search logic
 ###############################################################################
@@ -800,18 +1150,63 @@ class Position(namedtuple('Position', 'board score turn version')):
 Entry = namedtuple('Entry', 'lower upper')
 
 
+def best_first(moves, value):
+    '''
+    按value从大到小依次给出走法, 顺序与sorted(moves, key=value, reverse=True)相同,
+    但只在需要下一步时才从堆中取出, 剪枝后剩下的走法不用再排序
+    '''
+    heap = [(-value(move), n, move) for n, move in enumerate(moves)]
+    heapq.heapify(heap)
+    while heap:
+        yield heapq.heappop(heap)[2]
+
+
+class TranspositionTable(object):
+    """ 定长置换表, 用64位Zobrist键的低位定位, 每格只存一个局面
+    new_search()后之前的项全部失效, 不必清空; 同一次搜索中深度不低于原有项才覆盖
+    """
+
+    def __init__(self, bits=TABLE_BITS):
+        self.mask = (1 << bits) - 1
+        self.slots = [None] * (1 << bits)  # (key, age, depth, value)
+        self.age = 0
+
+    def new_search(self):
+        self.age += 1
+
+    def get(self, key, default=None):
+        slot = self.slots[key & self.mask]
+        if slot is not None and slot[0] == key and slot[1] == self.age:
+            return slot[3]
+        return default
+
+    def put(self, key, value, depth=0):
+        index = key & self.mask
+        slot = self.slots[index]
+        if slot is None or slot[0] == key or slot[1] != self.age or depth >= slot[2]:
+            self.slots[index] = (key, self.age, depth, value)
+
+
 class Searcher:
-    def __init__(self):
-        self.tp_score = {}
-        self.tp_move = {}
+    def __init__(self, ctx=None, workers=SEARCH_WORKERS):
+        self.ctx = Context() if ctx is None else ctx
+        self.tp_score = TranspositionTable()
+        self.tp_move = TranspositionTable()
         self.history = set()
         self.nodes = 0
+        self.workers = workers
+        self.pool = None
+        self.shared_alpha = None
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
 
-    def quiescence(self, pos, moves, oppo):
+    def quiescence(self, pos, moves):
+        average = pos.ctx.average
         score = 0
         maxscore = 0
-        oppo_rooted_set = oppo.rooted()
-        oppo_rooted_set = set(map(lambda x: 254-x, oppo_rooted_set)) #对方有根子
         argmax = None
         for move in moves:
             p = pos.board[move[0]]
@@ -830,10 +1225,10 @@ class Searcher:
             if q in 'rcnabpk':
                 score += pst[q.upper()][k]
             elif q in 'defghi':
-                score += average[oppo.version][oppo.turn][False]
+                score += average[pos.version][not pos.turn][False]
             elif q == 'u':
-                score += average[oppo.version][oppo.turn][True][k]
-            if move[1] in oppo_rooted_set:
+                score += average[pos.version][not pos.turn][True][k]
+            if move[1] in pos.oppo_rooted(): #对方有根子
                 if p in 'RCNABPK':
                     score -= pst[p][j]
                 if p in 'EFGHI':
@@ -851,11 +1246,9 @@ class Searcher:
                 gamma <= r <= s(pos)   if gamma <= s(pos)"""
         global debug_var
 
-        oppo = pos.rotate()
-
         if root:
-            self.tp_score = {}
-            self.tp_move = {}
+            self.tp_score.new_search()
+            self.tp_move.new_search()
         self.nodes += 1
 
         # Depth <= 0 is QSearch. Here any position is searched as deeply as is needed for
@@ -870,25 +1263,29 @@ class Searcher:
         if pos.score <= -MATE_LOWER:
             return -MATE_UPPER
 
-        moves = sorted(pos.gen_moves(), key=pos.value, reverse=True)
-        killer = self.tp_move.get(pos)
+        key = pos.key()
+        # 吃将的分数最高, 按生成顺序找到的第一个就是排序后的第一个, 这里不需要打分
+        moves = list(pos.gen_moves())
+        killer = self.tp_move.get(key)
         for move in [killer] + moves:
             if (move is not None) and pos.board[move[1]] == 'k':
-                self.tp_move[pos] = move
+                self.tp_move.put(key, move, depth)
                 return MATE_UPPER
 
         # Look in the table if we have already searched this position before.
         # We also need to be sure, that the stored search was over the same
         # nodes as the current search.
-        entry = self.tp_score.get((pos, depth, root), Entry(-MATE_UPPER, MATE_UPPER))
-        if entry.lower >= beta and (not root or self.tp_move.get(pos) is not None):
+        score_key = key ^ ZOBRIST_DEPTH[depth][root]
+        entry = self.tp_score.get(score_key, Entry(-MATE_UPPER, MATE_UPPER))
+        if entry.lower >= beta and (not root or self.tp_move.get(key) is not None):
             return entry.lower
         if entry.upper < alpha:
             return entry.upper
 
         if nullmove_now and depth > 3 and not root and any(c in pos.board for c in 'RNCI'):
+            oppo = pos.opponent()
             if all(oppo.board[m[1]] != 'k' for m in oppo.gen_moves()):
-               val = -self.alphabeta(pos.rotate(), -beta, 1-beta, depth-3, root=False, nullmove=nullmove, nullmove_now=False)
+               val = -self.alphabeta(oppo, -beta, 1-beta, depth-3, root=False, nullmove=nullmove, nullmove_now=False)
                if val >= beta and self.alphabeta(pos, alpha, beta, depth-3, root=False, nullmove=nullmove, nullmove_now=False):
                   return val
 
@@ -898,7 +1295,8 @@ class Searcher:
         # and not capture anything else.
         if depth == 0:
             if QS:
-                score = self.quiescence(pos, moves, oppo)
+                captures = sorted((m for m in moves if pos.board[m[1]] != '.'), key=pos.value, reverse=True)
+                score = self.quiescence(pos, captures)
                 return pos.score + pos.kongtou_score - pos.kongtou_score_opponent + score[0]
             else:
                 return pos.score + pos.kongtou_score - pos.kongtou_score_opponent
@@ -910,20 +1308,21 @@ class Searcher:
 
         # Then all the other moves
         mvBest = None
+        ordered = best_first(moves, pos.value)
+        first = next(ordered, None)
 
-        for move in [killer] + moves:
-            if root and move in forbidden_moves:
+        for move in chain((killer, first), ordered):
+            if root and move in self.ctx.forbidden_moves:
                 continue
             if (move is not None) and (depth > 0):
                 if best == -MATE_UPPER:
-                    val = -self.alphabeta(pos.move(move), -beta, -alpha, depth - 1, root=False, nullmove=nullmove, nullmove_now=nullmove_now)
+                    val = -self.search_child(pos, move, -beta, -alpha, depth - 1, nullmove, nullmove_now)
                 else:
-                    val = -self.alphabeta(pos.move(move), -alpha - 1, -alpha, depth - 1, root=False, nullmove=nullmove, nullmove_now=nullmove_now)
+                    val = -self.search_child(pos, move, -alpha - 1, -alpha, depth - 1, nullmove, nullmove_now)
                     if val > alpha and val < beta:
-                        val = -self.alphabeta(pos.move(move), -beta, -alpha, depth - 1, root=False, nullmove=nullmove, nullmove_now=nullmove_now)
+                        val = -self.search_child(pos, move, -beta, -alpha, depth - 1, nullmove, nullmove_now)
                 if val >= MATE_UPPER:
-                    updated = pos.move(move).nullmove()
-                    if any(updated.board[m[1]] == 'k' for m in updated.gen_moves()):
+                    if pos.gives_check(move):
                         mvBest = move
                         best = val
                         break
@@ -936,13 +1335,12 @@ class Searcher:
                         alpha = val
                         
         if not mvBest and moves:
-            mvBest = moves[0]
+            mvBest = first
 
         if mvBest is not None:
             # Clear before setting, so we always have a value
             # Save the move for pv construction and killer heuristic
-            if len(self.tp_move) > TABLE_SIZE: self.tp_move.clear()
-            self.tp_move[pos] = mvBest
+            self.tp_move.put(key, mvBest, depth)
 
         # Stalemate checking is a bit tricky: Say we failed low, because
         # we can't (legally) move and so the (real) score is -infty.
@@ -955,22 +1353,27 @@ class Searcher:
         # but only if depth == 1, so that's probably fair enough.
         # (Btw, at depth 1 we can also mate without realizing.)
         if best < alpha and best < 0 and depth > 0:
-            is_dead = lambda pos: any(pos.value(m) >= MATE_LOWER for m in pos.gen_moves())
-            if all(is_dead(pos.move(m)) for m in pos.gen_moves()):
-                in_check = is_dead(pos.nullmove())
-                best = -MATE_UPPER if in_check else 0
+            # all()找到第一步不送将的走法就停止
+            if all(pos.exposes_king(m) for m in pos.gen_moves()):
+                best = -MATE_UPPER if pos.in_check() else 0
 
-        # Clear before setting, so we always have a value
-        if len(self.tp_score) > TABLE_SIZE: self.tp_score.clear()
         # Table part 2
         if best >= beta:
-            self.tp_score[pos, depth, root] = Entry(best, entry.upper)
+            self.tp_score.put(score_key, Entry(best, entry.upper), depth)
         if best < alpha:
-            self.tp_score[pos, depth, root] = Entry(entry.lower, best)
+            self.tp_score.put(score_key, Entry(entry.lower, best), depth)
 
         return best
 
-    def search(self, pos, history=()):
+    def search_child(self, pos, move, alpha, beta, depth, nullmove, nullmove_now):
+        if not pos.mutable:
+            return self.alphabeta(pos.move(move), alpha, beta, depth, root=False, nullmove=nullmove, nullmove_now=nullmove_now)
+        pos.make(move)
+        val = self.alphabeta(pos, alpha, beta, depth, root=False, nullmove=nullmove, nullmove_now=nullmove_now)
+        pos.unmake()
+        return val
+
+    def search(self, pos, history=(), maxdepth=1):
         """ Iterative deepening MTD-bi search """
         self.nodes = 0
         self.calc_average()
@@ -979,20 +1382,66 @@ class Searcher:
         if DRAW_TEST:
             self.history = set(history)
             # print('# Clearing table due to new history')
-            self.tp_score.clear()
+            self.tp_score.new_search()
 
         # In finished games, we could potentially go far enough to cause a recursion
         # limit exception. Hence we bound the ply.
-        for depth in range(1, 2):
+        for depth in range(1, maxdepth + 1):
             # The inner loop is a binary search on the score of the position.
             # Inv: lower <= score <= upper
             # 'while lower != upper' would work, but play tests show a margin of 20 plays
             # better.
             lower, upper = -MATE_UPPER, MATE_UPPER
-            val = self.alphabeta(pos, lower, upper, depth, nullmove=NULLMOVE, nullmove_now=NULLMOVE)
-            yield depth, self.tp_move.get(pos), self.tp_score.get((pos, depth, True), Entry(-MATE_UPPER, MATE_UPPER)).lower
+            if self.workers > 1:
+                val = self.root_split(pos, depth)
+            else:
+                root = ArrayPosition(pos) if ARRAY_POSITION else pos
+                val = self.alphabeta(root, lower, upper, depth, nullmove=NULLMOVE, nullmove_now=NULLMOVE)
+            # 置换表中根节点的下界在这些深度上总是-MATE_UPPER, 直接返回alphabeta的值作为分数
+            yield depth, self.tp_move.get(pos.key()), val
+
+    def root_split(self, pos, depth):
+        '''
+        根节点并行搜索: 每个根节点走法交给一个工作进程, 各进程通过共享内存中的alpha收窄窗口,
+        结果合并到tp_move/tp_score中, 与alphabeta(root=True)的记录方式相同
+        '''
+        self.tp_score.new_search()
+        self.tp_move.new_search()
+        key = pos.key()
+        moves = sorted(pos.gen_moves(), key=pos.value, reverse=True)
+        for move in moves:
+            if pos.board[move[1]] == 'k':
+                self.tp_move.put(key, move, depth)
+                return MATE_UPPER
+        moves = [move for move in moves if move not in self.ctx.forbidden_moves]
+
+        if self.pool is None:
+            self.shared_alpha = multiprocessing.Value('d', -MATE_UPPER)
+            self.pool = ProcessPoolExecutor(self.workers, initializer=_init_root_worker, initargs=(self.shared_alpha, ))
+        self.shared_alpha.value = -MATE_UPPER
+        # 第一个(排序最好的)走法先单独搜完得到alpha, 其余走法再并行用零窗口搜索;
+        # 按排序的顺序提交, 好的走法先搜完, 尽早抬高alpha
+        futures = moves[:1] and [self.pool.submit(_search_root_move, pos, moves[0], depth, True)]
+        if futures:
+            futures[0].result()
+        futures += [self.pool.submit(_search_root_move, pos, move, depth, False) for move in moves[1:]]
+
+        best, mvBest = -MATE_UPPER, None
+        for move, future in zip(moves, futures):
+            val, nodes = future.result()
+            self.nodes += nodes
+            if val > best and val > -MATE_UPPER:
+                best, mvBest = val, move
+        if not mvBest and moves:
+            mvBest = moves[0]
+        if mvBest is not None:
+            self.tp_move.put(key, mvBest, depth)
+        if best >= MATE_UPPER:
+            self.tp_score.put(key ^ ZOBRIST_DEPTH[depth][True], Entry(best, MATE_UPPER), depth)
+        return best
 
     def calc_average(self, version=0):
+        di = self.ctx.di
         numr, numb = sum(di[version][True][key] for key in di[version][True]), sum(di[version][False][key] for key in di[version][False])
         averagecoveredr, averagecoveredb = 0, 0
         averager, averageb = {}, {}
@@ -1032,9 +1481,46 @@ class Searcher:
                 averageb[i] = sumb//numb
 
         self.average = {True: {False: averagecoveredr, True: averager}, False: {False: averagecoveredb, True: averageb}}
-        average[version] = deepcopy(self.average)
+        self.ctx.average[version] = deepcopy(self.average)
         return self.average
 
+# 工作进程中的搜索器和共享的alpha, 由_init_root_worker()设置
+_worker_searcher = None
+_worker_alpha = None
+
+
+def _init_root_worker(shared_alpha):
+    global _worker_searcher, _worker_alpha
+    _worker_searcher = Searcher(workers=1)
+    _worker_alpha = shared_alpha
+
+
+def _search_root_move(pos, move, depth, first):
+    # 在工作进程中搜索根节点的一个走法, 返回(分数, 节点数)
+    searcher = _worker_searcher
+    searcher.ctx = pos.ctx
+    searcher.nodes = 0
+    searcher.tp_score.new_search()
+    searcher.tp_move.new_search()
+    root = ArrayPosition(pos) if ARRAY_POSITION else pos
+    alpha, beta = _worker_alpha.value, MATE_UPPER
+    if first:
+        val = -searcher.search_child(root, move, -beta, -alpha, depth - 1, NULLMOVE, NULLMOVE)
+    else:
+        val = -searcher.search_child(root, move, -alpha - 1, -alpha, depth - 1, NULLMOVE, NULLMOVE)
+        if val > alpha:
+            # 搜索期间其他进程可能已经抬高了alpha, 先用新的alpha做零窗口搜索, 仍然超过时才用全窗口重搜
+            alpha = max(alpha, _worker_alpha.value)
+            if val <= alpha:
+                val = -searcher.search_child(root, move, -alpha - 1, -alpha, depth - 1, NULLMOVE, NULLMOVE)
+            if val > alpha and val < beta:
+                val = -searcher.search_child(root, move, -beta, -alpha, depth - 1, NULLMOVE, NULLMOVE)
+    with _worker_alpha.get_lock():
+        if val > _worker_alpha.value:
+            _worker_alpha.value = val
+    return val, searcher.nodes
+
+
 ###############################################################################
 # User interface
 ###############################################################################
@@ -1078,6 +1564,45 @@ def random_policy(pos):
     return stupid_AI_move
 
 
+def perft(pos, depth):
+    '''
+    A test function that counts the leaf nodes of the move tree, used to check the move generator
+    '''
+    if depth == 0:
+        return 1
+    return sum(perft(pos.move(move), depth - 1) for move in pos.gen_moves())
+
+
+def benchmark_root_split(workers=4, depth=4, positions=5, plies=16, seed=2021):
+    '''
+    A test function that compares the single process search with root_split() on random middlegame positions
+    '''
+    rand = random.Random(seed)
+    ctx = Context(B.translate_mapping(B.mapping))
+    serial, parallel = Searcher(ctx, workers=1), Searcher(ctx, workers=workers)
+    serial.calc_average()
+    total_serial, total_parallel = 0, 0
+    for n in range(positions):
+        pos = Position(initial_covered, 0, True, 0, ctx).set()
+        for _ in range(plies):
+            pos = pos.move(rand.choice([m for m in pos.gen_moves() if pos.board[m[1]] != 'k']))
+        serial.nodes = parallel.nodes = 0
+        start = time.time()
+        val = serial.alphabeta(ArrayPosition(pos), -MATE_UPPER, MATE_UPPER, depth, nullmove=NULLMOVE, nullmove_now=NULLMOVE)
+        t_serial = time.time() - start
+        start = time.time()
+        val_parallel = parallel.root_split(pos, depth)
+        t_parallel = time.time() - start
+        total_serial += t_serial
+        total_parallel += t_parallel
+        print("position %d: serial %.2fs %d nodes (%s, %s), %d workers %.2fs %d nodes (%s, %s)" % (
+            n, t_serial, serial.nodes, val, render_tuple(serial.tp_move.get(pos.key())), workers, t_parallel,
+            parallel.nodes, val_parallel, render_tuple(parallel.tp_move.get(pos.key()))))
+    parallel.close()
+    print("speedup: %.2f" % (total_serial / total_parallel))
+    return total_serial / total_parallel
+
+
 def translate_eat(eat, dst, turn, type):
     assert turn in {'RED', 'BLACK'} and type in {'CLEARMODE', 'DARKMODE'}
     if eat is None or eat == '.':
@@ -1102,13 +1627,12 @@ def generate_forbiddenmoves(pos, check_bozi=True, step=0):
     # 生成禁着
     # 这里禁着判断比较简单，如果走了这步棋以后形成的局面在过往局面中超过3次，不允许电脑走。
     # 这里的pos是电脑视角
-    global forbidden_moves
-    forbidden_moves = set()
+    forbidden_moves = pos.ctx.forbidden_moves = set()
     pos.set()
     moves = pos.gen_moves()
     for move in moves:
         posnew = pos.move(move)
-        if cache.get(posnew.board, 0) > 0:
+        if pos.ctx.cache.get(posnew.board, 0) > 0:
             forbidden_moves.add(move)
         if check_bozi:
             i, j = move
@@ -1134,17 +1658,17 @@ def generate_forbiddenmoves(pos, check_bozi=True, step=0):
     return forbidden_moves
 
 
-def print_cache():
+def print_cache(ctx):
     # 内部调试函数，打印cache
     print("print_cache starts!")
-    for cnt, key in enumerate(cache):
+    for cnt, key in enumerate(ctx.cache):
         print("Cache " + str(cnt) + ":")
-        print_pos(Position(key, 0, True, 0).set())
+        print_pos(Position(key, 0, True, 0, ctx).set())
     print("print_cache ends!")
 
 
-def printmapping():
-    for k, v in mapping.items():
+def printmapping(ctx):
+    for k, v in ctx.mapping.items():
         print(render(k), ':', v)
 
 
@@ -1158,17 +1682,15 @@ def translate_rooted(rooted_chesses, rotated=False):
 
 
 def main(random_move=False, AI=True, debug=False):
-    global mapping
-    resetrbdict()
-    mapping = B.translate_mapping(B.mapping)
+    ctx = Context(B.translate_mapping(B.mapping))
     with open("debug.json", "w") as f:
-         json.dump(mapping, f)
+         json.dump(ctx.mapping, f)
     if debug:
-        hist = [Position(bug, 0, True, 0).set()]
+        hist = [Position(bug, 0, True, 0, ctx).set()]
     else:
-        hist = [Position(initial_covered, 0, True, 0).set()]
-    setcache(hist[-1].board)
-    searcher = Searcher()
+        hist = [Position(initial_covered, 0, True, 0, ctx).set()]
+    ctx.setcache(hist[-1].board)
+    searcher = Searcher(ctx)
     searcher.calc_average()
     myeatlist = []
     AIeatlist = []
@@ -1215,7 +1737,7 @@ def main(random_move=False, AI=True, debug=False):
 
         hist.append(pos)  # move的过程Rotate了一次, 这里pos是电脑视角
         rotated = hist[-1].rotate()  # 玩家视角
-        setcache(rotated.board)
+        ctx.setcache(rotated.board)
 
         # After our move we rotate the board and print it again.
         # This allows us to see the effect of our move.
@@ -1272,7 +1794,7 @@ def main(random_move=False, AI=True, debug=False):
             AIeatlist.append(rendered_eat)
 
         hist.append(pos)
-        setcache(hist[-1].board)
+        ctx.setcache(hist[-1].board)
         
         if debug:
            print("RETURN FROM DEBUG MODE!")
@@ -1052,14 +1052,15 @@ class Searcher:
 
         return best
 
-    def _inner_recur(self, version, uncertainty_dict, uncertainty_keys, len_uncertainty_keys, i, board, score, turn, me=1, op=1, pruning=False):
+    def _inner_recur(self, version, uncertainty_dict, uncertainty_keys, len_uncertainty_keys, i, board, score, turn, pruning=False):
         '''
         uncertainty_dict 记录位置到U/u的映射
         例如board[2] = 'U', 则uncertainty_dict[2] = 'U'。
-        mul_black 黑色子力组合计数
-        mul_red 红色子力组合计数
+        返回(Sscore, S): 子树中各种子力组合的加权分数和与权重和。
+        从剩余子力中选出di_key的权重为选之前的个数。
         '''
         notturn = not turn
+
         if i >= len_uncertainty_keys:
             pos = Position(board, score, turn, version)
             pos.set()
@@ -1075,23 +1076,28 @@ class Searcher:
             ############################################
             result = self.alphabeta_double_recursive(
                 pos, -MATE_UPPER, MATE_UPPER, depth=depths[version], root=True, nullmove=NULLMOVE, nullmove_now=NULLMOVE, version=version, pruning=pruning)
-            self.result_dict[version][board] = (result, me, op)
-            return
+            self.result_dict[version][board] = result
+            return result, 1
 
+        Sscore, S = 0, 0
         key = uncertainty_keys[i]
         if uncertainty_dict[key] == 'U':
             for di_key in di[version][turn]:
                 if di[version][turn][di_key] > 0 and di_key in ('RPC' if turn else 'rpc'):
+                    weight = di[version][turn][di_key]
                     di[version][turn][di_key] -= 1
                     newboard = put(board, key, di_key.upper())
                     score_diff = pst[di_key.upper()][key] - average[version - 1][turn][True][key]
-                    self._inner_recur(version, uncertainty_dict, uncertainty_keys, len_uncertainty_keys, i+1, newboard,
-                                      score+score_diff, turn, me=me*(di[version][turn][di_key]+1), op=op, pruning=pruning)
+                    sub_score, sub_s = self._inner_recur(version, uncertainty_dict, uncertainty_keys, len_uncertainty_keys, i+1, newboard,
+                                                         score+score_diff, turn, pruning=pruning)
+                    Sscore += weight * sub_score
+                    S += weight * sub_s
                     di[version][turn][di_key] += 1
 
         elif uncertainty_dict[key] == 'u':
             for di_key in di[version][notturn]:
                 if di[version][notturn][di_key] > 0 and di_key in ('rpc' if turn else 'RPC'):
+                    weight = di[version][notturn][di_key]
                     di[version][notturn][di_key] -= 1
                     newboard = put(board, key, di_key.lower())
                     rkey = 254 - key
@@ -1108,10 +1114,14 @@ class Searcher:
                     # True, 表示访问的是不确定子的数据。如访问暗子的数据，应该是False。
                     # rkey: 同上。
                     ###################################################################################
-                    self._inner_recur(version, uncertainty_dict, uncertainty_keys, len_uncertainty_keys, i+1, newboard,
-                                      score-score_diff, turn, me=me, op=op*(di[version][notturn][di_key]+1), pruning=pruning)
+                    sub_score, sub_s = self._inner_recur(version, uncertainty_dict, uncertainty_keys, len_uncertainty_keys, i+1, newboard,
+                                                         score-score_diff, turn, pruning=pruning)
+                    Sscore += weight * sub_score
+                    S += weight * sub_s
                     di[version][notturn][di_key] += 1
 
+        return Sscore, S
+
     def evaluate(self, pos, oppo, version, pruning=False):
         if version >= len_depths:
             moves = pos.gen_moves()
@@ -1137,15 +1147,9 @@ class Searcher:
                     uncertainty_dict[i] = x
             uncertainty_keys = list(uncertainty_dict.keys())
             len_uncertainty_keys = len(uncertainty_keys)
-            self._inner_recur(version, uncertainty_dict, uncertainty_keys, len_uncertainty_keys, 0, pos.board, pos.score,
-                              pos.turn, me=1, op=1, pruning=pruning)
-            S = 0  # Sum of Situations
-            Sscore = 0  # Sum of Scores
-            for key in self.result_dict[version]:
-                item = self.result_dict[version][key]
-                combinations = item[1] * item[2]
-                Sscore += item[0] * combinations
-                S += combinations
+            # Sscore: Sum of Scores, S: Sum of Situations
+            Sscore, S = self._inner_recur(version, uncertainty_dict, uncertainty_keys, len_uncertainty_keys, 0, pos.board, pos.score,
+                                          pos.turn, pruning=pruning)
             if S == 0:
                 return 0
             else:
@@ -1154,13 +1158,9 @@ class Searcher:
     def call_evaluate(self, pos, version, pruning=False, printf=True):
         result = self.evaluate(pos, pos.rotate(), version, pruning=pruning)
         if printf:
-            S = 0
             for key in self.result_dict[1]:
                 #print_pos(key)
-                item = self.result_dict[1][key]
-                score, me, op = item[0], item[1], item[2]
-                S += item[1] * item[2]
-                print("score = %s, me = %d, op = %d, S = %s" % (score, me, op, S))
+                print("score = %s" % self.result_dict[1][key])
         print(render_tuple(self.tp_move[pos]))
         return result
 
@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+'''
+web端(app.py)的回归测试. 需要flask和编译好的cppjieqi(所在目录加入PYTHONPATH), 否则跳过
+'''
+import os
+import sys
+import unittest
+
+try:
+    import flask
+    import cppjieqi
+except ImportError:
+    flask = cppjieqi = None
+
+WEB_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'web')
+
+# 红方b2e2翻出炮, 黑方h7e7翻出炮, 红炮打中卒, 黑方b9c7翻出马
+MOVES = ['b2e2C', 'h7e7C', 'e2e6', 'b9c7N']
+
+
+@unittest.skipIf(cppjieqi is None, 'flask or cppjieqi is not available')
+class GameAnalyzerTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        # app导入时创建引擎, 从当前目录的上一级读取score.conf和kaijuku
+        cls.cwd = os.getcwd()
+        os.chdir(WEB_DIR)
+        sys.path.insert(0, WEB_DIR)
+        import app
+        cls.app = app
+
+    @classmethod
+    def tearDownClass(cls):
+        sys.path.remove(WEB_DIR)
+        os.chdir(cls.cwd)
+
+    def analyze(self, analyzer):
+        self.app.result_cache.clear()
+        result = analyzer.analyze(self.app.INITIAL_BOARD, True, MOVES, budget_ms=10)
+        self.assertTrue(result['success'])
+        return result
+
+    def test_same_game_gets_same_timeline(self):
+        # 复盘结果只取决于棋局, 与线程调度, 之前评估过的局面和缓存无关
+        first = self.analyze(self.app.game_analyzer)
+        second = self.analyze(self.app.GameAnalyzer(workers=3))
+        self.assertEqual(len(first['timeline']), len(MOVES) + 1)
+        self.assertEqual(first['timeline'], second['timeline'])
+        self.assertEqual(first['moves'], second['moves'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+'''
+cppjieqi(C++引擎的Python绑定)的回归测试. 需要先编译cppjieqi并把它所在的目录加入PYTHONPATH, 否则跳过
+'''
+import json
+import os
+import subprocess
+import sys
+import unittest
+
+try:
+    import cppjieqi
+except ImportError:
+    cppjieqi = None
+
+WEB_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'web')
+
+# web端的90字符局面, 红方(大写)在上
+INITIAL_BOARD = (
+    'DEFGKGFED'
+    '.........'
+    '.H.....H.'
+    'I.I.I.I.I'
+    '.........'
+    '.........'
+    'i.i.i.i.i'
+    '.h.....h.'
+    '.........'
+    'defgkgfed'
+)
+
+
+def put(board, *changes):
+    board = list(board)
+    for index, piece in changes:
+        board[index] = piece
+    return ''.join(board)
+
+
+# 红方b2e2翻出炮, 黑方h7e7翻出炮
+OPENING = put(INITIAL_BOARD, (19, '.'), (22, 'C'), (70, '.'), (67, 'c'))
+# 红方已经翻出两车两马, 黑方少了两个暗车和两个暗马
+RED_WINNING = put(INITIAL_BOARD, (0, 'R'), (8, 'R'), (1, 'N'), (7, 'N'), (81, '.'), (89, '.'), (82, '.'), (88, '.'))
+# 不在开局库中的历史, 让引擎正常搜索
+HISTORY = ['x', 'y']
+
+# 在单独的进程中运行: argv为(共享内存段名或'', 是否先搜索一步, 局面...), 输出各局面红方走时的评估
+CHILD = '''
+import json, sys
+import cppjieqi
+name, search, boards = sys.argv[1], sys.argv[2] == '1', sys.argv[3:]
+cppjieqi.initialize()
+if name and not cppjieqi.attach_shared_tt(name):
+    sys.exit(3)
+game_id = cppjieqi.create_game()
+if search:
+    cppjieqi.set_board(game_id, boards[0], True, %r)
+    cppjieqi.get_ai_move(game_id, 4, None, 2000)
+scores = []
+for board in boards:
+    cppjieqi.set_board(game_id, board, True, %r)
+    scores.append(list(cppjieqi.evaluate(game_id, 15)))
+print(json.dumps(scores))
+''' % (HISTORY, HISTORY)
+
+
+@unittest.skipIf(cppjieqi is None, 'cppjieqi is not built')
+class EvaluateTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        # initialize()和对局实例从当前目录的上一级读取score.conf和kaijuku
+        cls.cwd = os.getcwd()
+        os.chdir(WEB_DIR)
+        cppjieqi.initialize()
+        cls.game_id = cppjieqi.create_game()
+
+    @classmethod
+    def tearDownClass(cls):
+        cppjieqi.delete_game(cls.game_id)
+        os.chdir(cls.cwd)
+
+    def evaluate(self, board, red_turn=True, budget_ms=15):
+        cppjieqi.set_board(self.game_id, board, red_turn, HISTORY)
+        return cppjieqi.evaluate(self.game_id, budget_ms)
+
+    def test_winning_position_scores_high(self):
+        # evaluate的分数是局面的绝对分数(走子方视角), 不是相对根节点的增量
+        score, depth = self.evaluate(RED_WINNING)
+        self.assertGreaterEqual(depth, 0)
+        self.assertGreater(score, 200)
+        score, depth = self.evaluate(RED_WINNING, red_turn=False)
+        self.assertLess(score, -200)
+
+    def test_score_does_not_depend_on_previous_evaluations(self):
+        # 每次评估在新的置换表generation上按节点预算搜索, 之前评估过的局面不影响结果
+        first = self.evaluate(OPENING)
+        self.assertTrue(cppjieqi.search_info(self.game_id)['exact'])
+        self.evaluate(RED_WINNING)
+        self.evaluate(RED_WINNING, red_turn=False)
+        self.assertEqual(self.evaluate(OPENING), first)
+        self.assertTrue(cppjieqi.search_info(self.game_id)['exact'])
+
+
+@unittest.skipIf(cppjieqi is None, 'cppjieqi is not built')
+class SharedTableTest(unittest.TestCase):
+
+    def run_child(self, name, search, *boards):
+        env = dict(os.environ, PYTHONPATH=os.path.dirname(os.path.abspath(cppjieqi.__file__)))
+        result = subprocess.run([sys.executable, '-c', CHILD, name, '1' if search else '0'] + list(boards),
+                                cwd=WEB_DIR, env=env, stdout=subprocess.PIPE, universal_newlines=True)
+        if result.returncode == 3:
+            self.skipTest('shared memory is not available')
+        self.assertEqual(result.returncode, 0)
+        return json.loads(result.stdout.splitlines()[-1])
+
+    def test_evaluations_match_cold_runs(self):
+        # 两个进程共用置换表, 各自先搜索不同的根节点再评估, 结果与不共享置换表的新进程相同
+        name = '/jieqi-test-%d' % os.getpid()
+        cold = self.run_child('', False, OPENING, RED_WINNING)
+        try:
+            first = self.run_child(name, True, OPENING, RED_WINNING)
+            second = self.run_child(name, True, RED_WINNING, OPENING)
+        finally:
+            # 换回私有表并删除共享内存段
+            if cppjieqi.attach_shared_tt(name):
+                cppjieqi.detach_shared_tt(True)
+        self.assertEqual(first, cold)
+        self.assertEqual(second, cold[::-1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+'''
+musesfish_pvs走子生成的回归测试: 初始暗子局面的perft计数, 查表生成器与原来逐格扫描的生成器在随机局面上的走法列表一致, 以及置换表的键
+'''
+import os
+import random
+import sys
+import unittest
+from itertools import count
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import musesfish_pvs as muses
+from musesfish_pvs import A9, E, W, directions
+
+
+def reference_gen_moves(board):
+    # 改为查表之前的gen_moves, 逐个方向逐格扫描
+    for i in range(51, 204):
+
+        p = board[i]
+
+        if not p.isupper() or p == 'U': continue
+
+        if p == 'K':
+            for scanpos in range(i - 16, A9, -16):
+                if board[scanpos] == 'k':
+                    yield (i, scanpos)
+                elif board[scanpos] != '.':
+                    break
+
+        if p in ('C', 'H'): #明暗炮
+            for d in directions[p]:
+                cfoot = 0
+                for j in count(i+d, d):
+                    q = board[j]
+                    if q.isspace(): break
+                    if cfoot == 0 and q == '.': yield (i, j)
+                    elif cfoot == 0 and q != '.': cfoot += 1
+                    elif cfoot == 1 and q.islower(): yield (i, j); break
+                    elif cfoot == 1 and q.isupper(): break;
+            continue
+
+        for d in directions[p]:
+            for j in count(i+d, d):
+                q = board[j]
+                # Stay inside the board, and off friendly pieces
+                if q.isspace() or q.isupper(): break
+                # 过河的卒/兵才能横着走
+                if p == 'P' and d in (E, W) and i > 128: break
+                # j & 15 等价于 j % 16但是更快
+                elif p == 'K' and (j < 160 or j & 15 > 8 or j & 15 < 6): break
+                elif p == 'G' and j != 183: break # 暗士, 花心坐标: (11, 7), 11 * 16 + 7 = 183
+                elif p in ('N', 'E'): # 暗马
+                    n_diff_x = (j - i) & 15
+                    if n_diff_x == 14 or n_diff_x == 2:
+                        if board[i + (1 if n_diff_x == 2 else -1)] != '.': break
+                    else:
+                        if j > i and board[i + 16] != '.': break
+                        elif j < i and board[i - 16] != '.': break
+                elif p in ('B', 'F') and board[i + d // 2] != '.': break
+                # Move it
+                yield (i, j)
+                # Stop crawlers from sliding, and sliding after captures
+                if p in 'PNBAKIEFG' or q.islower(): break
+
+
+class MoveGenTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.ctx = muses.Context(muses.B.translate_mapping(muses.B.mapping))
+        muses.Searcher(cls.ctx, workers=1).calc_average()
+
+    def initial(self):
+        return muses.Position(muses.initial_covered, 0, True, 0, self.ctx).set()
+
+    def test_perft_initial(self):
+        pos = self.initial()
+        self.assertEqual([muses.perft(pos, depth) for depth in (1, 2, 3)], [44, 1926, 67930])
+
+    def test_gen_moves_matches_reference(self):
+        rand = random.Random(2021)
+        checked = 0
+        for _ in range(20):
+            pos = self.initial()
+            for _ in range(60):
+                moves = list(pos.gen_moves())
+                self.assertEqual(moves, list(reference_gen_moves(pos.board)))
+                checked += 1
+                moves = [move for move in moves if pos.board[move[1]] != 'k']
+                if not moves:
+                    break
+                pos = pos.move(rand.choice(moves))
+        self.assertGreater(checked, 500)
+
+    def test_key_includes_version(self):
+        # 估值与version有关, 只有version不同的局面不能命中同一个置换表项
+        pos = self.initial()
+        other = pos._replace(version=1)
+        self.assertNotEqual(pos.key(), other.key())
+        self.assertEqual(muses.ArrayPosition(pos).key(), pos.key())
+        self.assertEqual(muses.ArrayPosition(other).key(), other.key())
+
+
+if __name__ == '__main__':
+    unittest.main()
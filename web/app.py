@@ -10,7 +10,14 @@ import sys
 import os
 import json
 import time
-from flask import Flask, request, jsonify, send_from_directory
+import uuid
+import hashlib
+import threading
+import queue
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from flask import Flask, Response, g, request, jsonify, send_from_directory
 from flask_cors import CORS
 import math
 
@@ -27,11 +34,248 @@ except ImportError as e:
 app = Flask(__name__)
 CORS(app)
 
+# 服务端对局会话: 超过SESSION_TTL秒未访问的会话会被清理, 最多保存MAX_SESSIONS个
+SESSION_TTL = 3600
+MAX_SESSIONS = 1000
+# 推荐走法/局面评估结果的LRU缓存大小
+RESULT_CACHE_SIZE = 4096
+# 准入控制: 最多SEARCH_CONCURRENCY个搜索同时运行(每个搜索占用一个C++对局实例), 最多SEARCH_QUEUE_SIZE个排队,
+# 队列满时返回503和Retry-After; 排队超过DEGRADE_WAIT秒的搜索降级为DEGRADED_DEPTH层/DEGRADED_MOVETIME毫秒
+SEARCH_CONCURRENCY = int(os.environ.get('JIEQI_SEARCH_CONCURRENCY', 1))
+SEARCH_QUEUE_SIZE = int(os.environ.get('JIEQI_SEARCH_QUEUE_SIZE', 8))
+DEGRADE_WAIT = float(os.environ.get('JIEQI_DEGRADE_WAIT', 2.0))
+SEARCH_MOVETIME = 15000
+DEGRADED_DEPTH = 5
+DEGRADED_MOVETIME = 1000
+# 优势条/胜率使用的限时浅层搜索(cppjieqi.evaluate)的时间预算, 毫秒
+EVAL_BUDGET_MS = 15
+# 整盘复盘: ANALYSIS_WORKERS个线程(各自一个C++对局实例)并行评估, 每个局面默认ANALYSIS_BUDGET_MS毫秒;
+# 走子方期望得分(胜+和/2)下降超过阈值的一步标记为失误. 复盘与搜索一样经过search_gate排队,
+# 最多ANALYSIS_MAX_PLIES步, 所有局面的评估时间之和不超过ANALYSIS_MAX_TOTAL_MS(超过时按比例缩短每个局面的预算)
+ANALYSIS_WORKERS = int(os.environ.get('JIEQI_ANALYSIS_WORKERS', os.cpu_count() or 1))
+ANALYSIS_BUDGET_MS = 50
+ANALYSIS_MAX_BUDGET_MS = 1000
+ANALYSIS_MAX_PLIES = 300
+ANALYSIS_MAX_TOTAL_MS = 15000
+MOVE_MARKS = ((0.2, 'blunder'), (0.1, 'mistake'), (0.05, 'inaccuracy'))
+# 设置后C++引擎的置换表放在这个名字的POSIX共享内存段中(如/jieqi-tt), 同一台机器上的gunicorn worker共用一张表.
+# 只有推荐走法的搜索用这张表; 局面评估用各对局实例私有的表, 结果与其他worker无关, 可以放进缓存
+TT_SHM_NAME = os.environ.get('JIEQI_TT_SHM', '')
+# /metrics直方图的桶
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20)
+DEPTH_BUCKETS = (-1, 0, 1, 2, 3, 4, 5, 6, 7, 8)
+NODES_BUCKETS = (1e3, 1e4, 1e5, 3e5, 1e6, 3e6, 1e7, 3e7, 1e8)
+NPS_BUCKETS = (1e4, 1e5, 2e5, 5e5, 1e6, 2e6, 5e6)
+# 异步搜索任务: 完成的任务保留JOB_TTL秒, SSE连接空闲SSE_KEEPALIVE秒发送一次心跳
+JOB_TTL = 600
+SSE_KEEPALIVE = 15
+DARK_PIECES = 'DEFGHIdefghi'
+# 与game.js中createInitialBoard()相同的初始局面, 第0行为红方底线
+INITIAL_BOARD = (
+    'DEFGKGFED'
+    '.........'
+    '.H.....H.'
+    'I.I.I.I.I'
+    '.........'
+    '.........'
+    'i.i.i.i.i'
+    '.h.....h.'
+    '.........'
+    'defgkgfed'
+)
+
+
+def board_to_string(web_board):
+    """将10x9的web_board二维数组展平为90个字符的字符串"""
+    return "".join(["".join(row) for row in web_board])
+
+
+def history_to_strings(history):
+    """将前端传来的历史记录（对象列表）转换为C++引擎需要的棋盘字符串列表"""
+    if history and isinstance(history[0], dict):
+        return [board_to_string(move_obj['boardStateAfter']) for move_obj in history if 'boardStateAfter' in move_obj]
+    return history # 假设已经是字符串列表
+
+
+class ResultCache:
+    """
+    推荐走法和局面评估结果的LRU缓存. 键为(类型, 棋盘, 走子方, 历史哈希, 搜索参数),
+    悔棋/重做/翻转棋盘/重复点击提示时直接返回之前的结果. 引擎参数变化时(set_params)整个缓存失效
+    """
+
+    def __init__(self, capacity=RESULT_CACHE_SIZE):
+        self.capacity = capacity
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.params = None
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(kind, board_str, is_red_turn, history, limits=None):
+        history_hash = hashlib.blake2b("|".join(history).encode(), digest_size=8).hexdigest()
+        return (kind, board_str, is_red_turn, history_hash, limits)
+
+    def get(self, key):
+        with self.lock:
+            value = self.entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.capacity:
+                self.entries.popitem(last=False)
+
+    def set_params(self, params):
+        """引擎参数(评估表, 引擎版本等)的指纹, 变化时清空缓存"""
+        with self.lock:
+            if params != self.params:
+                self.entries.clear()
+                self.params = params
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        with self.lock:
+            total = self.hits + self.misses
+            return {
+                'size': len(self.entries),
+                'capacity': self.capacity,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': round(self.hits / total, 4) if total else 0.0
+            }
+
+
+def engine_params():
+    """引擎参数指纹: 评估表score.conf的内容和C++模块文件的修改时间"""
+    h = hashlib.blake2b(digest_size=8)
+    try:
+        with open('../score.conf', 'rb') as f:
+            h.update(f.read())
+        h.update(str(os.path.getmtime(cppjieqi.__file__)).encode())
+    except (OSError, NameError):
+        pass
+    return h.hexdigest()
+
+
+result_cache = ResultCache()
+
+
+def format_labels(names, values):
+    if not names:
+        return ''
+    return '{' + ','.join(f'{n}="{v}"' for n, v in zip(names, values)) + '}'
+
+
+class Histogram:
+    """Prometheus文本格式的直方图(累计桶), 按标签值分组, 多线程共享"""
+
+    def __init__(self, name, help_text, buckets, labels=()):
+        self.name = name
+        self.help = help_text
+        self.buckets = buckets
+        self.labels = labels
+        self.series = {} # 标签值 -> [各桶计数, 总和, 总数]
+        self.lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        with self.lock:
+            series = self.series.setdefault(label_values, [[0] * len(self.buckets), 0.0, 0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        with self.lock:
+            for label_values, (counts, total, count) in sorted(self.series.items()):
+                for bound, n in zip(self.buckets, counts):
+                    le = format_labels(self.labels + ('le', ), label_values + (f'{bound:g}', ))
+                    lines.append(f'{self.name}_bucket{le} {n}')
+                inf = format_labels(self.labels + ('le', ), label_values + ('+Inf', ))
+                lines.append(f'{self.name}_bucket{inf} {count}')
+                lines.append(f'{self.name}_sum{format_labels(self.labels, label_values)} {total}')
+                lines.append(f'{self.name}_count{format_labels(self.labels, label_values)} {count}')
+        return lines
+
+
+class Counter:
+    """按标签值分组的计数器"""
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def inc(self, *label_values):
+        with self.lock:
+            self.series[label_values] = self.series.get(label_values, 0) + 1
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} counter']
+        with self.lock:
+            for label_values, n in sorted(self.series.items()):
+                lines.append(f'{self.name}{format_labels(self.labels, label_values)} {n}')
+        return lines
+
+
+def gauge(name, help_text, value, metric_type='gauge'):
+    return [f'# HELP {name} {help_text}', f'# TYPE {name} {metric_type}', f'{name} {value}']
+
+
+request_latency = Histogram('jieqi_http_request_duration_seconds', 'HTTP request latency',
+                            LATENCY_BUCKETS, ('endpoint', 'method'))
+request_count = Counter('jieqi_http_requests_total', 'HTTP requests', ('endpoint', 'method', 'status'))
+# kind: search(get_ai_move)或eval(限时浅层评估)
+search_depth = Histogram('jieqi_search_depth', 'Completed search depth (-1: static evaluation only)',
+                         DEPTH_BUCKETS, ('kind', ))
+search_nodes = Histogram('jieqi_search_nodes', 'Nodes searched per search', NODES_BUCKETS, ('kind', ))
+search_nps = Histogram('jieqi_search_nps', 'Nodes per second per search', NPS_BUCKETS, ('kind', ))
+search_latency = Histogram('jieqi_search_duration_seconds', 'Engine time per search', LATENCY_BUCKETS, ('kind', ))
+
+
+def record_search(kind, game_id, elapsed):
+    """记录对局实例上一次搜索的深度, 节点数和NPS"""
+    info = cppjieqi.search_info(game_id)
+    if not info:
+        return
+    search_depth.observe(info['depth'], kind)
+    search_nodes.observe(info['nodes'], kind)
+    search_latency.observe(elapsed, kind)
+    if elapsed > 0:
+        search_nps.observe(info['nodes'] / elapsed, kind)
+
+
+def engine_evaluate(game_id, budget_ms):
+    """
+    cppjieqi.evaluate并记录指标, 返回((走子方视角的分数, 完成的深度), exact).
+    exact为False时搜索被墙钟时限打断, 结果与机器负载有关, 不能放进缓存
+    """
+    start = time.perf_counter()
+    evaluation = cppjieqi.evaluate(game_id, budget_ms)
+    record_search('eval', game_id, time.perf_counter() - start)
+    return evaluation, cppjieqi.search_info(game_id).get('exact', False)
+
 class WebJieqiAI:
     """Web版暗棋AI接口"""
     
     def __init__(self):
         self.game_id = None
+        self.lock = threading.Lock() # 评估和分析共用self.game_id这个对局实例
         self.initialize_ai()
         
     def __del__(self):
@@ -48,7 +292,11 @@ class WebJieqiAI:
             return False
         try:
             cppjieqi.initialize()
+            if TT_SHM_NAME:
+                shared = cppjieqi.attach_shared_tt(TT_SHM_NAME)
+                print(f"Shared transposition table {TT_SHM_NAME}: {'attached' if shared else 'unavailable, using a private table'}")
             self.game_id = cppjieqi.create_game()
+            result_cache.set_params(engine_params())
             print(f"C++ AI engine initialized and game instance {self.game_id} created.")
             return True
         except Exception as e:
@@ -74,8 +322,20 @@ class WebJieqiAI:
         except (ValueError, IndexError):
             return None
 
-    def get_ai_recommendation(self, web_board, current_player, history, depth):
-        """获取AI推荐走法"""
+    def cached_recommendation(self, web_board, current_player, history, depth):
+        """缓存中已有的推荐走法, 没有时返回None. 命中时不需要排队等待引擎"""
+        cache_key = result_cache.key('move', board_to_string(web_board), current_player == 'red',
+                                     history_to_strings(history), depth)
+        cached = result_cache.get(cache_key)
+        return None if cached is None else dict(cached, cached=True)
+
+    def get_ai_recommendation(self, web_board, current_player, history, depth, game_id=None, progress=None,
+                              movetime=SEARCH_MOVETIME, check_cache=True):
+        """
+        获取AI推荐走法. game_id: 使用的C++对局实例, 默认为self.game_id;
+        progress(depth, score, move, time_ms): 每完成一层迭代加深时的回调;
+        movetime: 搜索的时间预算(毫秒); check_cache为False时调用方已经查过缓存
+        """
         if not AI_AVAILABLE:
             return {
                 'success': False,
@@ -92,67 +352,29 @@ class WebJieqiAI:
             start_time = time.time()
 
             # 1. 将10x9的web_board二维数组展平为90个字符的字符串
-            board_str = "".join(["".join(row) for row in web_board])
+            board_str = board_to_string(web_board)
             
             # 2. 确定当前是否为红方回合
             is_red_turn = current_player == 'red'
             
             # 3. 将前端传来的历史记录（对象列表）转换为C++引擎需要的棋盘字符串列表
-            history_board_strings = []
-            if history and isinstance(history[0], dict):
-                for move_obj in history:
-                    if 'boardStateAfter' in move_obj:
-                        board_state_2d = move_obj['boardStateAfter']
-                        history_board_strings.append("".join(["".join(row) for row in board_state_2d]))
-            else:
-                history_board_strings = history # 假设已经是字符串列表
+            history_board_strings = history_to_strings(history)
 
-            # 4. 设置C++引擎的棋盘状态
-            cppjieqi.set_board(self.game_id, board_str, is_red_turn, history_board_strings)
-
-            # 5. 调用C++ AI引擎获取最佳走法 (UCCI格式)
-            ai_move_ucci = cppjieqi.get_ai_move(self.game_id, depth)
-            
-            search_time = time.time() - start_time
-            
-            if not ai_move_ucci or "ERROR" in ai_move_ucci:
-                return {
-                    'success': False,
-                    'error': f'AI engine returned an error: {ai_move_ucci}'
-                }
+            # 同一局面和搜索参数之前算过时直接返回缓存的结果
+            cache_key = result_cache.key('move', board_str, is_red_turn, history_board_strings, depth)
+            cached = result_cache.get(cache_key) if check_cache else None
+            if cached is not None:
+                return dict(cached, cached=True)
 
-            print(f"C++ AI returned move: {ai_move_ucci}, time: {search_time:.3f}s")
-            
-            # 4. 将UCCI走法转换为Web前端需要的格式
-            web_move = self.ucci_to_web_move(ai_move_ucci)
-            if not web_move:
-                return {
-                    'success': False,
-                    'error': f'Failed to parse AI move: {ai_move_ucci}'
-                }
-            
-            # 计算与C++一致的 quiesc_depth（round<15 -> 2，否则 1）
-            round_num = len(history_board_strings) // 2
-            quiesc_depth = 2 if round_num < 15 else 1
-            
-            # 5. 组装返回给前端的数据
-            from_piece = web_board[web_move['from']['row']][web_move['from']['col']]
-            to_piece = web_board[web_move['to']['row']][web_move['to']['col']]
+            # 4. 设置C++引擎的棋盘状态
+            game_id = self.game_id if game_id is None else game_id
+            cppjieqi.set_board(game_id, board_str, is_red_turn, history_board_strings)
 
-            return {
-                'success': True,
-                'move': {
-                    'from': web_move['from'],
-                    'to': web_move['to'],
-                    'piece': from_piece,
-                    'capturedPiece': to_piece,
-                    'isCapture': to_piece != '.'
-                },
-                'score': 0,
-                'depth': depth,
-                'search_time': round(search_time, 3),
-                'details': [f"C++ AI recommended move: {ai_move_ucci} (depth={depth}, quiesc_depth={quiesc_depth})"]
-            }
+            # 5. 调用C++ AI引擎搜索
+            result = self._search_move(web_board, depth, start_time, game_id, progress, movetime)
+            if result['success']:
+                result_cache.put(cache_key, result)
+            return dict(result, cached=False)
             
         except Exception as e:
             print(f"AI recommendation error: {e}")
@@ -161,6 +383,51 @@ class WebJieqiAI:
                 'error': f'AI error: {str(e)}'
             }
 
+    def _search_move(self, web_board, depth, start_time, game_id=None, progress=None, movetime=SEARCH_MOVETIME):
+        """在已经set_board的局面上搜索最佳走法, 组装成返回给前端的数据"""
+        # 调用C++ AI引擎获取最佳走法 (UCCI格式)
+        game_id = self.game_id if game_id is None else game_id
+        engine_start = time.perf_counter()
+        ai_move_ucci = cppjieqi.get_ai_move(game_id, depth, progress, movetime)
+        record_search('search', game_id, time.perf_counter() - engine_start)
+        
+        search_time = time.time() - start_time
+        
+        if not ai_move_ucci or "ERROR" in ai_move_ucci:
+            return {
+                'success': False,
+                'error': f'AI engine returned an error: {ai_move_ucci}'
+            }
+
+        print(f"C++ AI returned move: {ai_move_ucci}, time: {search_time:.3f}s")
+        
+        # 将UCCI走法转换为Web前端需要的格式
+        web_move = self.ucci_to_web_move(ai_move_ucci)
+        if not web_move:
+            return {
+                'success': False,
+                'error': f'Failed to parse AI move: {ai_move_ucci}'
+            }
+        
+        # 组装返回给前端的数据
+        from_piece = web_board[web_move['from']['row']][web_move['from']['col']]
+        to_piece = web_board[web_move['to']['row']][web_move['to']['col']]
+
+        return {
+            'success': True,
+            'move': {
+                'from': web_move['from'],
+                'to': web_move['to'],
+                'piece': from_piece,
+                'capturedPiece': to_piece,
+                'isCapture': to_piece != '.'
+            },
+            'score': 0,
+            'depth': depth,
+            'search_time': round(search_time, 3),
+            'details': [f"C++ AI recommended move: {ai_move_ucci} (depth={depth}, quiescence=captures)"]
+        }
+
     def _score_to_wdl(self, score_for_red: float, move_count: int = 0):
         # 基于评分的快速概率映射（可后续标定）
         # 红方评分为正 → 红方胜率高；为负 → 黑方胜率高
@@ -189,6 +456,20 @@ class WebJieqiAI:
             'black_win': round(p_black, 4)
         }
 
+    def board_score(self, board_str, is_red_turn, history_board_strings):
+        """
+        C++引擎约EVAL_BUDGET_MS毫秒(按节点数计)的浅层搜索评估, 返回(相对于当前走子方的分数, 完成的深度), 结果带缓存
+        """
+        cache_key = result_cache.key('eval', board_str, is_red_turn, history_board_strings, EVAL_BUDGET_MS)
+        evaluation = result_cache.get(cache_key)
+        if evaluation is None:
+            with self.lock:
+                cppjieqi.set_board(self.game_id, board_str, is_red_turn, history_board_strings)
+                evaluation, exact = engine_evaluate(self.game_id, EVAL_BUDGET_MS)
+            if exact:
+                result_cache.put(cache_key, evaluation)
+        return evaluation
+
     def evaluate_position(self, web_board, current_player, history):
         """评估当前局面"""
         if not AI_AVAILABLE:
@@ -202,71 +483,667 @@ class WebJieqiAI:
                 'error': 'AI game instance not created'
             }
         try:
-            board_str = "".join(["".join(row) for row in web_board])
+            board_str = board_to_string(web_board)
             is_red_turn = current_player == 'red'
             
             # 将历史记录转换为棋盘字符串列表
-            history_board_strings = []
-            if history and isinstance(history[0], dict):
-                for move_obj in history:
-                    if 'boardStateAfter' in move_obj:
-                        board_state_2d = move_obj['boardStateAfter']
-                        history_board_strings.append("".join(["".join(row) for row in board_state_2d]))
-            else:
-                history_board_strings = history
-
-            # 设置C++引擎的棋盘状态
-            cppjieqi.set_board(self.game_id, board_str, is_red_turn, history_board_strings)
+            history_board_strings = history_to_strings(history)
 
             # C++引擎返回相对于当前玩家的分数
-            score_relative = cppjieqi.get_board_evaluation(self.game_id)
+            score_relative, eval_depth = self.board_score(board_str, is_red_turn, history_board_strings)
 
             # 将分数统一转换为红方视角
             score_for_red = score_relative if is_red_turn else -score_relative
 
-            # 根据红方分数判断局面
-            advantage_level = "balanced"
-            advantage_side = "none"
-            evaluation_text = "均势"
-
-            if score_for_red > 200:
-                advantage_level = "decisive_advantage"
-                advantage_side = "red"
-                evaluation_text = "红方巨大优势"
-            elif score_for_red > 50:
-                advantage_level = "slight_advantage"
-                advantage_side = "red"
-                evaluation_text = "红方优势"
-            elif score_for_red < -200:
-                advantage_level = "decisive_advantage"
-                advantage_side = "black"
-                evaluation_text = "黑方巨大优势"
-            elif score_for_red < -50:
-                advantage_level = "slight_advantage"
-                advantage_side = "black"
-                evaluation_text = "黑方优势"
-            
-            # 将分数映射到0-100的百分比，用于优势条显示
-            # 使用tanh函数使分数在极端情况下变化更平滑
-            percentage_red = 50 + 25 * math.tanh(score_for_red / 400.0)
-            percentage = max(5, min(95, percentage_red))
+            return dict(self._evaluation_result(score_for_red), eval_depth=eval_depth)
+        except Exception as e:
+            print(f"Position evaluation error: {e}")
+            return {
+                'success': False,
+                'error': f'Evaluation error: {str(e)}'
+            }
+
+    def _evaluation_result(self, score_for_red):
+        """根据红方视角的分数生成评估文字和优势条"""
+        # 根据红方分数判断局面
+        advantage_level = "balanced"
+        advantage_side = "none"
+        evaluation_text = "均势"
+
+        if score_for_red > 200:
+            advantage_level = "decisive_advantage"
+            advantage_side = "red"
+            evaluation_text = "红方巨大优势"
+        elif score_for_red > 50:
+            advantage_level = "slight_advantage"
+            advantage_side = "red"
+            evaluation_text = "红方优势"
+        elif score_for_red < -200:
+            advantage_level = "decisive_advantage"
+            advantage_side = "black"
+            evaluation_text = "黑方巨大优势"
+        elif score_for_red < -50:
+            advantage_level = "slight_advantage"
+            advantage_side = "black"
+            evaluation_text = "黑方优势"
+        
+        # 将分数映射到0-100的百分比，用于优势条显示
+        # 使用tanh函数使分数在极端情况下变化更平滑
+        percentage_red = 50 + 25 * math.tanh(score_for_red / 400.0)
+        percentage = max(5, min(95, percentage_red))
+
+        return {
+            'success': True,
+            'score': score_for_red,
+            'evaluation': evaluation_text,
+            'advantage': {'level': advantage_level, 'side': advantage_side, 'percentage': percentage}
+        }
 
+    def analyze(self, web_board, current_player, history):
+        """
+        一次set_board同时得到评估, 优势条和WDL胜率, 代替分别调用position-evaluation和win-probability.
+        推荐走法由调用方经search_gate排队搜索, 这里只在评估期间持有self.lock
+        """
+        if not AI_AVAILABLE:
             return {
-                'success': True,
-                'score': score_for_red,
-                'evaluation': evaluation_text,
-                'advantage': {'level': advantage_level, 'side': advantage_side, 'percentage': percentage}
+                'success': False,
+                'error': 'AI engine not available'
+            }
+        if self.game_id is None:
+            return {
+                'success': False,
+                'error': 'AI game instance not created'
             }
+        try:
+            board_str = board_to_string(web_board)
+            is_red_turn = current_player == 'red'
+            history_board_strings = history_to_strings(history)
+
+            eval_key = result_cache.key('eval', board_str, is_red_turn, history_board_strings, EVAL_BUDGET_MS)
+            evaluation = result_cache.get(eval_key)
+            cached = evaluation is not None
+            if not cached:
+                with self.lock:
+                    cppjieqi.set_board(self.game_id, board_str, is_red_turn, history_board_strings)
+                    evaluation, exact = engine_evaluate(self.game_id, EVAL_BUDGET_MS)
+                if exact:
+                    result_cache.put(eval_key, evaluation)
+            score_relative, eval_depth = evaluation
+
+            score_for_red = score_relative if is_red_turn else -score_relative
+            result = self._evaluation_result(score_for_red)
+            wdl = self._score_to_wdl(score_for_red, move_count=len(history_board_strings))
+            result.update({
+                'score_for_red': score_for_red,
+                'wdl': wdl,
+                'current_player': current_player,
+                'current_player_winrate': round(wdl['red_win'] if is_red_turn else wdl['black_win'], 4),
+                'eval_depth': eval_depth,
+                'cached': cached
+            })
+            return result
         except Exception as e:
-            print(f"Position evaluation error: {e}")
+            print(f"Analyze error: {e}")
             return {
                 'success': False,
-                'error': f'Evaluation error: {str(e)}'
+                'error': f'Analyze error: {str(e)}'
             }
 
 
+def position_hash(board_str, is_red_turn):
+    """局面哈希(16位十六进制), 与进程无关, 多个worker之间也一致"""
+    return hashlib.blake2b((board_str + ('r' if is_red_turn else 'b')).encode(), digest_size=8).hexdigest()
+
+
+def parse_web_move(move):
+    """将走法(UCCI字符串或{'from': {row, col}, 'to': {row, col}})转换为90格下标(src, dst)"""
+    if isinstance(move, str):
+        if len(move) != 4:
+            raise ValueError(f'Invalid move: {move}')
+        move = {
+            'from': {'row': int(move[1]), 'col': ord(move[0]) - ord('a')},
+            'to': {'row': int(move[3]), 'col': ord(move[2]) - ord('a')}
+        }
+    squares = []
+    for key in ('from', 'to'):
+        row, col = int(move[key]['row']), int(move[key]['col'])
+        if not (0 <= row < 10 and 0 <= col < 9):
+            raise ValueError(f'Square out of board: {move[key]}')
+        squares.append(row * 9 + col)
+    return squares[0], squares[1]
+
+
+class GameSession:
+    """
+    服务端保存的一盘棋: 只记录起始局面, 紧凑的走法列表(如'e3e4', 暗子翻开时带上翻出的棋子, 如'e3e4P')
+    和每个局面的哈希, 请求时只需提交新的一步
+    """
+
+    def __init__(self, board_str=INITIAL_BOARD, is_red_turn=True):
+        self.id = uuid.uuid4().hex
+        self.start_board = board_str
+        self.start_red_turn = is_red_turn
+        self.board = board_str
+        self.is_red_turn = is_red_turn
+        self.moves = []
+        self.hashes = [position_hash(board_str, is_red_turn)]
+        self.last_access = time.time()
+
+    @property
+    def current_player(self):
+        return 'red' if self.is_red_turn else 'black'
+
+    def web_board(self):
+        return [list(self.board[r * 9:(r + 1) * 9]) for r in range(10)]
+
+    @staticmethod
+    def _apply(board, is_red_turn, src, dst, reveal):
+        piece = board[src]
+        if piece in DARK_PIECES:
+            piece = reveal.upper() if is_red_turn else reveal.lower()
+        b = list(board)
+        b[src], b[dst] = '.', piece
+        return ''.join(b)
+
+    def play(self, move, reveal=None):
+        """走一步, 暗子走动时reveal为翻开后的棋子. 返回被吃的子"""
+        src, dst = parse_web_move(move)
+        piece, captured = self.board[src], self.board[dst]
+        if piece == '.' or piece.isupper() != self.is_red_turn:
+            raise ValueError('No piece of the side to move on the source square')
+        if captured != '.' and captured.isupper() == self.is_red_turn:
+            raise ValueError('Cannot capture own piece')
+        if piece in DARK_PIECES:
+            if not reveal or len(reveal) != 1 or reveal.upper() not in 'RNBACP':
+                raise ValueError('Revealed piece required when moving a dark piece')
+        else:
+            reveal = None
+        self.board = self._apply(self.board, self.is_red_turn, src, dst, reveal)
+        self.is_red_turn = not self.is_red_turn
+        ucci = f"{chr(src % 9 + ord('a'))}{src // 9}{chr(dst % 9 + ord('a'))}{dst // 9}"
+        self.moves.append(ucci + (reveal.upper() if reveal else ''))
+        self.hashes.append(position_hash(self.board, self.is_red_turn))
+        return captured
+
+    def history_strings(self):
+        """重放走法得到每步之后的棋盘字符串, 与前端history中的boardStateAfter对应"""
+        boards = []
+        board, is_red_turn = self.start_board, self.start_red_turn
+        for move in self.moves:
+            src, dst = parse_web_move(move[:4])
+            board = self._apply(board, is_red_turn, src, dst, move[4:] or None)
+            is_red_turn = not is_red_turn
+            boards.append(board)
+        return boards
+
+    def state(self, with_moves=False):
+        state = {
+            'success': True,
+            'sessionId': self.id,
+            'board': self.web_board(),
+            'currentPlayer': self.current_player,
+            'moveCount': len(self.moves),
+            'hash': self.hashes[-1],
+            'lastMove': self.moves[-1] if self.moves else None
+        }
+        if with_moves:
+            state['moves'] = self.moves
+            state['hashes'] = self.hashes
+        return state
+
+
+class SessionStore:
+    """会话表, 多个请求线程共享"""
+
+    def __init__(self, ttl=SESSION_TTL, max_sessions=MAX_SESSIONS):
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self.sessions = {}
+        self.lock = threading.Lock()
+
+    def create(self, board_str=INITIAL_BOARD, is_red_turn=True):
+        session = GameSession(board_str, is_red_turn)
+        with self.lock:
+            self._expire()
+            if len(self.sessions) >= self.max_sessions:
+                # 会话已满时淘汰最久没有访问的会话
+                oldest = min(self.sessions.values(), key=lambda s: s.last_access)
+                del self.sessions[oldest.id]
+            self.sessions[session.id] = session
+        return session
+
+    def get(self, session_id):
+        with self.lock:
+            session = self.sessions.get(session_id)
+            if session is not None:
+                session.last_access = time.time()
+            return session
+
+    def delete(self, session_id):
+        with self.lock:
+            return self.sessions.pop(session_id, None) is not None
+
+    def __len__(self):
+        return len(self.sessions)
+
+    def _expire(self):
+        now = time.time()
+        for session_id in [k for k, s in self.sessions.items() if now - s.last_access > self.ttl]:
+            del self.sessions[session_id]
+
+
+def request_position(data):
+    """
+    取出请求对应的局面(web_board, current_player, history):
+    带sessionId时使用服务端保存的对局, 否则使用请求中的board/currentPlayer/history.
+    出错时返回(None, (错误信息, 状态码))
+    """
+    session_id = data.get('sessionId')
+    if session_id:
+        session = sessions.get(session_id)
+        if session is None:
+            return None, ('Session not found', 404)
+        return (session.web_board(), session.current_player, session.history_strings()), None
+    web_board = data.get('board')
+    if not web_board:
+        return None, ('Board data required', 400)
+    return (web_board, data.get('currentPlayer', 'red'), history_to_strings(data.get('history', []))), None
+
+
+class Overloaded(Exception):
+    """搜索队列已满, retry_after为建议的重试秒数"""
+
+    def __init__(self, retry_after):
+        super(Overloaded, self).__init__('Search queue is full')
+        self.retry_after = retry_after
+
+
+class SearchGate:
+    """
+    搜索准入控制. 每个C++对局实例同一时间只能运行一个搜索, 实例池的大小就是并发数.
+    同步推荐和异步任务共用一个有界队列: 排满时拒绝(Overloaded), 排队太久的搜索降低预算
+    """
+
+    def __init__(self, concurrency=SEARCH_CONCURRENCY, queue_size=SEARCH_QUEUE_SIZE, degrade_wait=DEGRADE_WAIT):
+        self.concurrency = concurrency
+        self.queue_size = queue_size
+        self.degrade_wait = degrade_wait
+        self.waiting = 0
+        self.running = 0
+        self.rejected = 0
+        self.degraded = 0
+        self.search_time = 1.0 # 搜索用时(秒)的指数滑动平均, 用于估计Retry-After
+        self.lock = threading.Lock()
+        self.game_ids = queue.Queue()
+        if AI_AVAILABLE and ai_engine.game_id is not None:
+            for _ in range(concurrency):
+                self.game_ids.put(cppjieqi.create_game())
+
+    def enter(self):
+        """进入队列, 队列已满时抛出Overloaded"""
+        with self.lock:
+            if self.waiting >= self.queue_size:
+                self.rejected += 1
+                raise Overloaded(max(1, math.ceil(self.search_time * (self.waiting + 1) / self.concurrency)))
+            self.waiting += 1
+
+    def leave(self):
+        """离开队列且不再搜索(排队中的任务被取消)"""
+        with self.lock:
+            self.waiting -= 1
+
+    def budget(self, depth, wait):
+        """根据排队时间决定搜索预算, 返回(depth, movetime, degraded)"""
+        if wait <= self.degrade_wait:
+            return depth, SEARCH_MOVETIME, False
+        with self.lock:
+            self.degraded += 1
+        return min(depth, DEGRADED_DEPTH), DEGRADED_MOVETIME, True
+
+    @contextmanager
+    def slot(self, since):
+        """等待空闲的对局实例(调用前已enter), 得到(game_id, 排队秒数); since为进入队列的时间"""
+        game_id = self.game_ids.get()
+        started = time.time()
+        with self.lock:
+            self.waiting -= 1
+            self.running += 1
+        try:
+            yield game_id, started - since
+        finally:
+            with self.lock:
+                self.running -= 1
+                self.search_time = 0.8 * self.search_time + 0.2 * (time.time() - started)
+            self.game_ids.put(game_id)
+
+    def search(self, web_board, current_player, history, depth, since, progress=None, on_start=None):
+        """
+        排队并搜索推荐走法(调用前已enter, 缓存已查过). on_start(game_id)在开始搜索前调用,
+        返回False时放弃搜索并返回None
+        """
+        with self.slot(since) as (game_id, wait):
+            cppjieqi.stop(game_id, False) # 清除上一个被取消的搜索可能留下的中断标志
+            if on_start is not None and not on_start(game_id):
+                return None
+            depth, movetime, degraded = self.budget(depth, wait)
+            result = ai_engine.get_ai_recommendation(web_board, current_player, history, depth, game_id=game_id,
+                                                     progress=progress, movetime=movetime, check_cache=False)
+        return dict(result, degraded=degraded, queue_wait=round(wait, 3))
+
+    def stats(self):
+        with self.lock:
+            return {
+                'concurrency': self.concurrency,
+                'queue_size': self.queue_size,
+                'waiting': self.waiting,
+                'running': self.running,
+                'rejected': self.rejected,
+                'degraded': self.degraded
+            }
+
+
+class SearchJob:
+    """一次异步搜索: 事件列表依次为每层迭代加深的progress和最后的result"""
+
+    def __init__(self, web_board, current_player, history, depth):
+        self.id = uuid.uuid4().hex
+        self.web_board = web_board
+        self.current_player = current_player
+        self.history = history
+        self.depth = depth
+        self.status = 'queued'
+        self.game_id = None # 运行中使用的C++对局实例
+        self.events = []
+        self.result = None
+        self.created = time.time()
+        self.finished = None
+        self.cond = threading.Condition()
+
+    @property
+    def done(self):
+        return self.status in ('done', 'failed', 'cancelled')
+
+    def publish(self, event, data):
+        with self.cond:
+            self.events.append((event, data))
+            self.cond.notify_all()
+
+    def on_progress(self, depth, score, move, time_ms):
+        """C++引擎每完成一层迭代加深时调用, score为走子方视角"""
+        is_red_turn = self.current_player == 'red'
+        self.publish('progress', {
+            'depth': depth,
+            'score': score,
+            'score_for_red': score if is_red_turn else -score,
+            'move': ai_engine.ucci_to_web_move(move),
+            'ucci': move,
+            'time_ms': time_ms
+        })
+
+    def finish(self, result):
+        with self.cond:
+            if self.status == 'cancelling':
+                result = {'success': False, 'cancelled': True, 'error': 'Search cancelled'}
+            self.result = result
+            self.status = 'cancelled' if result.get('cancelled') else ('done' if result.get('success') else 'failed')
+            self.game_id = None
+            self.finished = time.time()
+            self.events.append(('result', result))
+            self.cond.notify_all()
+
+    def state(self):
+        with self.cond:
+            return {
+                'success': True,
+                'jobId': self.id,
+                'status': self.status,
+                'progress': [data for event, data in self.events if event == 'progress'],
+                'result': self.result
+            }
+
+    def stream(self):
+        """生成SSE事件流, 任务结束(发送result事件)后关闭"""
+        index = 0
+        while True:
+            with self.cond:
+                if index >= len(self.events) and not self.done:
+                    self.cond.wait(SSE_KEEPALIVE)
+                events, done = self.events[index:], self.done
+            if not events and not done:
+                yield ': keepalive\n\n'
+                continue
+            for event, data in events:
+                yield f"event: {event}\ndata: {json.dumps(data)}\n\n"
+            index += len(events)
+            if done:
+                return
+
+
+class JobManager:
+    """
+    异步搜索任务表. 任务经过search_gate排队, 在搜索线程中使用池里的C++对局实例运行,
+    提交请求立即返回, 不再占用Flask的请求线程
+    """
+
+    def __init__(self, gate, ttl=JOB_TTL):
+        self.gate = gate
+        self.ttl = ttl
+        self.jobs = {}
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=gate.concurrency, thread_name_prefix='search-job')
+
+    def submit(self, web_board, current_player, history, depth):
+        """提交任务; 缓存命中时任务直接完成, 队列已满时抛出Overloaded"""
+        job = SearchJob(web_board, current_player, history, depth)
+        cached = ai_engine.cached_recommendation(web_board, current_player, history, depth)
+        if cached is None:
+            self.gate.enter()
+        with self.lock:
+            self._expire()
+            self.jobs[job.id] = job
+        if cached is None:
+            self.executor.submit(self._run, job)
+        else:
+            job.finish(dict(cached, degraded=False, queue_wait=0.0))
+        return job
+
+    def __len__(self):
+        with self.lock:
+            return len(self.jobs)
+
+    def get(self, job_id):
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def cancel(self, job_id):
+        """
+        取消任务: 排队中的任务不再运行, 运行中的任务通过cppjieqi.stop()在几毫秒内中断.
+        状态变化都在job.cond中进行, 保证stop只会发给这个任务正在使用的对局实例
+        """
+        job = self.get(job_id)
+        if job is None:
+            return None
+        with job.cond:
+            if job.done:
+                return job
+            running = job.game_id is not None
+            if running:
+                cppjieqi.stop(job.game_id)
+            job.status = 'cancelling'
+        if not running:
+            job.finish({'success': False, 'cancelled': True, 'error': 'Search cancelled'})
+        return job
+
+    def _run(self, job):
+        if job.done:
+            self.gate.leave() # 排队时已被取消
+            return
+
+        def on_start(game_id):
+            with job.cond:
+                if job.status != 'queued':
+                    return False
+                job.game_id = game_id
+                job.status = 'running'
+                return True
+
+        try:
+            result = self.gate.search(job.web_board, job.current_player, job.history, job.depth, job.created,
+                                      progress=job.on_progress, on_start=on_start)
+        except Exception as e:
+            result = {'success': False, 'error': f'AI error: {str(e)}'}
+        if result is not None:
+            job.finish(result)
+
+    def _expire(self):
+        now = time.time()
+        for job_id in [k for k, j in self.jobs.items() if j.done and now - j.finished > self.ttl]:
+            del self.jobs[job_id]
+
+
+class GameAnalyzer:
+    """
+    整盘棋复盘. 各局面相互独立, 分到线程池中并行评估; 每个线程从池中取一个C++对局实例,
+    cppjieqi.evaluate搜索时释放GIL, 所以多个局面真正并行. 对局实例在第一次用到时才创建
+    """
+
+    def __init__(self, workers=ANALYSIS_WORKERS):
+        self.workers = workers
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='analysis')
+        self.game_ids = queue.Queue()
+        self.created = 0
+        self.lock = threading.Lock()
+
+    def _acquire(self):
+        with self.lock:
+            if self.game_ids.empty() and self.created < self.workers:
+                self.created += 1
+                return cppjieqi.create_game()
+        return self.game_ids.get()
+
+    def _evaluate(self, position, budget_ms):
+        """评估一个局面, 返回(红方视角的分数, 完成的深度), 结果带缓存"""
+        board_str, is_red_turn, history = position
+        cache_key = result_cache.key('eval', board_str, is_red_turn, history, budget_ms)
+        evaluation = result_cache.get(cache_key)
+        if evaluation is None:
+            game_id = self._acquire()
+            try:
+                cppjieqi.set_board(game_id, board_str, is_red_turn, history)
+                evaluation, exact = engine_evaluate(game_id, budget_ms)
+            finally:
+                self.game_ids.put(game_id)
+            if exact:
+                result_cache.put(cache_key, evaluation)
+        score, depth = evaluation
+        return (score if is_red_turn else -score), depth
+
+    def analyze(self, start_board, start_red_turn, moves, budget_ms=ANALYSIS_BUDGET_MS):
+        """
+        重放moves(紧凑格式'e3e4'/'e3e4P'或{'from', 'to', 'reveal'}), 并行评估每个局面.
+        走法不合法时抛出ValueError
+        """
+        start_time = time.time()
+        game = GameSession(start_board, start_red_turn)
+        positions = [(game.board, game.is_red_turn, [])]
+        history = []
+        for move in moves:
+            if isinstance(move, str):
+                game.play(move[:4], move[4:] or None)
+            else:
+                game.play(move, move.get('reveal'))
+            history.append(game.board)
+            positions.append((game.board, game.is_red_turn, list(history)))
+
+        evaluations = list(self.executor.map(lambda position: self._evaluate(position, budget_ms), positions))
+
+        timeline = []
+        for ply, ((board_str, is_red_turn, _), (score_for_red, depth)) in enumerate(zip(positions, evaluations)):
+            timeline.append({
+                'ply': ply,
+                'currentPlayer': 'red' if is_red_turn else 'black',
+                'score_for_red': score_for_red,
+                'wdl': ai_engine._score_to_wdl(score_for_red, move_count=ply),
+                'depth': depth
+            })
+        marked = []
+        for ply, move in enumerate(game.moves):
+            before, after = timeline[ply], timeline[ply + 1]
+            mover = 'red_win' if before['currentPlayer'] == 'red' else 'black_win'
+            expected = lambda wdl: wdl[mover] + wdl['draw'] / 2
+            loss = round(max(0.0, expected(before['wdl']) - expected(after['wdl'])), 4)
+            mark = next((name for threshold, name in MOVE_MARKS if loss >= threshold), None)
+            marked.append({'ply': ply + 1, 'move': move, 'player': before['currentPlayer'], 'loss': loss, 'mark': mark})
+        return {
+            'success': True,
+            'timeline': timeline,
+            'moves': marked,
+            'blunders': [m['ply'] for m in marked if m['mark'] == 'blunder'],
+            'budget_ms': budget_ms,
+            'analysis_time': round(time.time() - start_time, 3)
+        }
+
+
 # 创建AI实例
 ai_engine = WebJieqiAI()
+sessions = SessionStore()
+search_gate = SearchGate()
+jobs = JobManager(search_gate)
+game_analyzer = GameAnalyzer()
+
+
+def overloaded_response(e):
+    """队列已满: 503, Retry-After给出建议的重试秒数"""
+    response = jsonify({'success': False, 'error': 'Server busy, please retry later', 'retry_after': e.retry_after})
+    response.headers['Retry-After'] = str(e.retry_after)
+    return response, 503
+
+@app.before_request
+def start_timer():
+    g.request_start = time.perf_counter()
+
+@app.after_request
+def record_request(response):
+    """按路由模板(而不是具体的URL)统计请求延迟, 避免sessionId/jobId使标签无限增长"""
+    if 'request_start' in g:
+        endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+        request_latency.observe(time.perf_counter() - g.request_start, endpoint, request.method)
+        request_count.inc(endpoint, request.method, str(response.status_code))
+    return response
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Prometheus文本格式的指标: 请求延迟, 搜索深度/节点数/NPS, 置换表, 排队, 会话和缓存"""
+    lines = []
+    for metric in (request_latency, request_count, search_depth, search_nodes, search_nps, search_latency):
+        lines += metric.render()
+    queue_stats = search_gate.stats()
+    cache_stats = result_cache.stats()
+    lines += gauge('jieqi_search_queue_waiting', 'Searches waiting for an engine instance', queue_stats['waiting'])
+    lines += gauge('jieqi_search_queue_running', 'Searches running', queue_stats['running'])
+    lines += gauge('jieqi_search_queue_size', 'Maximum number of waiting searches', queue_stats['queue_size'])
+    lines += gauge('jieqi_search_rejected_total', 'Searches rejected with 503', queue_stats['rejected'], 'counter')
+    lines += gauge('jieqi_search_degraded_total', 'Searches run with a reduced budget', queue_stats['degraded'], 'counter')
+    lines += gauge('jieqi_active_sessions', 'Server-side game sessions', len(sessions))
+    lines += gauge('jieqi_jobs', 'Search jobs kept in memory', len(jobs))
+    lines += gauge('jieqi_result_cache_size', 'Entries in the result cache', cache_stats['size'])
+    lines += gauge('jieqi_result_cache_hits_total', 'Result cache hits', cache_stats['hits'], 'counter')
+    lines += gauge('jieqi_result_cache_misses_total', 'Result cache misses', cache_stats['misses'], 'counter')
+    lines += gauge('jieqi_result_cache_hit_ratio', 'Result cache hit ratio', cache_stats['hit_ratio'])
+    if AI_AVAILABLE:
+        engine = cppjieqi.engine_stats()
+        lines += gauge('jieqi_engine_searches_total', 'Engine searches (get_ai_move)', engine['searches'], 'counter')
+        lines += gauge('jieqi_engine_evaluations_total', 'Engine time-limited evaluations', engine['evaluations'], 'counter')
+        lines += gauge('jieqi_engine_nodes_total', 'Nodes searched by the engine', engine['nodes'], 'counter')
+        lines += gauge('jieqi_engine_tt_probes_total', 'Transposition table probes', engine['tt_probes'], 'counter')
+        lines += gauge('jieqi_engine_tt_hits_total', 'Transposition table hits', engine['tt_hits'], 'counter')
+        lines += gauge('jieqi_engine_tt_hit_ratio', 'Transposition table hit ratio',
+                       engine['tt_hits'] / engine['tt_probes'] if engine['tt_probes'] else 0)
+        lines += gauge('jieqi_engine_tt_fill_ratio', 'Estimated transposition table fill', engine['tt_fill'])
+        lines += gauge('jieqi_engine_tt_entries', 'Transposition table score entries', engine['tt_entries'])
+        lines += gauge('jieqi_engine_tt_shared', 'Transposition table in shared memory', int(engine['tt_shared']))
+        lines += gauge('jieqi_engine_games', 'Engine game instances', engine['games'])
+    return Response('\n'.join(lines) + '\n', mimetype='text/plain; version=0.0.4')
 
 @app.route('/')
 def index():
@@ -290,21 +1167,31 @@ def ai_recommendation():
                 'error': 'No data provided'
             }), 400
         
-        web_board = data.get('board')
-        current_player = data.get('currentPlayer', 'red')
-        history = data.get('history', [])
-        
-        if not web_board:
+        position, error = request_position(data)
+        if error:
             return jsonify({
                 'success': False,
-                'error': 'Board data required'
-            }), 400
+                'error': error[0]
+            }), error[1]
+        web_board, current_player, history = position
 
         # 从请求中获取depth参数，如果没有则使用默认值
         depth = data.get('depth', 9)
         
-        # 调用 get_ai_recommendation 辅助函数
-        recommendation = ai_engine.get_ai_recommendation(web_board, current_player, history, depth)
+        if not AI_AVAILABLE or ai_engine.game_id is None:
+            return jsonify({'success': False, 'error': 'AI engine not available'}), 500
+
+        # 缓存命中时直接返回, 否则经过准入控制排队使用空闲的引擎实例
+        recommendation = ai_engine.cached_recommendation(web_board, current_player, history, depth)
+        if recommendation is not None:
+            recommendation.update(degraded=False, queue_wait=0.0)
+        else:
+            since = time.time()
+            try:
+                search_gate.enter()
+            except Overloaded as e:
+                return overloaded_response(e)
+            recommendation = search_gate.search(web_board, current_player, history, depth, since)
         
         if recommendation['success']:
             return jsonify(recommendation)
@@ -318,6 +1205,49 @@ def ai_recommendation():
             'error': f'Server error: {str(e)}'
         }), 500
 
+@app.route('/api/jobs', methods=['POST'])
+def submit_job():
+    """提交异步搜索任务, 参数与ai-recommendation相同, 立即返回jobId"""
+    data = request.get_json(silent=True)
+    if not data:
+        return jsonify({'success': False, 'error': 'No data provided'}), 400
+    if not AI_AVAILABLE or ai_engine.game_id is None:
+        return jsonify({'success': False, 'error': 'AI engine not available'}), 500
+    position, error = request_position(data)
+    if error:
+        return jsonify({'success': False, 'error': error[0]}), error[1]
+    web_board, current_player, history = position
+    try:
+        job = jobs.submit(web_board, current_player, history, data.get('depth', 9))
+    except Overloaded as e:
+        return overloaded_response(e)
+    return jsonify({'success': True, 'jobId': job.id, 'status': job.status}), 202
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """查询搜索任务的状态, 已完成的各层进度和最终结果"""
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({'success': False, 'error': 'Job not found'}), 404
+    return jsonify(job.state())
+
+@app.route('/api/jobs/<job_id>', methods=['DELETE'])
+def cancel_job(job_id):
+    """取消搜索任务, 正在运行的搜索会被中断"""
+    job = jobs.cancel(job_id)
+    if job is None:
+        return jsonify({'success': False, 'error': 'Job not found'}), 404
+    return jsonify({'success': True, 'jobId': job.id, 'status': job.status})
+
+@app.route('/api/jobs/<job_id>/events', methods=['GET'])
+def job_events(job_id):
+    """用Server-Sent Events推送搜索进度(progress事件)和最终结果(result事件)"""
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({'success': False, 'error': 'Job not found'}), 404
+    return Response(job.stream(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
 @app.route('/api/position-evaluation', methods=['POST'])
 def position_evaluation():
     """局面评估接口"""
@@ -330,15 +1260,13 @@ def position_evaluation():
                 'error': 'No data provided'
             }), 400
         
-        web_board = data.get('board')
-        current_player = data.get('currentPlayer', 'red')
-        history = data.get('history', [])
-        
-        if not web_board:
+        position, error = request_position(data)
+        if error:
             return jsonify({
                 'success': False,
-                'error': 'Board data required'
-            }), 400
+                'error': error[0]
+            }), error[1]
+        web_board, current_player, history = position
         
         evaluation = ai_engine.evaluate_position(web_board, current_player, history)
         
@@ -351,40 +1279,108 @@ def position_evaluation():
             'error': f'Evaluation error: {str(e)}'
         }), 500
 
+@app.route('/api/analyze', methods=['POST'])
+def analyze():
+    """局面分析接口: 评估, 优势条, WDL胜率, bestMove为true时同时给出推荐走法"""
+    try:
+        data = request.get_json()
+        if not data:
+            return jsonify({'success': False, 'error': 'No data provided'}), 400
+        position, error = request_position(data)
+        if error:
+            return jsonify({'success': False, 'error': error[0]}), error[1]
+        web_board, current_player, history = position
+
+        result = ai_engine.analyze(web_board, current_player, history)
+        if result['success'] and data.get('bestMove', False):
+            # 与ai-recommendation一样经过准入控制: 在实例池上排队, 不占用评估用的self.lock
+            depth = data.get('depth', 9)
+            recommendation = ai_engine.cached_recommendation(web_board, current_player, history, depth)
+            if recommendation is not None:
+                recommendation.update(degraded=False, queue_wait=0.0)
+            else:
+                since = time.time()
+                try:
+                    search_gate.enter()
+                except Overloaded as e:
+                    return overloaded_response(e)
+                recommendation = search_gate.search(web_board, current_player, history, depth, since)
+            result['recommendation'] = recommendation
+            result['cached'] = result['cached'] and recommendation.get('cached', False)
+        return jsonify(result), (200 if result['success'] else 500)
+    except Exception as e:
+        print(f"Analyze error: {e}")
+        return jsonify({'success': False, 'error': f'Analyze error: {str(e)}'}), 500
+
+@app.route('/api/game-analysis', methods=['POST'])
+def game_analysis():
+    """
+    整盘复盘: {'sessionId'}或{'board': 起始局面, 'currentPlayer', 'moves': 走法列表}, 可选budgetMs(每个局面的评估时间).
+    返回每个局面的分数/WDL曲线和每步的失误标记
+    """
+    data = request.get_json(silent=True)
+    if not data:
+        return jsonify({'success': False, 'error': 'No data provided'}), 400
+    if not AI_AVAILABLE or ai_engine.game_id is None:
+        return jsonify({'success': False, 'error': 'AI engine not available'}), 500
+    if data.get('sessionId'):
+        session = sessions.get(data['sessionId'])
+        if session is None:
+            return jsonify({'success': False, 'error': 'Session not found'}), 404
+        start_board, start_red_turn, moves = session.start_board, session.start_red_turn, list(session.moves)
+    else:
+        start_board = board_to_string(data['board']) if data.get('board') else INITIAL_BOARD
+        start_red_turn = data.get('currentPlayer', 'red') == 'red'
+        moves = data.get('moves')
+        if not isinstance(moves, list):
+            return jsonify({'success': False, 'error': 'Move list required'}), 400
+    if len(start_board) != 90:
+        return jsonify({'success': False, 'error': 'Board must be 10x9'}), 400
+    if len(moves) > ANALYSIS_MAX_PLIES:
+        return jsonify({'success': False, 'error': f'At most {ANALYSIS_MAX_PLIES} moves'}), 400
+    try:
+        budget_ms = min(max(int(data.get('budgetMs', ANALYSIS_BUDGET_MS)), 1), ANALYSIS_MAX_BUDGET_MS,
+                        max(1, ANALYSIS_MAX_TOTAL_MS // (len(moves) + 1)))
+    except (ValueError, TypeError):
+        return jsonify({'success': False, 'error': 'budgetMs must be an integer'}), 400
+    since = time.time()
+    try:
+        search_gate.enter()
+    except Overloaded as e:
+        return overloaded_response(e)
+    try:
+        # 复盘期间占用search_gate的一个位置, 与推荐/任务共用并发上限和有界队列
+        with search_gate.slot(since):
+            return jsonify(game_analyzer.analyze(start_board, start_red_turn, moves, budget_ms))
+    except (ValueError, KeyError, TypeError) as e:
+        return jsonify({'success': False, 'error': f'Invalid move: {str(e)}'}), 400
+    except Exception as e:
+        print(f"Game analysis error: {e}")
+        return jsonify({'success': False, 'error': f'Analysis error: {str(e)}'}), 500
+
 @app.route('/api/win-probability', methods=['POST'])
 def win_probability():
     try:
         data = request.get_json()
         if not data:
             return jsonify({'success': False, 'error': 'No data provided'}), 400
-        web_board = data.get('board')
-        current_player = data.get('currentPlayer', 'red')
-        history = data.get('history', [])
-        if not web_board:
-            return jsonify({'success': False, 'error': 'Board data required'}), 400
+        position, error = request_position(data)
+        if error:
+            return jsonify({'success': False, 'error': error[0]}), error[1]
+        web_board, current_player, history = position
         
         if ai_engine.game_id is None:
             return jsonify({'success': False, 'error': 'AI game instance not created'}), 500
 
         # 计算红方视角评分
-        board_str = "".join(["".join(row) for row in web_board])
+        board_str = board_to_string(web_board)
         is_red_turn = current_player == 'red'
 
         # 将历史记录转换为棋盘字符串列表
-        history_board_strings = []
-        if history and isinstance(history[0], dict):
-            for move_obj in history:
-                if 'boardStateAfter' in move_obj:
-                    board_state_2d = move_obj['boardStateAfter']
-                    history_board_strings.append("".join(["".join(row) for row in board_state_2d]))
-        else:
-            history_board_strings = history
+        history_board_strings = history_to_strings(history)
         
-        # Set the board state in the C++ engine first
-        cppjieqi.set_board(ai_engine.game_id, board_str, is_red_turn, history_board_strings)
-        
-        # Now get the evaluation
-        score_relative = cppjieqi.get_board_evaluation(ai_engine.game_id)
+        # Set the board state in the C++ engine and get the evaluation (cached)
+        score_relative, eval_depth = ai_engine.board_score(board_str, is_red_turn, history_board_strings)
         score_for_red = score_relative if is_red_turn else -score_relative
         # 转为 WDL 概率
         wdl = ai_engine._score_to_wdl(score_for_red, move_count=len(history))
@@ -395,18 +1391,73 @@ def win_probability():
             'score_for_red': score_for_red,
             'wdl': wdl,
             'current_player': current_player,
-            'current_player_winrate': round(current_winrate, 4)
+            'current_player_winrate': round(current_winrate, 4),
+            'eval_depth': eval_depth
         })
     except Exception as e:
         print(f"Win probability error: {e}")
         return jsonify({'success': False, 'error': f'WDL error: {str(e)}'}), 500
 
+@app.route('/api/sessions', methods=['POST'])
+def create_session():
+    """创建对局会话, 可选传入起始局面board/currentPlayer"""
+    data = request.get_json(silent=True) or {}
+    board_str, is_red_turn = INITIAL_BOARD, True
+    if data.get('board'):
+        board_str = board_to_string(data['board'])
+        if len(board_str) != 90:
+            return jsonify({'success': False, 'error': 'Board must be 10x9'}), 400
+        is_red_turn = data.get('currentPlayer', 'red') == 'red'
+    session = sessions.create(board_str, is_red_turn)
+    return jsonify(session.state()), 201
+
+@app.route('/api/sessions/<session_id>', methods=['GET'])
+def get_session(session_id):
+    """获取对局会话的当前局面和走法列表"""
+    session = sessions.get(session_id)
+    if session is None:
+        return jsonify({'success': False, 'error': 'Session not found'}), 404
+    return jsonify(session.state(with_moves=True))
+
+@app.route('/api/sessions/<session_id>', methods=['DELETE'])
+def delete_session(session_id):
+    """结束对局会话"""
+    if not sessions.delete(session_id):
+        return jsonify({'success': False, 'error': 'Session not found'}), 404
+    return jsonify({'success': True})
+
+@app.route('/api/sessions/<session_id>/moves', methods=['POST'])
+def post_session_move(session_id):
+    """提交一步棋: {'move': 'e3e4'或{'from': {row, col}, 'to': {row, col}}, 'reveal': 暗子翻开后的棋子}"""
+    session = sessions.get(session_id)
+    if session is None:
+        return jsonify({'success': False, 'error': 'Session not found'}), 404
+    data = request.get_json(silent=True) or {}
+    if 'move' not in data:
+        return jsonify({'success': False, 'error': 'Move required'}), 400
+    try:
+        captured = session.play(data['move'], data.get('reveal'))
+    except (ValueError, KeyError, TypeError) as e:
+        return jsonify({'success': False, 'error': f'Invalid move: {str(e)}'}), 400
+    state = session.state()
+    state['capturedPiece'] = captured
+    return jsonify(state)
+
+@app.route('/api/cache', methods=['DELETE'])
+def clear_cache():
+    """清空结果缓存"""
+    result_cache.clear()
+    return jsonify({'success': True, 'cache': result_cache.stats()})
+
 @app.route('/api/game-status', methods=['GET'])
 def game_status():
     """获取游戏状态"""
     return jsonify({
         'ai_available': AI_AVAILABLE,
         'server_time': time.time(),
+        'active_sessions': len(sessions),
+        'cache': result_cache.stats(),
+        'search_queue': search_gate.stats(),
         'version': '2.0.0-cpp' # 更新版本号
     })
 
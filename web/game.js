@@ -969,10 +969,10 @@ class JieqiGame {
         }
     }
 
-    // 局面评估
+    // 局面评估: /api/analyze一次返回评估和WDL胜率
     async evaluateCurrentPosition() {
         try {
-            const response = await fetch('/api/position-evaluation', {
+            const response = await fetch('/api/analyze', {
                 method: 'POST',
                 headers: {
                     'Content-Type': 'application/json',
@@ -993,36 +993,13 @@ class JieqiGame {
             
             if (evaluation.success) {
                 this.displayPositionEvaluation(evaluation);
-                // 评估成功后，获取胜率/和棋/负概率
-                await this.getWinProbability();
+                this.displayWinProbability(evaluation);
             }
         } catch (error) {
             console.warn('局面评估失败:', error);
         }
     }
 
-    // 调用胜率接口
-    async getWinProbability() {
-        try {
-            const response = await fetch('/api/win-probability', {
-                method: 'POST',
-                headers: { 'Content-Type': 'application/json' },
-                body: JSON.stringify({
-                    board: this.gameState.board,
-                    currentPlayer: this.gameState.currentPlayer,
-                    history: this.gameState.gameHistory
-                })
-            });
-            if (!response.ok) return;
-            const result = await response.json();
-            if (result.success) {
-                this.displayWinProbability(result);
-            }
-        } catch (e) {
-            console.warn('胜率接口调用失败:', e);
-        }
-    }
-
     // 显示WDL胜率
     displayWinProbability(result) {
         let evaluationElement = document.getElementById('positionEvaluation');
@@ -1354,6 +1331,9 @@ class JieqiGame {
     gotoMove(moveIndex) {
         if (moveIndex < -1 || moveIndex >= this.gameState.gameHistory.length) return;
         
+        // 局面改变, 正在进行的AI搜索已经没有意义
+        this.cancelSearchJob();
+
         // 清除各种悬而未决的状态
         if (this.pendingDarkPieceSelection) {
             const existingSelector = document.querySelector('.panel-dark-piece-selector');
@@ -1483,6 +1463,7 @@ class JieqiGame {
         // 新游戏
         document.getElementById('newGame').addEventListener('click', () => {
             this.showModal('确认新游戏', '确定要开始新游戏吗？当前进度将丢失。', () => {
+                this.cancelSearchJob();
                 // 清除可能存在的暗子选择器
                 const existingSelector = document.querySelector('.panel-dark-piece-selector');
                 if (existingSelector) {
@@ -1539,6 +1520,7 @@ class JieqiGame {
 
         // AI开关事件
         document.getElementById('redAiToggle').addEventListener('change', (e) => {
+            this.cancelSearchJob();
             this.aiToggles.red = e.target.checked;
             this.showMessage(`红方AI已${this.aiToggles.red ? '开启' : '关闭'}`, 'info');
             if (this.aiToggles.red && this.gameState.currentPlayer === 'red') {
@@ -1547,6 +1529,7 @@ class JieqiGame {
         });
 
         document.getElementById('blackAiToggle').addEventListener('change', (e) => {
+            this.cancelSearchJob();
             this.aiToggles.black = e.target.checked;
             this.showMessage(`黑方AI已${this.aiToggles.black ? '开启' : '关闭'}`, 'info');
             if (this.aiToggles.black && this.gameState.currentPlayer === 'black') {
@@ -1624,26 +1607,19 @@ class JieqiGame {
             
             const aiDepth = 9; // AI depth is now fixed in the backend
 
-            // 发送棋盘状态到后端AI
-            const response = await fetch('http://localhost:8000/api/ai-recommendation', {
-                method: 'POST',
-                headers: {
-                    'Content-Type': 'application/json',
-                },
-                body: JSON.stringify({
-                    board: this.gameState.board,
-                    currentPlayer: targetPlayer,
-                    history: this.gameState.gameHistory,
-                    depth: aiDepth // 发送深度参数
-                })
+            // 提交异步搜索任务, 搜索过程中显示每一层迭代加深的结果
+            const playerName = targetPlayer === 'red' ? '红方' : '黑方';
+            const recommendation = await this.runSearchJob({
+                board: this.gameState.board,
+                currentPlayer: targetPlayer,
+                history: this.gameState.gameHistory,
+                depth: aiDepth // 发送深度参数
+            }, (progress) => {
+                const score = progress.score_for_red;
+                this.aiRecommendationElement.innerHTML =
+                    `<p>正在获取${playerName}AI推荐... 深度${progress.depth}: ${progress.ucci} (红方评分 ${score > 0 ? '+' : ''}${score})</p>`;
             });
             
-            if (!response.ok) {
-                throw new Error('AI服务暂时不可用');
-            }
-            
-            const recommendation = await response.json();
-            
             // 如果AI开启，则自动执行
             if (this.isAIActive(targetPlayer)) {
                 this.executeAIRecommendation(recommendation);
@@ -1653,6 +1629,10 @@ class JieqiGame {
             }
             
         } catch (error) {
+            if (error.cancelled) {
+                this.aiRecommendationElement.innerHTML = '<p>AI搜索已取消</p>';
+                return;
+            }
             this.aiRecommendationElement.innerHTML = `<p style="color: #e74c3c;">获取AI推荐失败: ${error.message}</p>`;
             this.showMessage('获取AI推荐失败', 'error');
         } finally {
@@ -1660,6 +1640,61 @@ class JieqiGame {
         }
     }
 
+    // 提交搜索任务, 通过SSE接收每层的进度(onProgress)并返回最终结果
+    async runSearchJob(body, onProgress) {
+        const response = await fetch('/api/jobs', {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify(body)
+        });
+        if (response.status === 503) {
+            const retryAfter = response.headers.get('Retry-After');
+            throw new Error(`服务器繁忙, 请${retryAfter ? retryAfter + '秒后' : '稍后'}重试`);
+        }
+        if (!response.ok) {
+            throw new Error('AI服务暂时不可用');
+        }
+        const job = await response.json();
+
+        return new Promise((resolve, reject) => {
+            const events = new EventSource(`/api/jobs/${job.jobId}/events`);
+            const finish = () => {
+                events.close();
+                if (this.searchJob && this.searchJob.id === job.jobId) this.searchJob = null;
+            };
+            this.searchJob = {
+                id: job.jobId,
+                cancel: () => {
+                    finish();
+                    const error = new Error('AI搜索已取消');
+                    error.cancelled = true;
+                    reject(error);
+                }
+            };
+            events.addEventListener('progress', (e) => {
+                if (onProgress) onProgress(JSON.parse(e.data));
+            });
+            events.addEventListener('result', (e) => {
+                finish();
+                resolve(JSON.parse(e.data));
+            });
+            events.onerror = () => {
+                finish();
+                reject(new Error('AI搜索连接中断'));
+            };
+        });
+    }
+
+    // 取消正在进行的AI搜索(悔棋, 新游戏, 切换AI开关时), 后端会中断搜索释放CPU
+    cancelSearchJob() {
+        if (!this.searchJob) return;
+        const job = this.searchJob;
+        this.searchJob = null;
+        job.cancel();
+        this.isAIThinking = false;
+        fetch(`/api/jobs/${job.id}`, { method: 'DELETE' }).catch(() => {});
+    }
+
     async getBothPlayerRecommendations() {
         try {
             // 同时获取红方和黑方的推荐
@@ -1709,7 +1744,7 @@ class JieqiGame {
             return;
         }
 
-        const { move, score, depth, search_time, details } = recommendation;
+        const { move, score, depth, search_time, details, degraded } = recommendation;
         const playerName = playerType === 'red' ? '红方' : '黑方';
         const playerColor = playerType === 'red' ? '#d32f2f' : '#424242';
         
@@ -1725,7 +1760,7 @@ class JieqiGame {
                 ${this.positionToString(move.from)} → ${this.positionToString(move.to)}
             </div>
             <div class="ai-move-detail">
-                <strong>搜索深度:</strong> ${depth}
+                <strong>搜索深度:</strong> ${depth}${degraded ? ' (服务器繁忙, 已降低搜索深度)' : ''}
             </div>
             <div class="ai-move-detail">
                 <strong>搜索时间:</strong> ${search_time}秒